@@ -13,18 +13,29 @@
 # limitations under the License.
 # ==============================================================================
 import numpy as np
-import tensorflow as tf
 import os
 import math
 import random
 import time
+import socket
 import util
-from neurosat import NeuroSATDatapoint
-from neuroquery import NeuroQuery
+from util import NeuroSATDatapoint
+from query_cache import CachedNeuroQuery
+from wire import decode_weights, encode_episodes
+from weight_shm import open_weight_segment
+from uploader import EpisodeUploader
+from solver_pool import SolverPool
+from cnf_cache import CNFCache
+from corpus import Corpus, ProblemList, rss_mb
+from corpus_index import CorpusIndex
+from scheduler import mk_scheduler
 from sat_util import *
-from collections import namedtuple
+from collections import Counter, namedtuple
 
-ActorEpisodeResult = namedtuple('ActorEpisodeResult', ['dimacs', 'cuber', 'brancher', 'esteps', 'datapoints'])
+ActorEpisodeResult = namedtuple('ActorEpisodeResult', ['dimacs', 'cuber', 'brancher', 'esteps', 'datapoints', 'wall_secs', 'n_conflicts', 'truncated'])
+
+INGEST_BACKOFF_SECS     = 0.1
+INGEST_MAX_BACKOFF_SECS = 10.0
 
 def sl_esteps_to_esteps(cfg, sl_esteps):
     return np.power(2, sl_esteps / cfg['log_esteps_scale'])
@@ -36,41 +47,200 @@ def mk_zopts(actor_info):
     return Z3Options(max_conflicts=actor_info['solver']['max_conflicts'],
                      sat_restart_max=actor_info['solver']['sat_restart_max'],
                      lookahead_delta_fraction=actor_info['solver']['lookahead_delta_fraction'])
+
+class EpisodeBudget:
+    # Limits of one episode, any of wall_secs, n_steps (branching steps), n_conflicts (of check and cube) and n_queries
+    # (states sent to the network). Episodes that exceed one are cut off, and marked as truncated.
+    def __init__(self, budget_info, s):
+        self.budget_info     = budget_info
+        self.s               = s
+        self.start           = time.time()
+        self.start_conflicts = s.conflicts()
+        self.n_steps         = 0
+        self.n_queries       = 0
+
+    def n_conflicts(self):
+        # z3 counts conflicts over the lifetime of its sat core, which may be recreated in between
+        conflicts = self.s.conflicts()
+        return conflicts - self.start_conflicts if conflicts >= self.start_conflicts else conflicts
+
+    def exceeded(self):
+        # the first limit exceeded, or None
+        if 'wall_secs' in self.budget_info and time.time() - self.start >= self.budget_info['wall_secs']: return "wall_secs"
+        if 'n_steps' in self.budget_info and self.n_steps >= self.budget_info['n_steps']: return "n_steps"
+        if 'n_conflicts' in self.budget_info and self.n_conflicts() >= self.budget_info['n_conflicts']: return "n_conflicts"
+        if 'n_queries' in self.budget_info and self.n_queries >= self.budget_info['n_queries']: return "n_queries"
+        return None
+
 class Actor:
-    def __init__(self, server, gpu_id, gpu_frac, actor_info):
+    def __init__(self, server, gpu_id, gpu_frac, actor_info, neuroquery=None, corpus=None):
         self.server     = server
         self.cfg        = server.get_config()
         self.cfg['dropout_training'] = False
-        self.neuroquery = NeuroQuery(self.cfg, gpu_id, gpu_frac) if actor_info['tf'] else None
+
+        # a neuroquery passed in is shared with other actors, and keeps its own weights up to date
+        self.shared_neuroquery = neuroquery is not None
+        if self.shared_neuroquery:
+            self.neuroquery = neuroquery
+        else:
+            self.neuroquery = mk_neuroquery(self.cfg, gpu_id, gpu_frac, actor_info) if actor_info['tf'] else None
 
         self.cubers     = [mk_cuber(cuber_info, self.neuroquery) for cuber_info in actor_info['cubers']] if 'cubers' in actor_info else []
         self.branchers  = [mk_brancher(self.cfg, brancher_info, self.neuroquery) for brancher_info in actor_info['branchers']] if 'branchers' in actor_info else []
 
         self.actor_info  = actor_info
-
-        self.sps = []
-        for root, subdirs, files in os.walk(actor_info['dimacs_dir']):
-            for dimacs in files:
-                self.sps.append((dimacs, parse_dimacs(os.path.join(root, dimacs))))
+        self.name        = "%s_%s_%d" % (actor_info['kind'], socket.gethostname(), os.getpid())
+        self.n_episodes  = 0
+
+        # per-episode limits (see EpisodeBudget), with the number of episodes cut off by each
+        self.budget_info = actor_info['budget'] if 'budget' in actor_info else {}
+        self.n_played    = 0
+        self.n_truncated = Counter()
+
+        # worker threads for computing the children of a state, see Z3Solver.to_tf_queries
+        self.n_query_threads = actor_info['solver']['n_query_threads'] if 'n_query_threads' in actor_info['solver'] else 1
+
+        self.weights_version = None
+        self.weight_segment  = open_weight_segment(self.cfg) if self.neuroquery is not None and not self.shared_neuroquery else None
+        self.n_pulls         = 0
+        self.n_weight_pulls  = 0
+        self.pull_bytes      = 0
+        self.pull_secs       = 0.0
+
+        # with an uploader, episodes are sent in the background (see uploader.py)
+        self.uploader = None
+        if 'uploader' in actor_info:
+            self.uploader = EpisodeUploader(server._pyroUri, actor_info['uploader'], compress=self.cfg['compress_episodes'])
+            self.uploader.start()
+
+        # with a solver pool, solvers are reused across episodes on the same problem (see solver_pool.py)
+        pool_mb      = actor_info['solver_pool']['max_mb'] if 'solver_pool' in actor_info else 0
+        self.solvers = SolverPool(mk_zopts(actor_info), max_bytes=pool_mb * (1 << 20))
+
+        # with a corpus, the problems are mapped from a file shared by all actors on the host (see corpus.py),
+        # otherwise they are parsed into this process (through the cnf cache if there is one, see cnf_cache.py)
+        if corpus is not None:
+            self.corpus = Corpus(corpus.path)
+            self.problem_idxs = self.corpus.shard(corpus.shard_idx, corpus.n_shards)
+        else:
+            self.corpus = ProblemList(actor_info['dimacs_dir'], CNFCache(actor_info['cnf_cache']['cache_dir']) if 'cnf_cache' in actor_info else None)
+            self.problem_idxs = list(range(len(self.corpus)))
+        # with a corpus index, the problems too large for this actor are skipped (see corpus_index.py)
+        if 'corpus_index' in actor_info:
+            index     = CorpusIndex(actor_info['corpus_index']['path'])
+            too_large = set([instance['name'] for instance in index.instances(min_cells=actor_info['corpus_index']['max_cells'] + 1)])
+            index.close()
+            self.problem_idxs = [problem_idx for problem_idx in self.problem_idxs if self.corpus.names[problem_idx] not in too_large]
+
+        if not self.problem_idxs:
+            raise Exception("no problems for actor %s in %s" % (self.name, actor_info['dimacs_dir']))
+        print("[ACTOR] %s: %d problems, rss %.1f MB" % (self.name, len(self.problem_idxs), rss_mb()))
+
+        # chooses the problem of each episode (see scheduler.py)
+        self.scheduler = mk_scheduler(actor_info, self.problem_idxs)
 
     def pull_weights(self):
-        if self.neuroquery is not None:
-            self.neuroquery.set_weights(self.server.get_weights())
+        if self.neuroquery is None or self.shared_neuroquery: return
+
+        start = time.time()
+        if self.weight_segment is None or not self.weight_segment.apply_if_newer(self.weights_version, self.set_weights):
+            blob = self.server.get_weights_if_newer(self.weights_version)
+            if blob is not None: self.set_weights(blob)
+        self.pull_secs += time.time() - start
+        self.n_pulls   += 1
+
+    def set_weights(self, blob):
+        self.weights_version, weights = decode_weights(blob)
+        self.n_weight_pulls += 1
+        self.pull_bytes     += len(blob)
+        self.neuroquery.set_weights(weights, version=self.weights_version)
+
+    def collect_stats(self):
+        stats = {}
+        if self.n_pulls > 0:
+            stats["weights/n_pulls"]        = self.n_pulls
+            stats["weights/n_weight_pulls"] = self.n_weight_pulls
+            stats["weights/bytes"]          = self.pull_bytes
+            stats["weights/pull_ms"]        = 1000.0 * self.pull_secs / self.n_pulls
+        if isinstance(self.neuroquery, CachedNeuroQuery):
+            for k, v in self.neuroquery.stats().items():
+                stats["query_cache/%s" % k] = v
+        if self.uploader is not None:
+            for k, v in self.uploader.stats().items():
+                stats["upload/%s" % k] = v
+        for k, v in self.solvers.stats().items():
+            stats["solver_pool/%s" % k] = v
+        for k, v in self.scheduler.stats().items():
+            stats["scheduler/%s" % k] = v
+        if self.budget_info and self.n_played > 0:
+            stats["budget/truncated_frac"] = sum(self.n_truncated.values()) / self.n_played
+            for reason in ["wall_secs", "n_steps", "n_conflicts", "n_queries"]:
+                if reason in self.budget_info:
+                    stats["budget/truncated_%s_frac" % reason] = self.n_truncated[reason] / self.n_played
+        stats["process/rss_mb"] = rss_mb()
+        return stats
+
+    def report_stats(self):
+        # plain floats, so that they go through the marshal serializer
+        stats = { k : float(v) for k, v in self.collect_stats().items() }
+        if stats:
+            self.server.process_actor_stats(self.name, stats)
 
     def loop(self):
         while True:
+            self.n_episodes += 1
+            if 'stats_freq' in self.actor_info and self.n_episodes % self.actor_info['stats_freq'] == 0:
+                self.report_stats()
+
             self.pull_weights()
-            (dimacs, sp) = random.choice(self.sps)
-            result = self.play_episode(dimacs, sp)
-            if result is None: continue
-            pre_datapoints, ps, cuber, brancher = result
-            datapoints, esteps = self.build_datapoints(sp, pre_datapoints, ps)
-            aer = ActorEpisodeResult(dimacs=dimacs, cuber=cuber, brancher=brancher, esteps=esteps, datapoints=datapoints)
-            self.server.process_actor_episode(tuple(aer))
-
-    def build_datapoints(self, sp, pre_datapoints, ps):
+            problem_idx = self.scheduler.next()
+            dimacs      = self.corpus.names[problem_idx]
+            s           = self.solvers.acquire(problem_idx, lambda: self.corpus.problem(problem_idx))
+            sp          = s.sp()
+            budget      = EpisodeBudget(self.budget_info, s)
+            try:
+                result      = self.play_episode(dimacs, sp, s, budget)
+                n_conflicts = budget.n_conflicts()
+            finally:
+                self.solvers.release(problem_idx, s)
+            wall_secs = time.time() - budget.start
+            self.n_played += 1
+            if result is None:
+                self.scheduler.update(problem_idx, wall_secs, n_datapoints=0, esteps=1.0)
+                continue
+            pre_datapoints, ps, cuber, brancher, truncated, leaf_esteps = result
+            if truncated is not None:
+                self.n_truncated[truncated] += 1
+            if leaf_esteps is None:
+                # truncated with nothing to bootstrap from: esteps is only a lower bound, so its targets are not trained on
+                datapoints, esteps = self.build_datapoints(sp, pre_datapoints, ps)
+                datapoints         = []
+            else:
+                datapoints, esteps = self.build_datapoints(sp, pre_datapoints, ps, leaf_esteps)
+            # by the datapoints the episode yields, also for actors that do not train
+            self.scheduler.update(problem_idx, wall_secs, n_datapoints=len(pre_datapoints), esteps=esteps)
+            aer = ActorEpisodeResult(dimacs=dimacs, cuber=cuber, brancher=brancher, esteps=esteps, datapoints=datapoints,
+                                     wall_secs=wall_secs, n_conflicts=n_conflicts, truncated=truncated is not None)
+            self.send_episode(aer)
+
+    def send_episode(self, aer):
+        if self.uploader is not None:
+            if not self.uploader.is_alive():
+                raise Exception("episode uploader thread died")
+            self.uploader.enqueue(aer)
+            return
+
+        # the server rejects episodes while its ingest queue is full
+        backoff_secs = INGEST_BACKOFF_SECS
+        blob         = encode_episodes([aer], compress=self.cfg['compress_episodes'])
+        while not self.server.process_actor_episode(blob):
+            time.sleep(backoff_secs)
+            backoff_secs = min(2 * backoff_secs, INGEST_MAX_BACKOFF_SECS)
+
+    def build_datapoints(self, sp, pre_datapoints, ps, leaf_esteps=1.0):
+        # leaf_esteps : the esteps of the last state, 1 unless the episode was truncated
         datapoints = []
-        esteps     = 1.0
+        esteps     = leaf_esteps
 
         for pre_datapoint, p in reversed(list(zip(pre_datapoints, ps))):
             esteps = 1 + esteps / p
@@ -82,24 +252,46 @@ class Actor:
 
         return (datapoints if self.actor_info['train'] else []), esteps
 
-    def play_episode(self, dimacs, sp):
+    def bootstrap_esteps(self, sp, tfq):
+        # the esteps the network predicts for the state of tfq, to stand in for the rest of a truncated episode
+        # (None without a network, in which case the datapoints of the episode are dropped)
+        if self.neuroquery is None: return None
+        if not tfq.fvars: return 1.0
+        return sl_esteps_to_esteps(self.cfg, self.neuroquery.query(sp.n_vars(), sp.n_clauses(), tfq.LC_idxs)['sl_esteps'])
+
+    def play_episode(self, dimacs, sp, s, budget):
+        # s      : a Z3Solver for sp at the root (in a push scope of its own when it is pooled)
+        # budget : an EpisodeBudget, to be checked before every branching step
+        # returns (pre_datapoints, ps, cuber, brancher, truncated, leaf_esteps), where truncated is the limit
+        # that cut off the episode (or None) and leaf_esteps the esteps of its last state (None if unknown)
         raise Exception("Abstract method")
 
 class LookaheadActor(Actor):
-    def play_episode(self, dimacs, sp):
+    def play_episode(self, dimacs, sp, s, budget):
         pre_datapoints = []
         ps = []
+        truncated   = None
+        leaf_esteps = 1.0
 
-        s    = Z3Solver(sp=sp, opts=mk_zopts(self.actor_info))
         tfq  = s.to_tf_query(assumptions=[])
         assert(tfq.fvars)
         tfqr = self.neuroquery.query(sp.n_vars(), sp.n_clauses(), tfq.LC_idxs)
+        budget.n_queries += 1
 
         while True:
             if tfq is None: break
             assert(tfq is not None)
             assert(tfqr is not None)
 
+            truncated = budget.exceeded()
+            if truncated is not None:
+                # as in AsatActor, a state that propagation decides ends the episode rather than truncating it
+                if s.propagate() == Z3Status.unsat:
+                    truncated = None
+                else:
+                    leaf_esteps = self.bootstrap_esteps(sp, s.to_tf_query(assumptions=[]))
+                break
+
             status = s.check(assumptions=[])
             if status != Z3Status.unknown: break
 
@@ -130,17 +322,25 @@ class LookaheadActor(Actor):
             if self.actor_info['pull_every_step']:
                 self.pull_weights()
 
+            # compute all children in one native call, then query the ones with free vars in a single batch
+            child_tfqs = s.to_tf_queries([[Lit(Var(tfq.fvars[pfvars[pfvar_idx]]), b)] for pfvar_idx in range(n_lookahead) for b in [False, True]],
+                                         n_threads=self.n_query_threads)
+            children   = []
             for pfvar_idx in range(n_lookahead):
-                var = Var(tfq.fvars[pfvars[pfvar_idx]])
-                for b_idx, b in enumerate([False, True]):
-                    tfq_b = s.to_tf_query(assumptions=[Lit(var, b)])
+                for b_idx in range(2):
+                    tfq_b = child_tfqs[2 * pfvar_idx + b_idx]
                     if tfq_b.fvars:
-                        pfvar_tfqs[pfvar_idx][b_idx]   = tfq_b
-                        pfvar_tfqrs[pfvar_idx][b_idx]  = self.neuroquery.query(sp.n_vars(), sp.n_clauses(), tfq_b.LC_idxs)
-                        pfvar_esteps[pfvar_idx][b_idx] = sl_esteps_to_esteps(self.cfg, pfvar_tfqrs[pfvar_idx][b_idx]['sl_esteps'])
+                        pfvar_tfqs[pfvar_idx][b_idx] = tfq_b
+                        children.append((pfvar_idx, b_idx))
                     else:
                         pfvar_esteps[pfvar_idx][b_idx] = 1.0
 
+            child_tfqrs = self.neuroquery.query_batch([(sp.n_vars(), sp.n_clauses(), pfvar_tfqs[pfvar_idx][b_idx].LC_idxs) for (pfvar_idx, b_idx) in children])
+            budget.n_queries += len(children)
+            for (pfvar_idx, b_idx), tfqr_b in zip(children, child_tfqrs):
+                pfvar_tfqrs[pfvar_idx][b_idx]  = tfqr_b
+                pfvar_esteps[pfvar_idx][b_idx] = sl_esteps_to_esteps(self.cfg, tfqr_b['sl_esteps'])
+
             # TODO(dselsam): there is probably a more principled way to do this
             pfvar_prior_ps         = util.npsoftmax(fvar_logits[pfvars] * self.actor_info['prior_tau'])
             pfvar_posterior_ps     = util.npsoftmax(- esteps_to_sl_esteps(self.cfg, np.sum(pfvar_esteps, axis=1)) * self.actor_info['posterior_tau'])
@@ -159,6 +359,7 @@ class LookaheadActor(Actor):
             # we will compute the sl_esteps at the end, using the ps
             pre_datapoints.append((tfq, best_var))
             ps.append(is_ps[is_branch])
+            budget.n_steps += 1
 
             # advance the solver and reuse the query results
             lit = Lit(Var(best_var), is_branch)
@@ -166,19 +367,29 @@ class LookaheadActor(Actor):
             tfq  = pfvar_tfqs[best_pfvar_var][is_branch]
             tfqr = pfvar_tfqrs[best_pfvar_var][is_branch]
 
-        return pre_datapoints, ps, "neuro-look-%d" % self.actor_info['n_lookahead'], "neuro-is"
+        return pre_datapoints, ps, "neuro-look-%d" % self.actor_info['n_lookahead'], "neuro-is", truncated, leaf_esteps
 
 class AsatActor(Actor):
-    def play_episode(self, dimacs, sp):
+    def play_episode(self, dimacs, sp, s, budget):
         cuber    = random.choice(self.cubers)
         brancher = random.choice(self.branchers)
 
-        s        = Z3Solver(sp=sp, opts=mk_zopts(self.actor_info))
-
         pre_datapoints = []
         ps             = []
+        truncated      = None
+        leaf_esteps    = 1.0
+        start_queries  = cuber.n_queries + brancher.n_queries
 
         while True:
+            budget.n_queries = cuber.n_queries + brancher.n_queries - start_queries
+            truncated        = budget.exceeded()
+            if truncated is not None:
+                if s.propagate() == Z3Status.unsat:
+                    truncated = None
+                else:
+                    leaf_esteps = self.bootstrap_esteps(sp, s.to_tf_query(assumptions=[]))
+                break
+
             status = s.check(assumptions=[])
             if status == Z3Status.sat:
                 print("Warning: problem is SAT, not handling this yet")
@@ -206,14 +417,16 @@ class AsatActor(Actor):
 
             pre_datapoints.append((tfq, var.idx()))
             ps.append(plit)
+            budget.n_steps += 1
             s.add(lits=[lit])
 
-        return pre_datapoints, ps, cuber.name, brancher.name
+        return pre_datapoints, ps, cuber.name, brancher.name, truncated, leaf_esteps
 
 
 class RandomCuber:
     def __init__(self, name):
-        self.name = name
+        self.name      = name
+        self.n_queries = 0
 
     def cube(self, s, assumptions):
         # TODO(dselsam): could be faster
@@ -228,6 +441,7 @@ class Z3Cuber:
     def __init__(self, name, lookahead_rewards):
         self.name              = name
         self.lookahead_rewards = lookahead_rewards
+        self.n_queries         = 0
 
     def cube(self, s, assumptions):
         lr           = random.choice(self.lookahead_rewards)
@@ -240,6 +454,8 @@ class NeuroCuber:
         self.name       = name
         self.tau        = tau
         self.neuroquery = neuroquery
+        # states sent to the network, for EpisodeBudget
+        self.n_queries  = 0
 
     def cube(self, s, assumptions):
         tfq = s.to_tf_query(assumptions=assumptions)
@@ -247,6 +463,7 @@ class NeuroCuber:
             return None
         else:
             fvar_logits = self.neuroquery.query(s.sp().n_vars(), s.sp().n_clauses(), tfq.LC_idxs)['logits'][tfq.fvars]
+            self.n_queries += 1
             fvar_ps     = util.npsoftmax(fvar_logits * self.tau)
             fvar_choice = np.random.choice(np.size(fvar_ps), 1, p=fvar_ps)[0]
             return Var(tfq.fvars[fvar_choice])
@@ -255,8 +472,9 @@ class NeuroCuber:
 
 class RandomBrancher:
     def __init__(self, cfg, name):
-        self.cfg  = cfg
-        self.name = name
+        self.cfg       = cfg
+        self.name      = name
+        self.n_queries = 0
 
     def branch(self, s, var):
         return Lit(var, random.random() < 0.5), 0.5
@@ -266,17 +484,18 @@ class NeuroISBrancher:
         self.cfg        = cfg
         self.name       = name
         self.neuroquery = neuroquery
+        # states sent to the network, for EpisodeBudget
+        self.n_queries  = 0
 
     def branch(self, s, var):
-        tfqs   = [s.to_tf_query(assumptions=[Lit(var, b)]) for b in [False, True]]
-        esteps = np.zeros(2)
+        tfqs   = s.to_tf_queries([[Lit(var, b)] for b in [False, True]])
+        esteps = np.ones(2)
 
-        for i in range(2):
-            if not tfqs[i].fvars:
-                esteps[i] = 1.0
-            else:
-                sl_esteps = self.neuroquery.query(s.sp().n_vars(), s.sp().n_clauses(), tfqs[i].LC_idxs)['sl_esteps']
-                esteps[i] = sl_esteps_to_esteps(self.cfg, sl_esteps)
+        children = [i for i in range(2) if tfqs[i].fvars]
+        tfqrs    = self.neuroquery.query_batch([(s.sp().n_vars(), s.sp().n_clauses(), tfqs[i].LC_idxs) for i in children])
+        self.n_queries += len(children)
+        for i, tfqr in zip(children, tfqrs):
+            esteps[i] = sl_esteps_to_esteps(self.cfg, tfqr['sl_esteps'])
 
         is_ps     = esteps / np.sum(esteps)
         is_branch = np.random.choice(np.size(is_ps), 1, p=is_ps)[0]
@@ -285,6 +504,21 @@ class NeuroISBrancher:
 
 ## Makers
 
+def mk_neuroquery(cfg, gpu_id, gpu_frac, actor_info):
+    engine = actor_info['engine'] if 'engine' in actor_info else "tf"
+    if engine == "tf":
+        from neuroquery import NeuroQuery
+        neuroquery = NeuroQuery(cfg, gpu_id, gpu_frac)
+    elif engine == "numpy":
+        from neurosat_np import NumpyNeuroQuery
+        neuroquery = NumpyNeuroQuery(cfg)
+    else:
+        raise Exception("unexpected engine '%s'" % engine)
+
+    if 'query_cache_mb' in actor_info and actor_info['query_cache_mb'] > 0:
+        neuroquery = CachedNeuroQuery(neuroquery, max_bytes=actor_info['query_cache_mb'] * (1 << 20))
+    return neuroquery
+
 def mk_cuber(cuber_info, neuroquery):
     if cuber_info['kind'] == "random":
         return RandomCuber(cuber_info['name'])
@@ -303,10 +537,10 @@ def mk_brancher(cfg, brancher_info, neuroquery):
     else:
         raise Exception("unexpected brancher kind '%s'" % brancher_info['kind'])
 
-def mk_actor(server, gpu_id, gpu_frac, actor_info):
+def mk_actor(server, gpu_id, gpu_frac, actor_info, neuroquery=None, corpus=None):
     if actor_info['kind'] == 'lookahead':
-        return LookaheadActor(server, gpu_id, gpu_frac, actor_info)
+        return LookaheadActor(server, gpu_id, gpu_frac, actor_info, neuroquery, corpus)
     elif actor_info['kind'] == 'asat':
-        return AsatActor(server, gpu_id, gpu_frac, actor_info)
+        return AsatActor(server, gpu_id, gpu_frac, actor_info, neuroquery, corpus)
     else:
         raise Exception("only lookahead actors currently supported")
@@ -0,0 +1,343 @@
+# Copyright 2018 Daniel Selsam. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import numpy as np
+import os
+import random
+import time
+
+def random_query(n_vars, n_clauses, k):
+    # random k-SAT graph in the same format as TFQuery.LC_idxs
+    lits    = np.random.randint(0, n_vars, size=(n_clauses, k)) + n_vars * np.random.randint(0, 2, size=(n_clauses, k))
+    clauses = np.repeat(np.arange(n_clauses), k)
+    return n_vars, n_clauses, np.stack([lits.flatten(), clauses], axis=1).astype(np.int32)
+
+def time_it(fn, n_iters):
+    fn()
+    start = time.time()
+    for _ in range(n_iters):
+        fn()
+    return time.time() - start
+
+def bench_query_batch(cfg, opts):
+    import tensorflow as tf
+    from neuroquery import NeuroQuery
+    nq = NeuroQuery(cfg, gpu_id=None, gpu_frac=1.0)
+    nq.sess.run(tf.global_variables_initializer())
+
+    for batch_size in [1, 4, 16, 64]:
+        queries = [random_query(opts.n_vars, opts.n_clauses, opts.k) for _ in range(batch_size)]
+        seq_secs   = time_it(lambda: [nq.query(*q) for q in queries], opts.n_iters)
+        batch_secs = time_it(lambda: nq.query_batch(queries), opts.n_iters)
+        print("[query_batch] batch_size=%3d  sequential: %8.1f queries/sec  batched: %8.1f queries/sec" %
+              (batch_size, batch_size * opts.n_iters / seq_secs, batch_size * opts.n_iters / batch_secs))
+
+def bench_numpy_engine(cfg, opts):
+    import tensorflow as tf
+    from neuroquery import NeuroQuery
+    from neurosat_np import NumpyNeuroQuery
+    tf_nq = NeuroQuery(cfg, gpu_id=None, gpu_frac=1.0)
+    tf_nq.sess.run(tf.global_variables_initializer())
+
+    # perturb the gains so that the weight reparam is exercised too
+    tvars = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES)
+    names = [tvar.name for tvar in tvars]
+    vals  = [np.random.uniform(0.5, 1.5, size=np.shape(val)).astype(np.float32) if name.endswith("/g:0") else val
+             for name, val in zip(names, tf_nq.sess.run(tvars))]
+    tf_nq.set_weights((names, vals))
+
+    np_nq = NumpyNeuroQuery(cfg)
+    np_nq.set_weights((names, vals))
+
+    for batch_size in [1, 16]:
+        queries = [random_query(opts.n_vars, opts.n_clauses, opts.k) for _ in range(batch_size)]
+        for tf_tfqr, np_tfqr in zip(tf_nq.query_batch(queries), np_nq.query_batch(queries)):
+            np.testing.assert_allclose(np_tfqr['logits'], tf_tfqr['logits'], rtol=1e-4, atol=1e-4)
+            np.testing.assert_allclose(np_tfqr['sl_esteps'], tf_tfqr['sl_esteps'], rtol=1e-4, atol=1e-4)
+
+        tf_secs = time_it(lambda: tf_nq.query_batch(queries), opts.n_iters)
+        np_secs = time_it(lambda: np_nq.query_batch(queries), opts.n_iters)
+        print("[numpy_engine] batch_size=%2d  parity ok  tf: %8.3f ms/call  numpy: %8.3f ms/call" %
+              (batch_size, 1000.0 * tf_secs / opts.n_iters, 1000.0 * np_secs / opts.n_iters))
+
+def random_datapoint(opts):
+    from util import NeuroSATDatapoint
+    n_vars = random.randint(opts.n_vars // 4, opts.n_vars)
+    n_vars, n_clauses, LC_idxs = random_query(n_vars, 4 * n_vars, opts.k)
+    return NeuroSATDatapoint(n_vars=n_vars, n_clauses=n_clauses, LC_idxs=LC_idxs,
+                             target_var=random.randrange(n_vars), target_sl_esteps=random.random())
+
+class ListReplayBuffer:
+    # the original list-of-namedtuples replay buffer, as a baseline
+    def __init__(self, cfg):
+        self.cfg        = cfg
+        self.storage    = [None for _ in range(cfg['replay_buffer_size'])]
+        self.next_index = 0
+        self.full       = False
+
+    def add_datapoints(self, datapoints):
+        for datapoint in datapoints:
+            self.storage[self.next_index] = datapoint
+            self.next_index = (self.next_index + 1) % self.cfg['replay_buffer_size']
+            self.full       = self.full or self.next_index == 0
+
+    def sample_datapoints(self, n_samples):
+        n_to_consider = len(self.storage) if self.full else self.next_index
+        return random.sample(self.storage[:n_to_consider], k=n_samples)
+
+def bench_replay(cfg, opts):
+    import tracemalloc
+    from replay_buffer import ReplayBuffer, CELL_BYTES, ENTRY_BYTES
+    datapoints = [random_datapoint(opts) for _ in range(cfg['replay_buffer_size'])]
+    cfg['replay_buffer_max_bytes'] = sum([np.shape(dp.LC_idxs)[0] * CELL_BYTES + ENTRY_BYTES for dp in datapoints])
+
+    for name, mk_buffer in [("list", ListReplayBuffer), ("arena", ReplayBuffer)]:
+        tracemalloc.start()
+        rb = mk_buffer(cfg)
+        rb.add_datapoints(datapoints)
+        n_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        # datapoints added to the list buffer are shared with the caller, so count them too
+        if name == "list": n_bytes += sum([dp.LC_idxs.nbytes for dp in datapoints])
+
+        for n_samples in [1, 16]:
+            secs = time_it(lambda: rb.sample_datapoints(n_samples), opts.n_iters)
+            print("[replay] %5s  memory: %8.1f MB  sample(%2d): %8.3f ms" % (name, n_bytes / float(1 << 20), n_samples, 1000.0 * secs / opts.n_iters))
+
+def bench_sum_tree(cfg, opts):
+    from replay_buffer import SumTree
+    for n_leaves in [20000, 200000, 2000000]:
+        tree = SumTree(n_leaves)
+        tree.reset(np.random.uniform(size=n_leaves))
+
+        def sample_and_update():
+            masses = np.random.uniform(0, tree.total(), size=cfg['batch_size'])
+            tree.update(tree.find(masses), np.random.uniform(size=cfg['batch_size']))
+
+        secs = time_it(sample_and_update, opts.n_iters)
+        print("[sum_tree] n=%8d  batch_size=%3d  %10.1f samples/sec (with priority updates)" %
+              (n_leaves, cfg['batch_size'], cfg['batch_size'] * opts.n_iters / secs))
+
+def bench_wire(cfg, opts):
+    # the previous path pickled the ActorEpisodeResult tuples and let Pyro zlib-compress the message
+    import pickle
+    import zlib
+    from collections import namedtuple
+    from wire import encode_episodes, decode_episodes
+    Episode = namedtuple('Episode', ['dimacs', 'cuber', 'brancher', 'esteps', 'datapoints', 'wall_secs', 'n_conflicts', 'truncated'])
+
+    for n_episodes in [1, 16]:
+        aers = [Episode(dimacs="bench.cnf", cuber="bench", brancher="bench", esteps=random.random(),
+                        datapoints=[random_datapoint(opts) for _ in range(20)], wall_secs=random.random(), n_conflicts=100, truncated=False) for _ in range(n_episodes)]
+
+        def pickle_zlib(): return zlib.compress(pickle.dumps([tuple(aer) for aer in aers], protocol=pickle.HIGHEST_PROTOCOL))
+        paths = [("pickle+zlib", pickle_zlib, lambda blob: pickle.loads(zlib.decompress(blob))),
+                 ("wire", lambda: encode_episodes(aers, compress=False), decode_episodes),
+                 ("wire+zlib1", lambda: encode_episodes(aers, compress=True), decode_episodes)]
+
+        for name, encode, decode in paths:
+            blob = encode()
+            for (_, _, _, esteps, datapoints, _, _, _), aer in zip(decode(blob), aers):
+                assert esteps == np.float32(aer.esteps) or name == "pickle+zlib"
+                assert all([np.array_equal(dp.LC_idxs, orig.LC_idxs) for dp, orig in zip(datapoints, aer.datapoints)])
+
+            encode_secs = time_it(encode, opts.n_iters)
+            decode_secs = time_it(lambda: decode(blob), opts.n_iters)
+            print("[wire] n_episodes=%2d  %11s  %10d bytes  encode: %8.3f ms  decode: %8.3f ms" %
+                  (n_episodes, name, len(blob), 1000.0 * encode_secs / opts.n_iters, 1000.0 * decode_secs / opts.n_iters))
+
+def bench_child_queries(cfg, opts):
+    # the children of one state, through z3 scopes vs natively with to_tf_queries
+    from sat_util import SATProblem, Z3Solver, Z3Options, Z3Status, Var, Lit
+    n_vars, n_clauses, LC_idxs = random_query(opts.n_vars, opts.n_clauses, opts.k)
+    clauses = [[] for _ in range(n_clauses)]
+    for vidx, c_idx in LC_idxs:
+        clauses[c_idx].append(Lit(Var(vidx % n_vars), vidx >= n_vars))
+
+    s = Z3Solver(SATProblem(n_vars=n_vars, clauses=clauses), Z3Options(max_conflicts=0, sat_restart_max=0))
+    if s.propagate() == Z3Status.unsat: return
+    tfq  = s.to_tf_query()
+    sets = [[Lit(Var(var), b)] for var in tfq.fvars[:16] for b in [False, True]]
+
+    def scoped():
+        for assumptions in sets:
+            s.push()
+            s.add(assumptions)
+            s.propagate()
+            s.to_tf_query()
+            s.pop()
+
+    print("[child_queries] n_children=%d  z3 scopes: %8.3f ms" % (len(sets), 1000.0 * time_it(scoped, opts.n_iters) / opts.n_iters))
+    for n_threads in [1, 2, 4]:
+        secs        = time_it(lambda: s.to_tf_queries(sets, n_threads=n_threads), opts.n_iters)
+        packed_secs = time_it(lambda: s.to_tf_queries_packed(sets, n_threads=n_threads), opts.n_iters)
+        print("[child_queries] n_children=%d  n_threads=%d  to_tf_queries: %8.3f ms  packed: %8.3f ms" %
+              (len(sets), n_threads, 1000.0 * secs / opts.n_iters, 1000.0 * packed_secs / opts.n_iters))
+
+def bench_solver_pool(cfg, opts):
+    # per-episode setup, up to the first query of the root, with a fresh solver per episode vs a pooled one
+    from sat_util import SATProblem, Z3Options, Var, Lit
+    from solver_pool import SolverPool
+    n_vars, n_clauses, LC_idxs = random_query(opts.n_vars, opts.n_clauses, opts.k)
+    clauses = [[] for _ in range(n_clauses)]
+    for vidx, c_idx in LC_idxs:
+        clauses[c_idx].append(Lit(Var(vidx % n_vars), vidx >= n_vars))
+    sp = SATProblem(n_vars=n_vars, clauses=clauses)
+
+    for name, max_bytes in [("fresh", 0), ("pooled", 1 << 30)]:
+        pool = SolverPool(Z3Options(max_conflicts=100, sat_restart_max=5), max_bytes=max_bytes)
+
+        def episode():
+            s = pool.acquire(0, lambda: sp)
+            s.propagate()
+            s.to_tf_query()
+            s.add([Lit(Var(0), False)])
+            pool.release(0, s)
+
+        secs = time_it(episode, opts.n_iters)
+        print("[solver_pool] %6s  setup: %8.3f ms/episode  up to the first query: %8.3f ms/episode" %
+              (name, pool.stats()['setup_ms'], 1000.0 * secs / opts.n_iters))
+
+def bench_cnf_cache(cfg, opts):
+    import gzip
+    import shutil
+    import tempfile
+    from sat_util import parse_dimacs
+    from cnf_cache import CNFCache
+    n_vars, n_clauses, LC_idxs = random_query(opts.n_vars, opts.n_clauses, opts.k)
+    ilits = np.where(LC_idxs[:, 0] < n_vars, LC_idxs[:, 0] + 1, -(LC_idxs[:, 0] - n_vars + 1)).reshape(n_clauses, opts.k)
+    text  = "p cnf %d %d\n" % (n_vars, n_clauses) + "".join(["%s 0\n" % " ".join(map(str, clause)) for clause in ilits])
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp_dir, "bench.cnf")
+        with open(path, 'w') as f: f.write(text)
+        with gzip.open(path + ".gz", 'wt') as f: f.write(text)
+
+        expected = parse_dimacs(path).to_flat()
+        for name, source in [("cnf", path), ("cnf.gz", path + ".gz")]:
+            cache = CNFCache()
+            for ilits_, offsets in [cache.load(source).to_flat(), cache.load(source).to_flat()]:
+                assert np.array_equal(ilits_, expected[0]) and np.array_equal(offsets, expected[1])
+
+            miss_secs = time_it(lambda: [os.remove(cache.cache_path(source)), cache.load(source)], opts.n_iters)
+            hit_secs  = time_it(lambda: cache.load(source), opts.n_iters)
+            print("[cnf_cache] %6s  parse and write: %8.3f ms  cached: %8.3f ms" %
+                  (name, 1000.0 * miss_secs / opts.n_iters, 1000.0 * hit_secs / opts.n_iters))
+
+        print("[cnf_cache]    cnf  parse_dimacs: %8.3f ms" % (1000.0 * time_it(lambda: parse_dimacs(path), opts.n_iters) / opts.n_iters))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+def proc_pss_mb():
+    # proportional set size: shared pages are split between the processes that map them
+    with open("/proc/self/smaps_rollup") as f:
+        return [int(line.split()[1]) for line in f if line.startswith("Pss:")][0] / 1024.0
+
+def corpus_worker(args):
+    from corpus import Corpus, ProblemList, rss_mb
+    kind, source, shard_idx, n_shards = args
+    if kind == "private":
+        problems = ProblemList(source)
+    else:
+        problems = Corpus(source)
+    # an episode on every problem of the shard
+    for problem_idx in problems.shard(shard_idx, n_shards):
+        problems.problem(problem_idx).n_cells()
+    return rss_mb(), proc_pss_mb()
+
+def bench_corpus(cfg, opts):
+    import multiprocessing
+    import shutil
+    import tempfile
+    from corpus import build_corpus
+    n_actors, n_problems = 4, 16
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        dimacs_dir = os.path.join(tmp_dir, "dimacs")
+        os.makedirs(dimacs_dir)
+        for problem_idx in range(n_problems):
+            n_vars, n_clauses, LC_idxs = random_query(opts.n_vars, opts.n_clauses, opts.k)
+            ilits = np.where(LC_idxs[:, 0] < n_vars, LC_idxs[:, 0] + 1, -(LC_idxs[:, 0] - n_vars + 1)).reshape(n_clauses, opts.k)
+            with open(os.path.join(dimacs_dir, "%d.cnf" % problem_idx), 'w') as f:
+                f.write("p cnf %d %d\n" % (n_vars, n_clauses) + "".join(["%s 0\n" % " ".join(map(str, clause)) for clause in ilits]))
+        corpus_path = os.path.join(tmp_dir, "bench.corpus")
+        build_corpus(corpus_path, dimacs_dir)
+
+        ctx = multiprocessing.get_context("fork")
+        for name, jobs in [("private", [("private", dimacs_dir, 0, 1)] * n_actors),
+                           ("shared", [("shared", corpus_path, 0, 1)] * n_actors),
+                           ("sharded", [("shared", corpus_path, actor_idx, n_actors) for actor_idx in range(n_actors)])]:
+            with ctx.Pool(n_actors) as pool:
+                # one job per worker, all alive at once
+                results = pool.map(corpus_worker, jobs, chunksize=1)
+            print("[corpus] %7s  %d actors  mean rss: %8.1f MB  mean pss: %8.1f MB" %
+                  (name, n_actors, np.mean([r[0] for r in results]), np.mean([r[1] for r in results])))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+def bench_scheduler(cfg, opts):
+    # simulated episodes on problems with a spread of costs: a tenth solved at the root, a tenth that stall the actor
+    from scheduler import UniformScheduler, CostAwareScheduler
+    n_problems  = 1000
+    kinds       = np.random.choice(3, size=n_problems, p=[0.1, 0.8, 0.1])
+    secs        = np.where(kinds == 0, 0.05, np.where(kinds == 1, np.random.uniform(0.5, 5.0, size=n_problems), 120.0))
+    datapoints  = np.where(kinds == 0, 0, np.where(kinds == 1, np.random.randint(5, 50, size=n_problems), 100))
+    esteps      = np.where(kinds == 0, 1.0, np.power(2.0, datapoints / 4.0))
+
+    sched_info = { "kind" : "cost", "epsilon" : 0.05, "tau" : 1.0, "half_life_secs" : 3600.0, "max_wait_secs" : 3600.0 }
+    for name, scheduler in [("uniform", UniformScheduler(list(range(n_problems)))),
+                            ("datapoints_per_sec", CostAwareScheduler(list(range(n_problems)), dict(sched_info, objective="datapoints_per_sec"))),
+                            ("esteps_band", CostAwareScheduler(list(range(n_problems)), dict(sched_info, objective="esteps_band", esteps_band=[16, 4096])))]:
+        start = time.time()
+        for _ in range(100 * opts.n_iters):
+            problem_idx = scheduler.next()
+            scheduler.update(problem_idx, secs[problem_idx], datapoints[problem_idx], esteps[problem_idx])
+        sched_ms = 1000.0 * (time.time() - start) / (100 * opts.n_iters)
+        stats    = scheduler.stats()
+        print("[scheduler] %18s  datapoints/sec: %6.2f  effective problems: %6.1f  scheduling: %6.3f ms/episode" %
+              (name, stats['datapoints_per_sec'], stats['effective_problems'] if 'effective_problems' in stats else n_problems, sched_ms))
+
+BENCHMARKS = {
+    "query_batch"  : bench_query_batch,
+    "numpy_engine" : bench_numpy_engine,
+    "replay"       : bench_replay,
+    "sum_tree"     : bench_sum_tree,
+    "wire"         : bench_wire,
+    "child_queries": bench_child_queries,
+    "solver_pool"  : bench_solver_pool,
+    "cnf_cache"    : bench_cnf_cache,
+    "corpus"       : bench_corpus,
+    "scheduler"    : bench_scheduler,
+}
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    parser = argparse.ArgumentParser()
+    parser.add_argument('bench', action='store', type=str, choices=sorted(BENCHMARKS.keys()))
+    parser.add_argument('--config', action='store', dest='config', type=str, default='config/server.json')
+    parser.add_argument('--n_vars', action='store', dest='n_vars', type=int, default=200)
+    parser.add_argument('--n_clauses', action='store', dest='n_clauses', type=int, default=800)
+    parser.add_argument('--k', action='store', dest='k', type=int, default=3)
+    parser.add_argument('--n_iters', action='store', dest='n_iters', type=int, default=50)
+    parser.add_argument('--seed', action='store', dest='seed', type=int, default=0)
+    opts = parser.parse_args()
+
+    with open(opts.config) as f: cfg = json.load(f)
+    cfg['dropout_training'] = False
+
+    np.random.seed(opts.seed)
+    random.seed(opts.seed)
+    BENCHMARKS[opts.bench](cfg, opts)
@@ -13,17 +13,16 @@
 # limitations under the License.
 # ==============================================================================
 import numpy as np
-import tensorflow as tf
 import os
 import math
 import random
 import time
 import util
-from neurosat import NeuroSATDatapoint
-from neuroquery import NeuroQuery
 from sat_util import *
 from collections import namedtuple
 from actor import mk_actor, mk_cuber, mk_brancher
+from inference_server import InferenceServer
+from corpus import build_corpora
 
 if __name__ == "__main__":
     import argparse
@@ -64,17 +63,37 @@ if __name__ == "__main__":
                 return actor_info
         raise Exception("could not find actor info for %d" % idx)
 
-    def launch_actor(actor_idx):
+    def launch_actor(actor_idx, neuroquery, corpus):
         server = construct_proxy_server()
         gpu_id = actor_idx % client_cfg['n_gpus'] if client_cfg['n_gpus'] > 0 else 0
-        actor  = mk_actor(server, gpu_id, gpu_frac, get_actor_info(actor_idx))
+        actor  = mk_actor(server, gpu_id, gpu_frac, get_actor_info(actor_idx), neuroquery, corpus)
         actor.loop()
 
+    # the problems of the actors that opt in are packed once into files that all of them map (see corpus.py)
+    corpora = [None for _ in range(n_actors_total)]
+    if 'corpus' in client_cfg:
+        corpora = build_corpora(client_cfg, [get_actor_info(actor_idx) for actor_idx in range(n_actors_total)])
+
+    inference_server = None
+    if 'inference_server' in client_cfg and client_cfg['inference_server']['enabled']:
+        print("Launching inference server...")
+        cfg = construct_proxy_server().get_config()
+        cfg['dropout_training'] = False
+        inference_server = InferenceServer(cfg, client_cfg['inference_server'], construct_proxy_server, n_actors_total,
+                                           gpu_id=0, gpu_frac=client_cfg['gpu_frac'])
+        inference_server.start()
+
+    def get_neuroquery(actor_idx):
+        if inference_server is not None and get_actor_info(actor_idx)['tf']:
+            return inference_server.mk_proxy(actor_idx)
+        else:
+            return None
+
     import multiprocessing
     actors = []
     print("Launching actors...")
     for actor_idx in range(n_actors_total):
-        actor = multiprocessing.Process(target=launch_actor, args=(actor_idx,))
+        actor = multiprocessing.Process(target=launch_actor, args=(actor_idx, get_neuroquery(actor_idx), corpora[actor_idx]))
         actor.start()
         actors.append(actor)
 
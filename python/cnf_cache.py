@@ -0,0 +1,123 @@
+# Copyright 2018 Daniel Selsam. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import bz2
+import gzip
+import hashlib
+import lzma
+import numpy as np
+import os
+import struct
+import time
+from sat_util import SATProblem, parse_dimacs_buffer
+
+# Pre-parsed problems, written once next to the DIMACS source (or into cache_dir) and memory-mapped on load.
+#   header  : magic, format, source size, source mtime_ns, blake2b of the source, n_vars, n_clauses, n_cells
+#   offsets : int64[n_clauses + 1], into the literals
+#   ilits   : int32[n_cells], the DIMACS literals of all clauses back to back
+# The cache is used if the size and mtime of the source match, and otherwise only if its content hash still does
+# (e.g. after the corpus was copied).
+
+CNF_MAGIC    = b"NCNF"
+CNF_FORMAT   = 1
+CNF_HEADER   = struct.Struct("<4sIqq16sIIq")
+HEADER_SIZE  = 64
+CACHE_SUFFIX = ".ncb"
+
+OPENERS = { ".gz" : gzip.open, ".xz" : lzma.open, ".lzma" : lzma.open, ".bz2" : bz2.open }
+
+def is_cache_file(filename):
+    return filename.endswith(CACHE_SUFFIX)
+
+def read_dimacs_bytes(path):
+    # transparently decompresses .gz, .xz/.lzma and .bz2 files
+    opener = OPENERS.get(os.path.splitext(path)[1], open)
+    with opener(path, 'rb') as f:
+        return f.read()
+
+def source_digest(path):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.digest()
+
+class CNFCache:
+    def __init__(self, cache_dir="none"):
+        self.cache_dir = cache_dir
+        self.n_hits    = 0
+        self.n_misses  = 0
+        self.load_secs = 0.0
+
+        if self.cache_dir != "none" and not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def cache_path(self, path):
+        if self.cache_dir == "none":
+            return path + CACHE_SUFFIX
+        # sources with the same name in different directories get different entries
+        tag = hashlib.blake2b(os.path.abspath(path).encode('utf-8'), digest_size=4).hexdigest()
+        return os.path.join(self.cache_dir, "%s-%s%s" % (os.path.basename(path), tag, CACHE_SUFFIX))
+
+    def _read(self, cache_path, path, st):
+        if not os.path.exists(cache_path) or os.path.getsize(cache_path) < HEADER_SIZE: return None
+        data = np.memmap(cache_path, dtype=np.uint8, mode='r')
+        magic, fmt, size, mtime_ns, digest, n_vars, n_clauses, n_cells = CNF_HEADER.unpack(data[:CNF_HEADER.size].tobytes())
+        if magic != CNF_MAGIC or fmt != CNF_FORMAT: return None
+        if data.size != HEADER_SIZE + 8 * (n_clauses + 1) + 4 * n_cells: return None
+        if (size, mtime_ns) != (st.st_size, st.st_mtime_ns):
+            if digest != source_digest(path): return None
+            # same content, so record the new stat to skip the hash next time
+            try:
+                with open(cache_path, 'r+b') as f:
+                    f.write(CNF_HEADER.pack(magic, fmt, st.st_size, st.st_mtime_ns, digest, n_vars, n_clauses, n_cells))
+            except OSError:
+                pass
+
+        offsets = data[HEADER_SIZE:HEADER_SIZE + 8 * (n_clauses + 1)].view(np.int64)
+        ilits   = data[HEADER_SIZE + 8 * (n_clauses + 1):].view(np.int32)
+        return SATProblem.from_flat(n_vars=n_vars, ilits=ilits, offsets=offsets)
+
+    def _write(self, cache_path, path, st, sp):
+        ilits, offsets = sp.to_flat()
+        header         = CNF_HEADER.pack(CNF_MAGIC, CNF_FORMAT, st.st_size, st.st_mtime_ns, source_digest(path),
+                                         sp.n_vars(), sp.n_clauses(), np.size(ilits))
+        # written under a temporary name, so that other actors never see a partial file
+        tmp_path = "%s.%d.tmp" % (cache_path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            f.write(header.ljust(HEADER_SIZE, b"\0"))
+            f.write(offsets.astype(np.int64).tobytes())
+            f.write(ilits.astype(np.int32).tobytes())
+        os.replace(tmp_path, cache_path)
+
+    def load(self, path):
+        start      = time.time()
+        st         = os.stat(path)
+        cache_path = self.cache_path(path)
+        sp         = self._read(cache_path, path, st)
+        if sp is not None:
+            self.n_hits += 1
+        else:
+            sp = parse_dimacs_buffer(read_dimacs_bytes(path))
+            self.n_misses += 1
+            try:
+                self._write(cache_path, path, st, sp)
+            except OSError as e:
+                print("[CNF_CACHE] failed to write %s (%s)" % (cache_path, e))
+
+        self.load_secs += time.time() - start
+        return sp
+
+    def stats(self):
+        return { "hits" : self.n_hits, "misses" : self.n_misses, "load_secs" : self.load_secs }
@@ -0,0 +1,168 @@
+# Copyright 2018 Daniel Selsam. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import hashlib
+import numpy as np
+import os
+import resource
+import struct
+import zlib
+from collections import namedtuple
+from sat_util import SATProblem, parse_dimacs_buffer
+from cnf_cache import CNFCache, is_cache_file, read_dimacs_bytes
+
+# The problems of a dimacs_dir packed into one read-only file, built once per host by the client and memory-mapped
+# by every actor, so that they all share the same pages instead of each holding a parsed copy of the corpus.
+#   header  : magic, format, n_problems, n_offsets, n_ilits, names bytes
+#   table   : int64[n_problems, 4] of n_vars, n_clauses, start in offsets, start in ilits
+#   offsets : int64[n_offsets], the clause offsets of each problem (as in SATProblem.to_flat)
+#   ilits   : int32[n_ilits], the DIMACS literals of each problem
+#   names   : the newline-separated names of the problems, their paths relative to the dimacs_dir
+# SATProblems are only built from it (with SATProblem.from_flat) when an episode needs one.
+
+CORPUS_MAGIC  = b"NCCP"
+CORPUS_FORMAT = 1
+CORPUS_HEADER = struct.Struct("<4sIqqqq")
+HEADER_SIZE   = 64
+
+CorpusShard = namedtuple('CorpusShard', ['path', 'shard_idx', 'n_shards'])
+
+def rss_mb():
+    # current resident set size, falling back to the peak where /proc is not available
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / float(1 << 20)
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def list_dimacs(dimacs_dir, host_shard=(0, 1)):
+    # (name, path) of the problems under dimacs_dir, keeping those of this host (by a hash of the name), where the
+    # name is the path under dimacs_dir, so that problems with the same file name in different subdirectories differ
+    host_idx, n_hosts = host_shard
+    problems          = []
+    for root, subdirs, files in os.walk(dimacs_dir):
+        for dimacs in sorted(files):
+            if is_cache_file(dimacs) or dimacs.endswith(".tmp"): continue
+            path = os.path.join(root, dimacs)
+            name = os.path.relpath(path, dimacs_dir)
+            if zlib.crc32(name.encode('utf-8')) % n_hosts != host_idx: continue
+            problems.append((name, path))
+    return sorted(problems)
+
+def build_corpus(path, dimacs_dir, cnf_cache=None, host_shard=(0, 1)):
+    names, table, offsets, ilits = [], [], [], []
+    n_offsets, n_ilits           = 0, 0
+    for dimacs, dimacs_path in list_dimacs(dimacs_dir, host_shard):
+        sp = cnf_cache.load(dimacs_path) if cnf_cache is not None else parse_dimacs_buffer(read_dimacs_bytes(dimacs_path))
+        sp_ilits, sp_offsets = sp.to_flat()
+        names.append(dimacs)
+        table.append((sp.n_vars(), sp.n_clauses(), n_offsets, n_ilits))
+        offsets.append(sp_offsets)
+        ilits.append(sp_ilits)
+        n_offsets += np.size(sp_offsets)
+        n_ilits   += np.size(sp_ilits)
+
+    names_blob = "\n".join(names).encode('utf-8')
+    header     = CORPUS_HEADER.pack(CORPUS_MAGIC, CORPUS_FORMAT, len(names), n_offsets, n_ilits, len(names_blob))
+
+    # written under a temporary name, so that actors of another client never map a partial file
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(header.ljust(HEADER_SIZE, b"\0"))
+        f.write(np.array(table, dtype=np.int64).reshape(-1, 4).tobytes())
+        for sp_offsets in offsets: f.write(sp_offsets.astype(np.int64).tobytes())
+        for sp_ilits in ilits: f.write(sp_ilits.astype(np.int32).tobytes())
+        f.write(names_blob)
+    os.replace(tmp_path, path)
+    return len(names)
+
+def build_corpora(client_cfg, actor_infos):
+    # actor_infos : the actor_info of each actor, returns the CorpusShard of each (None for actors that do not opt in)
+    # Actors with the same dimacs_dir share a corpus, and those with "shard" split its problems between them.
+    corpus_cfg = client_cfg['corpus']
+    host_shard = tuple(corpus_cfg['host_shard'])
+    if not os.path.isdir(corpus_cfg['dir']):
+        os.makedirs(corpus_cfg['dir'])
+
+    paths = {}
+    for actor_info in actor_infos:
+        if 'corpus' not in actor_info or actor_info['dimacs_dir'] in paths: continue
+        tag  = hashlib.blake2b(os.path.abspath(actor_info['dimacs_dir']).encode('utf-8'), digest_size=8).hexdigest()
+        path = os.path.join(corpus_cfg['dir'], "%s-%d-of-%d.corpus" % (tag, host_shard[0], host_shard[1]))
+        cnf_cache  = CNFCache(actor_info['cnf_cache']['cache_dir']) if 'cnf_cache' in actor_info else None
+        n_problems = build_corpus(path, actor_info['dimacs_dir'], cnf_cache=cnf_cache, host_shard=host_shard)
+        print("[CORPUS] Packed %d problems of %s into %s" % (n_problems, actor_info['dimacs_dir'], path))
+        paths[actor_info['dimacs_dir']] = path
+
+    sharing = {}
+    for actor_idx, actor_info in enumerate(actor_infos):
+        if 'corpus' in actor_info and actor_info['corpus']['shard']:
+            sharing.setdefault(actor_info['dimacs_dir'], []).append(actor_idx)
+
+    shards = []
+    for actor_idx, actor_info in enumerate(actor_infos):
+        if 'corpus' not in actor_info:
+            shards.append(None)
+        elif actor_info['corpus']['shard']:
+            group = sharing[actor_info['dimacs_dir']]
+            shards.append(CorpusShard(path=paths[actor_info['dimacs_dir']], shard_idx=group.index(actor_idx), n_shards=len(group)))
+        else:
+            shards.append(CorpusShard(path=paths[actor_info['dimacs_dir']], shard_idx=0, n_shards=1))
+    return shards
+
+class Corpus:
+    def __init__(self, path):
+        self.path = path
+        self.data = np.memmap(path, dtype=np.uint8, mode='r')
+        magic, fmt, n_problems, n_offsets, n_ilits, n_names_bytes = CORPUS_HEADER.unpack(self.data[:CORPUS_HEADER.size].tobytes())
+        if magic != CORPUS_MAGIC or fmt != CORPUS_FORMAT:
+            raise Exception("%s is not a corpus file" % path)
+
+        start        = HEADER_SIZE
+        self.table   = self.data[start:start + 32 * n_problems].view(np.int64).reshape(n_problems, 4)
+        start       += 32 * n_problems
+        self.offsets = self.data[start:start + 8 * n_offsets].view(np.int64)
+        start       += 8 * n_offsets
+        self.ilits   = self.data[start:start + 4 * n_ilits].view(np.int32)
+        start       += 4 * n_ilits
+        self.names   = self.data[start:start + n_names_bytes].tobytes().decode('utf-8').split("\n") if n_problems > 0 else []
+
+    def __len__(self):
+        return len(self.names)
+
+    def problem(self, idx):
+        n_vars, n_clauses, offsets_start, ilits_start = self.table[idx]
+        offsets = self.offsets[offsets_start:offsets_start + n_clauses + 1]
+        return SATProblem.from_flat(n_vars=int(n_vars), ilits=self.ilits[ilits_start:ilits_start + offsets[-1]], offsets=offsets)
+
+    def shard(self, shard_idx, n_shards):
+        return list(range(shard_idx, len(self), n_shards))
+
+class ProblemList:
+    # the problems of a dimacs_dir parsed into this process, with the same interface as Corpus
+    def __init__(self, dimacs_dir, cnf_cache=None):
+        self.names = []
+        self.sps   = []
+        for dimacs, path in list_dimacs(dimacs_dir):
+            self.names.append(dimacs)
+            self.sps.append(cnf_cache.load(path) if cnf_cache is not None else parse_dimacs_buffer(read_dimacs_bytes(path)))
+
+    def __len__(self):
+        return len(self.names)
+
+    def problem(self, idx):
+        return self.sps[idx]
+
+    def shard(self, shard_idx, n_shards):
+        return list(range(shard_idx, len(self), n_shards))
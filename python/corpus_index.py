@@ -0,0 +1,188 @@
+# Copyright 2018 Daniel Selsam. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import numpy as np
+import os
+import sqlite3
+import threading
+import time
+from sat_util import parse_dimacs_buffer
+from cnf_cache import read_dimacs_bytes, source_digest
+from corpus import list_dimacs
+
+# Persistent index of the problems of a corpus, keyed by name (as in ActorEpisodeResult.dimacs), which is the path
+# of the problem under its dimacs_dir (see corpus.list_dimacs), so an index covers the problems of one dimacs_dir:
+#   instances : the size of each problem and the content hash of its source, with running sums of the cost of
+#               its episodes (and the number cut off by their budget), so that selection and scheduling are a single query
+#   episodes  : the cost history of the last max_history episodes of each problem reported back by the actors
+# Instances are added by index_dir (or `python corpus_index.py`), episodes by the server as it ingests them.
+# Episodes are committed in batches of up to COMMIT_EPISODES, or COMMIT_SECS apart, and on flush.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS instances (
+    name            TEXT PRIMARY KEY,
+    path            TEXT,
+    digest          BLOB,
+    n_vars          INTEGER,
+    n_clauses       INTEGER,
+    n_cells         INTEGER,
+    max_clause_size INTEGER,
+    n_episodes      INTEGER NOT NULL DEFAULT 0,
+    sum_esteps      REAL NOT NULL DEFAULT 0,
+    sum_wall_secs   REAL NOT NULL DEFAULT 0,
+    sum_conflicts   REAL NOT NULL DEFAULT 0,
+    last_episode    REAL,
+    n_truncated     INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS instances_n_cells ON instances (n_cells);
+CREATE TABLE IF NOT EXISTS episodes (
+    name         TEXT NOT NULL,
+    time         REAL NOT NULL,
+    esteps       REAL NOT NULL,
+    wall_secs    REAL NOT NULL,
+    n_conflicts  INTEGER NOT NULL,
+    n_datapoints INTEGER NOT NULL,
+    truncated    INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS episodes_name ON episodes (name);
+"""
+
+# columns added since the first version of the schema, for indexes created before them
+MIGRATIONS = [("instances", "n_truncated", "INTEGER NOT NULL DEFAULT 0"),
+              ("episodes", "truncated", "INTEGER NOT NULL DEFAULT 0")]
+
+COMMIT_EPISODES = 256
+COMMIT_SECS     = 10.0
+MAX_HISTORY     = 1000
+
+INSTANCE_COLUMNS = ["name", "path", "n_vars", "n_clauses", "n_cells", "max_clause_size", "n_episodes",
+                    "sum_esteps", "sum_wall_secs", "sum_conflicts", "last_episode", "n_truncated"]
+
+class CorpusIndex:
+    def __init__(self, path, max_history=MAX_HISTORY):
+        self.path        = path
+        self.max_history = max_history
+        self.lock        = threading.Lock()
+        self.pending     = set()   # names with episodes recorded since the last commit
+        self.n_pending   = 0
+        self.last_commit = time.time()
+        # shared by the ingest threads of the server, hence the lock instead of a connection per thread
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        for table, column, decl in MIGRATIONS:
+            if column not in [row[1] for row in self.conn.execute("PRAGMA table_info(%s)" % table)]:
+                self.conn.execute("ALTER TABLE %s ADD COLUMN %s %s" % (table, column, decl))
+        self.conn.commit()
+
+    def index_dir(self, dimacs_dir, cnf_cache=None):
+        # adds the problems of dimacs_dir, skipping those whose source has not changed; returns (n indexed, n skipped)
+        n_indexed, n_skipped = 0, 0
+        for dimacs, path in list_dimacs(dimacs_dir):
+            digest = source_digest(path)
+            with self.lock:
+                row = self.conn.execute("SELECT digest FROM instances WHERE name = ?", (dimacs,)).fetchone()
+            if row is not None and row[0] == digest:
+                n_skipped += 1
+                continue
+
+            sp             = cnf_cache.load(path) if cnf_cache is not None else parse_dimacs_buffer(read_dimacs_bytes(path))
+            ilits, offsets = sp.to_flat()
+            max_clause     = int(np.max(np.diff(offsets))) if sp.n_clauses() > 0 else 0
+            with self.lock:
+                self.conn.execute("INSERT OR IGNORE INTO instances (name) VALUES (?)", (dimacs,))
+                self.conn.execute("UPDATE instances SET path = ?, digest = ?, n_vars = ?, n_clauses = ?, n_cells = ?, max_clause_size = ? WHERE name = ?",
+                                  (path, digest, sp.n_vars(), sp.n_clauses(), int(np.size(ilits)), max_clause, dimacs))
+                self.conn.commit()
+            n_indexed += 1
+        return n_indexed, n_skipped
+
+    def _commit(self):
+        # with the lock held: trims the history of the problems with new episodes, and commits them
+        for name in self.pending:
+            self.conn.execute("DELETE FROM episodes WHERE name = ? AND rowid NOT IN "
+                              "(SELECT rowid FROM episodes WHERE name = ? ORDER BY time DESC LIMIT ?)", (name, name, self.max_history))
+        self.conn.commit()
+        self.pending.clear()
+        self.n_pending   = 0
+        self.last_commit = time.time()
+
+    def flush(self):
+        with self.lock:
+            if self.n_pending > 0: self._commit()
+
+    def record_episode(self, name, esteps, wall_secs, n_conflicts, n_datapoints, truncated=False):
+        now = time.time()
+        with self.lock:
+            self.conn.execute("INSERT INTO episodes (name, time, esteps, wall_secs, n_conflicts, n_datapoints, truncated) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                              (name, now, esteps, wall_secs, n_conflicts, n_datapoints, int(truncated)))
+            # episodes of problems that were never indexed still get a row, without sizes
+            self.conn.execute("INSERT OR IGNORE INTO instances (name) VALUES (?)", (name,))
+            self.conn.execute("UPDATE instances SET n_episodes = n_episodes + 1, sum_esteps = sum_esteps + ?, sum_wall_secs = sum_wall_secs + ?, "
+                              "sum_conflicts = sum_conflicts + ?, last_episode = ?, n_truncated = n_truncated + ? WHERE name = ?",
+                              (esteps, wall_secs, n_conflicts, now, int(truncated), name))
+            self.pending.add(name)
+            self.n_pending += 1
+            if self.n_pending >= COMMIT_EPISODES or now - self.last_commit >= COMMIT_SECS:
+                self._commit()
+
+    def instances(self, min_cells=None, max_cells=None):
+        # one dict per instance, with the mean cost of its episodes and the fraction truncated (None before the first one)
+        query, args = "SELECT %s FROM instances WHERE 1" % ", ".join(INSTANCE_COLUMNS), []
+        if min_cells is not None:
+            query += " AND n_cells >= ?"
+            args.append(min_cells)
+        if max_cells is not None:
+            query += " AND n_cells <= ?"
+            args.append(max_cells)
+
+        with self.lock:
+            rows = self.conn.execute(query, args).fetchall()
+
+        instances = []
+        for row in rows:
+            instance = dict(zip(INSTANCE_COLUMNS, row))
+            n        = instance['n_episodes']
+            for cost in ["esteps", "wall_secs", "conflicts"]:
+                total = instance.pop("sum_%s" % cost)
+                instance["mean_%s" % cost] = total / n if n > 0 else None
+            instance['truncation_rate'] = instance['n_truncated'] / n if n > 0 else None
+            instances.append(instance)
+        return instances
+
+    def history(self, name, limit=100):
+        # the most recent episodes of name, newest first, as (time, esteps, wall_secs, n_conflicts, n_datapoints, truncated)
+        with self.lock:
+            return self.conn.execute("SELECT time, esteps, wall_secs, n_conflicts, n_datapoints, truncated FROM episodes WHERE name = ? ORDER BY time DESC LIMIT ?",
+                                     (name, limit)).fetchall()
+
+    def close(self):
+        with self.lock:
+            if self.n_pending > 0: self._commit()
+            self.conn.close()
+
+if __name__ == "__main__":
+    import argparse
+    from cnf_cache import CNFCache
+    parser = argparse.ArgumentParser()
+    parser.add_argument('index', action='store', type=str)
+    parser.add_argument('dimacs_dir', action='store', type=str)
+    parser.add_argument('--cnf_cache', action='store', dest='cnf_cache', type=str, default=None,
+                        help="use the cnf cache, with this cache_dir ('none' for next to the sources)")
+    opts = parser.parse_args()
+
+    index = CorpusIndex(opts.index)
+    start = time.time()
+    n_indexed, n_skipped = index.index_dir(opts.dimacs_dir, CNFCache(opts.cnf_cache) if opts.cnf_cache is not None else None)
+    print("[CORPUS_INDEX] Indexed %d problems (%d unchanged) of %s in %.1f secs" % (n_indexed, n_skipped, opts.dimacs_dir, time.time() - start))
@@ -0,0 +1,142 @@
+# Copyright 2018 Daniel Selsam. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import numpy as np
+import multiprocessing
+import os
+import queue
+import socket
+import time
+from collections import namedtuple
+from wire import decode_weights
+from weight_shm import open_weight_segment
+
+InferenceRequest = namedtuple('InferenceRequest', ['actor_idx', 'request_id', 'queries', 't_sent'])
+
+BATCH_SIZE_BINS = [1, 2, 4, 8, 16, 32, 64, 128, 256, np.inf]
+WAIT_MS_BINS    = [0.0, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0, 64.0, np.inf]
+
+class NeuroQueryProxy:
+    # drop-in replacement for NeuroQuery that forwards queries to a shared InferenceServer
+    def __init__(self, actor_idx, requests, responses):
+        self.actor_idx  = actor_idx
+        self.requests   = requests
+        self.responses  = responses
+        self.request_id = 0
+
+    def query(self, n_vars, n_clauses, LC_idxs):
+        return self.query_batch([(n_vars, n_clauses, LC_idxs)])[0]
+
+    def query_batch(self, queries):
+        if not queries: return []
+        self.request_id += 1
+        self.requests.put(InferenceRequest(actor_idx=self.actor_idx, request_id=self.request_id, queries=queries, t_sent=time.time()))
+        request_id, results = self.responses.get()
+        assert(request_id == self.request_id)
+        return results
+
+    def restore(self, restore_path):
+        raise Exception("NeuroQueryProxy: the inference server owns the weights")
+
+    def set_weights(self, weights, version=None):
+        # the inference server pulls the weights from the learner itself
+        pass
+
+class InferenceServer(multiprocessing.Process):
+    def __init__(self, cfg, server_info, construct_proxy_server, n_actors, gpu_id, gpu_frac):
+        multiprocessing.Process.__init__(self, daemon=True)
+        self.cfg                    = cfg
+        self.server_info            = server_info
+        self.construct_proxy_server = construct_proxy_server
+        self.gpu_id                 = gpu_id
+        self.gpu_frac               = gpu_frac
+
+        self.requests  = multiprocessing.Queue()
+        self.responses = [multiprocessing.Queue() for _ in range(n_actors)]
+
+    def mk_proxy(self, actor_idx):
+        return NeuroQueryProxy(actor_idx, self.requests, self.responses[actor_idx])
+
+    def _collect_batch(self):
+        batch     = [self.requests.get()]
+        n_queries = len(batch[0].queries)
+        deadline  = batch[0].t_sent + self.server_info['max_latency_ms'] / 1000.0
+
+        while n_queries < self.server_info['max_batch_size']:
+            timeout = deadline - time.time()
+            if timeout <= 0: break
+            try:
+                request = self.requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batch.append(request)
+            n_queries += len(request.queries)
+        return batch
+
+    def _pull_weights(self):
+        if time.time() - self.last_pull >= self.server_info['pull_weights_secs']:
+            if self.weight_segment is None or not self.weight_segment.apply_if_newer(self.neuroquery.weights_version, self._set_weights):
+                blob = self.server.get_weights_if_newer(self.neuroquery.weights_version)
+                if blob is not None: self._set_weights(blob)
+            self.last_pull = time.time()
+
+    def _set_weights(self, blob):
+        version, weights = decode_weights(blob)
+        self.neuroquery.set_weights(weights, version=version)
+
+    def _report(self):
+        # the histograms since the last report, logged next to the stats of the actors
+        stats = {}
+        for b, n in zip(BATCH_SIZE_BINS[:-1], self.batch_size_hist):
+            stats["inference/batch_size_ge_%d" % b] = int(n)
+        for b, n in zip(WAIT_MS_BINS[1:], self.wait_ms_hist):
+            stats["inference/wait_ms_lt_%s" % b] = int(n)
+        stats["inference/mean_batch_size"] = self.n_queries / max(np.sum(self.batch_size_hist), 1)
+        self.server.process_actor_stats(self.stats_name, stats)
+        self.n_queries          = 0
+        self.batch_size_hist[:] = 0
+        self.wait_ms_hist[:]    = 0
+
+    def run(self):
+        from neuroquery import NeuroQuery
+        self.neuroquery = NeuroQuery(self.cfg, self.gpu_id, self.gpu_frac)
+        self.server     = self.construct_proxy_server()
+        self.weight_segment = open_weight_segment(self.cfg)
+        self.last_pull  = - np.inf
+
+        self.stats_name      = "inference_server_%s_%d" % (socket.gethostname(), os.getpid())
+        self.n_queries       = 0
+        self.batch_size_hist = np.zeros(len(BATCH_SIZE_BINS) - 1, dtype=np.int64)
+        self.wait_ms_hist    = np.zeros(len(WAIT_MS_BINS) - 1, dtype=np.int64)
+
+        n_batches = 0
+        while True:
+            batch = self._collect_batch()
+            self._pull_weights()
+
+            start   = time.time()
+            results = self.neuroquery.query_batch([q for request in batch for q in request.queries])
+
+            self.n_queries       += len(results)
+            self.batch_size_hist += np.histogram([len(results)], bins=BATCH_SIZE_BINS)[0]
+            self.wait_ms_hist    += np.histogram([1000.0 * (start - request.t_sent) for request in batch], bins=WAIT_MS_BINS)[0]
+
+            offset = 0
+            for request in batch:
+                self.responses[request.actor_idx].put((request.request_id, results[offset:offset+len(request.queries)]))
+                offset += len(request.queries)
+
+            n_batches += 1
+            if n_batches % self.server_info['report_freq'] == 0:
+                self._report()
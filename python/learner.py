@@ -22,8 +22,38 @@ import os
 import time
 import queue
 import copy
-from neurosat import NeuroSAT, NeuroSATArgs
-from tfutil import build_l2_cost, build_learning_rate, build_apply_gradients, summarize_tensor
+from neurosat import NeuroSAT, NeuroSATArgs, NeuroSATSegments
+from util import pack_graphs
+from wire import encode_weights
+from weight_shm import WeightSegmentWriter
+from tfutil import build_l2_cost, build_learning_rate, build_apply_gradients, summarize_tensor, segment_sparse_softmax_cross_entropy_with_logits
+
+def assemble_batch(sample):
+    # batch_size datapoints packed as one disjoint union (see util.pack_graphs), with the dtypes the dataset expects
+    datapoints       = sample.datapoints
+    pg               = pack_graphs([(dp.n_vars, dp.n_clauses, dp.LC_idxs) for dp in datapoints])
+    target_var       = (pg.var_offsets[:-1] + np.array([dp.target_var for dp in datapoints])).astype(np.int32)
+    target_sl_esteps = np.array([dp.target_sl_esteps for dp in datapoints], dtype=np.float32)
+    return (np.int32(pg.n_vars), np.int32(pg.n_clauses), pg.LC_idxs, np.int32(pg.n_graphs), pg.var_graph, pg.clause_graph,
+            target_var, target_sl_esteps, np.asarray(sample.slots, dtype=np.int64), np.asarray(sample.ids, dtype=np.int64), sample.weights)
+
+class LearnerInputThread(threading.Thread):
+    def __init__(self, cfg, replay_buffer, batches):
+        super(LearnerInputThread, self).__init__(daemon=True)
+        self.cfg           = cfg
+        self.replay_buffer = replay_buffer
+        self.batches       = batches
+
+    def run(self):
+        while True:
+            if not self.replay_buffer.wait_until_ready(self.cfg['batch_size'], timeout=0):
+                print("[LEARNER:INPUT] waiting for the replay buffer...")
+                self.replay_buffer.wait_until_ready(self.cfg['batch_size'])
+                print("[LEARNER:INPUT] replay buffer ready")
+
+            sample = self.replay_buffer.sample(n_samples=self.cfg['batch_size'])
+            if sample is not None:
+                self.batches.put(assemble_batch(sample))
 
 class Learner:
     def __init__(self, cfg, replay_buffer, outqueue):
@@ -36,30 +66,44 @@ class Learner:
         tf.set_random_seed(cfg['seed'])
         np.random.seed(cfg['seed'])
 
-        def get_next_datapoint():
+        # batches are sampled and packed by learner_input_threads workers into a queue of up to prefetch batches,
+        # so the generator only pops them, and the time it spends waiting is reported as input stall time
+        self.batches          = queue.Queue(maxsize=cfg['prefetch'])
+        self.stall_lock       = threading.Lock()
+        self.input_stall_secs = 0.0
+        self.input_threads    = [LearnerInputThread(cfg, replay_buffer, self.batches) for _ in range(cfg['learner_input_threads'])]
+        for input_thread in self.input_threads:
+            input_thread.start()
+
+        def get_next_batch():
             while True:
-                datapoints = self.replay_buffer.sample_datapoints(n_samples=1)
-                if not datapoints:
-                    print("[LEARNER:GENERATOR] going to sleep...")
-                    time.sleep(20)
-                    print("[LEARNER:GENERATOR] waking up...")
-                else:
-                    assert(len(datapoints) == 1)
-                    dp = datapoints[0]
-                    yield dp.n_vars, dp.n_clauses, dp.LC_idxs, dp.target_var, dp.target_sl_esteps
+                start = time.time()
+                batch = self.batches.get()
+                with self.stall_lock:
+                    self.input_stall_secs += time.time() - start
+                yield batch
 
         dataset = tf.data.Dataset.from_generator(
-            get_next_datapoint,
-            (tf.int32, tf.int32, tf.int32, tf.int32, tf.float32),
-            (tf.TensorShape([]), tf.TensorShape([]), tf.TensorShape([None, 2]), tf.TensorShape([]), tf.TensorShape([]))
+            get_next_batch,
+            (tf.int32, tf.int32, tf.int32, tf.int32, tf.int32, tf.int32, tf.int32, tf.float32, tf.int64, tf.int64, tf.float32),
+            (tf.TensorShape([]), tf.TensorShape([]), tf.TensorShape([None, 2]),
+             tf.TensorShape([]), tf.TensorShape([None]), tf.TensorShape([None]),
+             tf.TensorShape([None]), tf.TensorShape([None]),
+             tf.TensorShape([None]), tf.TensorShape([None]), tf.TensorShape([None]))
         )
 
-        dataset = dataset.prefetch(cfg['prefetch'])
-        (n_vars, n_clauses, LC_idxs, target_var, target_sl_esteps) = dataset.make_one_shot_iterator().get_next()
-
-        self.neurosat        = NeuroSAT(cfg, NeuroSATArgs(n_vars=n_vars, n_clauses=n_clauses, LC_idxs=LC_idxs))
-        self.p_cost          = cfg['p_cost_scale'] * tf.nn.sparse_softmax_cross_entropy_with_logits(logits=self.neurosat.logits, labels=target_var)
-        self.v_cost          = cfg['v_cost_scale'] * tf.square(self.neurosat.sl_esteps - target_sl_esteps)
+        dataset = dataset.prefetch(1)
+        (n_vars, n_clauses, LC_idxs, n_graphs, var_graph, clause_graph, target_var, target_sl_esteps,
+         self.slots, self.ids, weights) = dataset.make_one_shot_iterator().get_next()
+
+        self.neurosat        = NeuroSAT(cfg, NeuroSATArgs(n_vars=n_vars, n_clauses=n_clauses, LC_idxs=LC_idxs),
+                                        NeuroSATSegments(n_graphs=n_graphs, var_graph=var_graph, clause_graph=clause_graph))
+        self.n_graphs        = n_graphs
+        self.p_costs         = cfg['p_cost_scale'] * segment_sparse_softmax_cross_entropy_with_logits(logits=self.neurosat.logits, labels=target_var,
+                                                                                                       segment_ids=var_graph, n_segments=n_graphs)
+        self.v_costs         = cfg['v_cost_scale'] * tf.square(self.neurosat.sl_esteps - target_sl_esteps)
+        self.p_cost          = tf.reduce_mean(weights * self.p_costs)
+        self.v_cost          = tf.reduce_mean(weights * self.v_costs)
         self.l2_cost         = cfg['l2_cost_scale'] * build_l2_cost()
         self.loss            = self.p_cost + self.v_cost + self.l2_cost
         self.global_step     = tf.get_variable("global_step", shape=[], initializer=tf.zeros_initializer(), trainable=False)
@@ -77,7 +121,8 @@ class Learner:
             self.saver.restore(self.sess, cfg['restore_path'])
 
         self.tvars = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES)
-        self.weights = self._extract_weights()
+        self.weight_segment = None
+        self.weights = self._extract_weights(int(self.sess.run(self.global_step)))
 
     def declare_summaries(self):
         with tf.name_scope('learn'):
@@ -85,7 +130,7 @@ class Learner:
             tf.summary.scalar('p_cost', self.p_cost)
             tf.summary.scalar('v_cost', self.v_cost)
             tf.summary.scalar('l2_cost', self.l2_cost)
-            tf.summary.scalar('target_sl_esteps', self.target_sl_esteps)
+            tf.summary.scalar('target_sl_esteps', tf.reduce_mean(self.target_sl_esteps))
             tf.summary.scalar('learning_rate', self.learning_rate)
 
         self.summary = tf.summary.merge_all()
@@ -93,22 +138,42 @@ class Learner:
     def save_checkpoint(self, iteration):
         self.saver.save(self.sess, os.path.join(self.cfg['checkpoint_dir'], "checkpoint"), global_step=int(iteration))
 
-    def _extract_weights(self):
+    def _extract_weights(self, version):
+        # serialized once here and then served as-is to every caller (see wire.decode_weights)
         names = [tvar.name for tvar in self.tvars]
         vals  = self.sess.run(self.tvars)
-        return names, vals
+
+        if self.cfg['weights_shm_path'] != "none":
+            # uncompressed, so that same-host actors can decode straight from the mapping (see WeightSegmentReader)
+            shm_blob = encode_weights(version, names, vals, compress=False)
+            if self.weight_segment is None:
+                self.weight_segment = WeightSegmentWriter(self.cfg['weights_shm_path'], capacity=2 * len(shm_blob))
+            self.weight_segment.write(version, shm_blob)
+
+        return version, encode_weights(version, names, vals, compress=self.cfg['compress_weights'])
 
     def get_weights(self):
-        return self.weights
+        return self.weights[1]
+
+    def get_weights_if_newer(self, version):
+        # weights are versioned by the iteration they were extracted at
+        weights = self.weights
+        if weights[0] == version: return None
+        else:                     return weights[1]
 
     def step(self):
         start = time.time()
-        _, iteration, summary = self.sess.run([self.apply_gradients, self.global_step, self.summary])
+        _, iteration, summary, n_datapoints, slots, ids, p_costs, v_costs = self.sess.run([self.apply_gradients, self.global_step, self.summary, self.n_graphs,
+                                                                                           self.slots, self.ids, self.p_costs, self.v_costs])
         end   = time.time()
-        self.outqueue.put((iteration, summary, end - start))
+        self.replay_buffer.update_priorities(slots, ids, p_costs + v_costs)
+
+        with self.stall_lock:
+            input_stall_secs, self.input_stall_secs = self.input_stall_secs, 0.0
+        self.outqueue.put((iteration, summary, end - start, n_datapoints, input_stall_secs))
 
         if iteration % self.cfg['update_weights_freq'] == 0:
-            self.weights = self._extract_weights()
+            self.weights = self._extract_weights(int(iteration))
 
         if iteration % self.cfg['checkpoint_freq'] == 0:
             self.save_checkpoint(iteration)
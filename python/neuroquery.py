@@ -16,8 +16,9 @@ import numpy as np
 import tensorflow as tf
 import os
 import queue
-from neurosat import NeuroSAT, NeuroSATArgs
+from neurosat import NeuroSAT, NeuroSATArgs, NeuroSATSegments
 from sat_util import Var, parse_dimacs
+from util import pack_graphs, unpack_graphs
 
 class NeuroQuery:
     def __init__(self, cfg, gpu_id, gpu_frac):
@@ -34,21 +35,41 @@ class NeuroQuery:
         self.n_clauses  = tf.placeholder(dtype=tf.int32, shape=[], name="Placeholder_n_clauses")
         self.LC_idxs    = tf.placeholder(dtype=tf.int32, shape=[None, 2], name="Placeholder_LC_idxs")
 
-        self.neurosat = NeuroSAT(cfg, NeuroSATArgs(n_vars=self.n_vars, n_clauses=self.n_clauses, LC_idxs=self.LC_idxs))
+        self.n_graphs     = tf.placeholder(dtype=tf.int32, shape=[], name="Placeholder_n_graphs")
+        self.var_graph    = tf.placeholder(dtype=tf.int32, shape=[None], name="Placeholder_var_graph")
+        self.clause_graph = tf.placeholder(dtype=tf.int32, shape=[None], name="Placeholder_clause_graph")
+
+        self.neurosat = NeuroSAT(cfg, NeuroSATArgs(n_vars=self.n_vars, n_clauses=self.n_clauses, LC_idxs=self.LC_idxs),
+                                 NeuroSATSegments(n_graphs=self.n_graphs, var_graph=self.var_graph, clause_graph=self.clause_graph))
 
         tvars = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES)
 
         self.assign_placeholders = { tvar.name : tf.placeholder(tvar.value().dtype, tvar.get_shape().as_list(), name="Placeholder_%s" % tvar.name.split(":")[0]) for tvar in tvars }
         self.assign_ops          = [ tvar.assign(self.assign_placeholders[tvar.name]) for tvar in tvars ]
+        self.weights_version     = None
 
     def query(self, n_vars, n_clauses, LC_idxs):
-        logits, sl_esteps = self.sess.run([self.neurosat.logits, self.neurosat.sl_esteps], feed_dict={ self.n_vars:n_vars, self.n_clauses:n_clauses, self.LC_idxs:LC_idxs })
-        return {"logits":logits, "sl_esteps":sl_esteps}
+        return self.query_batch([(n_vars, n_clauses, LC_idxs)])[0]
+
+    def query_batch(self, queries):
+        # queries : list of (n_vars, n_clauses, LC_idxs), answered with a single run of the network
+        if not queries: return []
+        return self.query_packed(pack_graphs(queries))
+
+    def query_packed(self, pg):
+        # pg : PackedGraphs, e.g. from util.packed_graphs_of_batch
+        logits, sl_esteps = self.sess.run([self.neurosat.logits, self.neurosat.sl_esteps],
+                                          feed_dict={ self.n_vars:pg.n_vars, self.n_clauses:pg.n_clauses, self.LC_idxs:pg.LC_idxs,
+                                                      self.n_graphs:pg.n_graphs, self.var_graph:pg.var_graph, self.clause_graph:pg.clause_graph })
+        return unpack_graphs(pg, logits, sl_esteps)
 
     def restore(self, restore_path):
         saver = tf.train.Saver()
         saver.restore(self.sess, restore_path)
+        self.weights_version = None
 
-    def set_weights(self, weights):
+    def set_weights(self, weights, version=None):
+        if version is not None and version == self.weights_version: return
+        self.weights_version = version
         names, values = weights
         self.sess.run(self.assign_ops, feed_dict={ self.assign_placeholders[name] : value for (name, value) in zip(names, values) })
@@ -17,11 +17,10 @@ import numpy as np
 import math
 import random
 from mlp import MLP
-from tfutil import repeat_end, decode_transfer_fn, mean_batch_norm
+from tfutil import repeat_end, decode_transfer_fn, mean_batch_norm, segment_mean, segment_mean_batch_norm
+from util import NeuroSATDatapoint
 from collections import namedtuple
 
-NeuroSATDatapoint = namedtuple('NeuroSATDatapoint',  ['n_vars', 'n_clauses', 'LC_idxs', 'target_var', 'target_sl_esteps'])
-
 class NeuroSATParameters:
     def __init__(self, cfg):
         if cfg['repeat_layers']:
@@ -39,8 +38,11 @@ class NeuroSATParameters:
 
 NeuroSATArgs = namedtuple('NeuroSATArgs', ['n_vars', 'n_clauses', 'LC_idxs'])
 
+# for a disjoint union of graphs (see util.pack_graphs)
+NeuroSATSegments = namedtuple('NeuroSATSegments', ['n_graphs', 'var_graph', 'clause_graph'])
+
 class NeuroSAT(object):
-    def __init__(self, cfg, args):
+    def __init__(self, cfg, args, segments=None):
         n_vars, n_lits, n_clauses = args.n_vars, 2 * args.n_vars, args.n_clauses
 
         L  = tf.ones(shape=[2 * args.n_vars, cfg['d_lit']], dtype=tf.float32)
@@ -54,23 +56,35 @@ class NeuroSAT(object):
 
         def flip(lits): return tf.concat([lits[n_vars:, :], lits[0:n_vars, :]], axis=0)
 
+        if segments is None:
+            def C_batch_norm(clauses): return mean_batch_norm(clauses)
+            def L_batch_norm(lits): return mean_batch_norm(lits)
+        else:
+            lit_graph = tf.concat([segments.var_graph, segments.var_graph], axis=0)
+            def C_batch_norm(clauses): return segment_mean_batch_norm(clauses, segments.clause_graph, segments.n_graphs)
+            def L_batch_norm(lits): return segment_mean_batch_norm(lits, lit_graph, segments.n_graphs)
+
         for t in range(cfg['n_rounds']):
             C_old, L_old = C, L
 
             LC_msgs = tf.sparse_tensor_dense_matmul(LC, L, adjoint_a=True) * cfg['LC_scale']
             C       = params.C_updates[t].forward(tf.concat([C, LC_msgs], axis=-1))
 
-            if cfg['batch_norm']: C = mean_batch_norm(C)
+            if cfg['batch_norm']: C = C_batch_norm(C)
             if cfg['res_layers']: C = C + C_old
 
             CL_msgs = tf.sparse_tensor_dense_matmul(LC, C, adjoint_a=False) * cfg['CL_scale']
             L       = params.L_updates[t].forward(tf.concat([L, CL_msgs, flip(L)], axis=-1))
 
-            if cfg['batch_norm']: L = mean_batch_norm(L)
+            if cfg['batch_norm']: L = L_batch_norm(L)
             if cfg['res_layers']: L = L + L_old
 
         scores = params.L_score.forward(tf.concat([L[0:n_vars, :], L[n_vars:, :]], axis=1))
 
         self.logits           = scores[:, 0]
         self.sl_esteps_scores = scores[:, 1]
-        self.sl_esteps        = tf.reduce_mean(self.sl_esteps_scores, axis=0)
+
+        if segments is None:
+            self.sl_esteps    = tf.reduce_mean(self.sl_esteps_scores, axis=0)
+        else:
+            self.sl_esteps    = segment_mean(self.sl_esteps_scores, segments.var_graph, segments.n_graphs)
@@ -0,0 +1,140 @@
+# Copyright 2018 Daniel Selsam. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import numpy as np
+import scipy.sparse
+from util import pack_graphs, unpack_graphs
+
+# NumPy/SciPy mirror of NeuroSAT (inference only), for actors that do not want a TF session
+
+def decode_np_transfer_fn(transfer_fn):
+    if transfer_fn == "relu": return lambda x: np.maximum(x, 0)
+    elif transfer_fn == "tanh": return np.tanh
+    elif transfer_fn == "sig": return lambda x: 1 / (1 + np.exp(-x))
+    elif transfer_fn == "elu": return lambda x: np.where(x > 0, x, np.expm1(x))
+    else:
+        raise Exception("Unsupported transfer function %s" % transfer_fn)
+
+def l2_normalize(w, axis):
+    # same epsilon as tf.nn.l2_normalize
+    return w / np.sqrt(np.maximum(np.sum(np.square(w), axis=axis, keepdims=True), 1e-12))
+
+class NumpyMLP(object):
+    def __init__(self, cfg, weights, name, nl_at_end=True):
+        self.transfer_fn = decode_np_transfer_fn(cfg['mlp_transfer_fn'])
+        self.nl_at_end   = nl_at_end
+        self.ws          = []
+        self.bs          = []
+
+        i = 0
+        while "%s/%d/b:0" % (name, i) in weights:
+            w = weights["%s/%d/w:0" % (name, i)]
+            if cfg['weight_reparam']:
+                w = l2_normalize(w, axis=0) * weights["%s/%d/g:0" % (name, i)]
+            self.ws.append(w.astype(np.float32))
+            self.bs.append(weights["%s/%d/b:0" % (name, i)].astype(np.float32))
+            i += 1
+
+        if not self.ws:
+            raise Exception("NumpyMLP: no weights found for '%s'" % name)
+
+    def forward(self, z):
+        x = z
+        for i in range(len(self.ws)):
+            x = np.dot(x, self.ws[i]) + self.bs[i]
+            if self.nl_at_end or i + 1 < len(self.ws):
+                x = self.transfer_fn(x)
+        return x
+
+class NumpyNeuroSATParameters:
+    def __init__(self, cfg, weights):
+        if cfg['repeat_layers']:
+            self.L_updates = [NumpyMLP(cfg, weights, name="L_u", nl_at_end=cfg['mlp_update_nl_at_end'])] * cfg['n_rounds']
+            self.C_updates = [NumpyMLP(cfg, weights, name="C_u", nl_at_end=cfg['mlp_update_nl_at_end'])] * cfg['n_rounds']
+        else:
+            self.L_updates = [NumpyMLP(cfg, weights, name=("L_u_%d" % t), nl_at_end=cfg['mlp_update_nl_at_end']) for t in range(cfg['n_rounds'])]
+            self.C_updates = [NumpyMLP(cfg, weights, name=("C_update_%d" % t), nl_at_end=cfg['mlp_update_nl_at_end']) for t in range(cfg['n_rounds'])]
+
+        self.L_score = NumpyMLP(cfg, weights, name="L_score", nl_at_end=False)
+
+def segment_matrix(segment_ids, n_segments):
+    # (n_segments, n) with rows that average each segment
+    n      = np.size(segment_ids)
+    counts = np.maximum(np.bincount(segment_ids, minlength=n_segments), 1).astype(np.float32)
+    return scipy.sparse.csr_matrix((1.0 / counts[segment_ids], (segment_ids, np.arange(n))), shape=(n_segments, n), dtype=np.float32)
+
+def numpy_neurosat(cfg, params, pg):
+    # pg : util.PackedGraphs, returns (logits, sl_esteps) just like NeuroSAT with segments
+    n_vars, n_lits, n_clauses = pg.n_vars, 2 * pg.n_vars, pg.n_clauses
+
+    L  = np.ones(shape=[n_lits, cfg['d_lit']], dtype=np.float32)
+    C  = np.ones(shape=[n_clauses, cfg['d_clause']], dtype=np.float32)
+
+    LC  = scipy.sparse.csr_matrix((np.ones(np.shape(pg.LC_idxs)[0], dtype=np.float32), (pg.LC_idxs[:, 0], pg.LC_idxs[:, 1])),
+                                  shape=(n_lits, n_clauses), dtype=np.float32)
+    CL  = LC.transpose().tocsr()
+
+    lit_graph = np.concatenate([pg.var_graph, pg.var_graph])
+    V_mean    = segment_matrix(pg.var_graph, pg.n_graphs)
+    L_mean    = segment_matrix(lit_graph, pg.n_graphs)
+    C_mean    = segment_matrix(pg.clause_graph, pg.n_graphs)
+
+    def flip(lits): return np.concatenate([lits[n_vars:, :], lits[0:n_vars, :]], axis=0)
+
+    for t in range(cfg['n_rounds']):
+        C_old, L_old = C, L
+
+        LC_msgs = (CL.dot(L) * cfg['LC_scale']).astype(np.float32)
+        C       = params.C_updates[t].forward(np.concatenate([C, LC_msgs], axis=-1))
+
+        if cfg['batch_norm']: C = C - C_mean.dot(C)[pg.clause_graph]
+        if cfg['res_layers']: C = C + C_old
+
+        CL_msgs = (LC.dot(C) * cfg['CL_scale']).astype(np.float32)
+        L       = params.L_updates[t].forward(np.concatenate([L, CL_msgs, flip(L)], axis=-1))
+
+        if cfg['batch_norm']: L = L - L_mean.dot(L)[lit_graph]
+        if cfg['res_layers']: L = L + L_old
+
+    scores = params.L_score.forward(np.concatenate([L[0:n_vars, :], L[n_vars:, :]], axis=1))
+    return scores[:, 0], V_mean.dot(scores[:, 1])
+
+class NumpyNeuroQuery:
+    def __init__(self, cfg):
+        self.cfg             = cfg
+        self.params          = None
+        self.weights_version = None
+
+    def query(self, n_vars, n_clauses, LC_idxs):
+        return self.query_batch([(n_vars, n_clauses, LC_idxs)])[0]
+
+    def query_batch(self, queries):
+        if not queries: return []
+        return self.query_packed(pack_graphs(queries))
+
+    def query_packed(self, pg):
+        if self.params is None:
+            raise Exception("NumpyNeuroQuery: query before set_weights")
+        logits, sl_esteps = numpy_neurosat(self.cfg, self.params, pg)
+        return unpack_graphs(pg, logits, sl_esteps)
+
+    def restore(self, restore_path):
+        raise Exception("NumpyNeuroQuery: restore not supported, use set_weights")
+
+    def set_weights(self, weights, version=None):
+        if version is not None and version == self.weights_version: return
+        self.weights_version = version
+        names, values = weights
+        # copied, since the values may be views into a shared weight segment (see weight_shm.py)
+        self.params = NumpyNeuroSATParameters(self.cfg, { name : np.array(value) for (name, value) in zip(names, values) })
@@ -0,0 +1,93 @@
+# Copyright 2018 Daniel Selsam. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import collections
+from util import lc_digest
+
+# rough per-entry cost of the key, the dict and the bookkeeping
+ENTRY_OVERHEAD_BYTES = 256
+
+class CachedNeuroQuery:
+    # LRU memoisation of query results in front of any NeuroQuery-compatible engine
+    def __init__(self, neuroquery, max_bytes):
+        self.neuroquery  = neuroquery
+        self.max_bytes   = max_bytes
+        self.version     = 0
+        self.weights_version = None
+        self.entries     = collections.OrderedDict()
+        self.n_bytes     = 0
+        self.n_hits      = 0
+        self.n_misses    = 0
+        self.n_evictions = 0
+
+    def _key(self, n_vars, n_clauses, LC_idxs):
+        # (n_vars, n_clauses, LC_idxs) determine the output, so they double as the problem id
+        return (self.version, n_vars, n_clauses, lc_digest(LC_idxs))
+
+    def _insert(self, key, tfqr):
+        tfqr    = {"logits":tfqr['logits'].copy(), "sl_esteps":tfqr['sl_esteps']}
+        n_bytes = tfqr['logits'].nbytes + ENTRY_OVERHEAD_BYTES
+        if n_bytes > self.max_bytes: return
+
+        self.entries[key] = (tfqr, n_bytes)
+        self.n_bytes     += n_bytes
+        while self.n_bytes > self.max_bytes:
+            _, (_, evicted_bytes) = self.entries.popitem(last=False)
+            self.n_bytes     -= evicted_bytes
+            self.n_evictions += 1
+
+    def query(self, n_vars, n_clauses, LC_idxs):
+        return self.query_batch([(n_vars, n_clauses, LC_idxs)])[0]
+
+    def query_batch(self, queries):
+        keys    = [self._key(*q) for q in queries]
+        results = [None for _ in queries]
+        misses  = collections.OrderedDict()
+
+        for i, key in enumerate(keys):
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                results[i] = self.entries[key][0]
+                self.n_hits += 1
+            else:
+                misses.setdefault(key, []).append(i)
+                self.n_misses += 1
+
+        tfqrs = self.neuroquery.query_batch([queries[idxs[0]] for idxs in misses.values()])
+        for (key, idxs), tfqr in zip(misses.items(), tfqrs):
+            for i in idxs:
+                results[i] = tfqr
+            self._insert(key, tfqr)
+
+        return results
+
+    def invalidate(self):
+        self.version += 1
+        self.entries.clear()
+        self.n_bytes  = 0
+
+    def restore(self, restore_path):
+        self.neuroquery.restore(restore_path)
+        self.weights_version = None
+        self.invalidate()
+
+    def set_weights(self, weights, version=None):
+        if version is not None and version == self.weights_version: return
+        self.weights_version = version
+        self.neuroquery.set_weights(weights, version=version)
+        self.invalidate()
+
+    def stats(self):
+        return { "hits" : self.n_hits, "misses" : self.n_misses, "evictions" : self.n_evictions,
+                 "entries" : len(self.entries), "bytes" : self.n_bytes }
@@ -12,36 +12,315 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 # ==============================================================================
+import numpy as np
 import random
+import threading
 import time
+from util import NeuroSATDatapoint, datapoint_fingerprint
+from replay_store import ReplayStore, replay_dir_of_checkpoint
+from collections import namedtuple
+
+# bytes per LC_idxs row, and per datapoint for the columns
+CELL_BYTES  = 8
+ENTRY_BYTES = 32
+
+# a persisted header leaves out 1/SYNC_AHEAD_FRACTION of the oldest datapoints (see ReplayBuffer._sync)
+SYNC_AHEAD_FRACTION = 64
+
+ReplaySample = namedtuple('ReplaySample', ['datapoints', 'slots', 'ids', 'weights'])
+
+class SumTree:
+    # complete binary tree over the leaves where every node holds the sum of its children,
+    # for O(log n) sampling proportional to the leaves and O(log n) updates
+    def __init__(self, capacity):
+        self.n_leaves = 1
+        while self.n_leaves < capacity:
+            self.n_leaves *= 2
+        self.tree = np.zeros(2 * self.n_leaves, dtype=np.float64)
+
+    def total(self):
+        return self.tree[1]
+
+    def get(self, idxs):
+        return self.tree[np.asarray(idxs, dtype=np.int64) + self.n_leaves]
+
+    def update(self, idxs, values):
+        nodes = np.asarray(idxs, dtype=np.int64) + self.n_leaves
+        if np.size(nodes) == 0: return
+        self.tree[nodes] = values
+        while nodes[0] > 1:
+            nodes = np.unique(nodes // 2)
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+
+    def reset(self, values):
+        self.tree[:] = 0.0
+        self.tree[self.n_leaves:self.n_leaves+len(values)] = values
+        n = self.n_leaves // 2
+        while n >= 1:
+            self.tree[n:2*n] = self.tree[2*n:4*n:2] + self.tree[2*n+1:4*n:2]
+            n //= 2
+
+    def find(self, masses):
+        # leaf for each mass in [0, total), never descending into an empty subtree
+        masses = np.array(masses, dtype=np.float64)
+        nodes  = np.ones(np.size(masses), dtype=np.int64)
+        while np.size(nodes) > 0 and nodes[0] < self.n_leaves:
+            left    = 2 * nodes
+            right   = (masses >= self.tree[left]) & (self.tree[left + 1] > 0)
+            masses -= np.where(right, self.tree[left], 0.0)
+            nodes   = left + right
+        return nodes - self.n_leaves
 
 class ReplayBuffer:
+    # Ring buffer of datapoints stored column-wise, with the LC_idxs rows of all datapoints in one int32 arena.
+    # Datapoints occupy consecutive slots (oldest at self.head) and consecutive arena rows, wrapping around both;
+    # adding a datapoint evicts the oldest ones until there is a free slot, enough contiguous free arena rows,
+    # and the bytes held stay within replay_buffer_max_bytes.
+    # Every datapoint takes at least one arena row, so the arena has wrapped iff the newest offset is below the oldest.
     def __init__(self, cfg):
-        self.cfg = cfg
-        self.storage           = [None for _ in range(cfg['replay_buffer_size'])]
-        self.next_index        = 0
-        self.eviction_started  = False
-
-    def _increment_index(self):
-        self.next_index = (self.next_index + 1) % self.cfg['replay_buffer_size']
-        if self.next_index == 0 and not self.eviction_started:
+        self.cfg              = cfg
+        self.capacity         = cfg['replay_buffer_size']
+        self.max_bytes        = cfg['replay_buffer_max_bytes']
+        arena_rows            = self.max_bytes // CELL_BYTES
+
+        # with replay_buffer_persist, the columns are memory-mapped files under <run_dir>/replay (see replay_store.py)
+        self.store            = None
+        if cfg['replay_buffer_persist']:
+            restore_from      = replay_dir_of_checkpoint(cfg['restore_path']) if cfg['restore_path'] != "none" else None
+            self.store        = ReplayStore(cfg['replay_dir'], self.capacity, arena_rows, restore_from=restore_from)
+        mk_column             = self.store.column if self.store is not None else (lambda name, shape, dtype: np.zeros(shape, dtype=dtype))
+
+        self.arena            = mk_column("arena", (arena_rows, 2), np.int32)
+        self.offsets          = mk_column("offsets", (self.capacity,), np.int64)
+        self.lengths          = mk_column("lengths", (self.capacity,), np.int64)
+        self.n_vars           = mk_column("n_vars", (self.capacity,), np.int32)
+        self.n_clauses        = mk_column("n_clauses", (self.capacity,), np.int32)
+        self.target_var       = mk_column("target_var", (self.capacity,), np.int32)
+        self.target_sl_esteps = mk_column("target_sl_esteps", (self.capacity,), np.float32)
+        self.ids              = mk_column("ids", (self.capacity,), np.int64)
+
+        # with replay_dedup "merge" a duplicate updates the running mean of target_sl_esteps of the live datapoint,
+        # with "drop" it is discarded, and with "none" datapoints are not fingerprinted at all
+        self.dedup            = cfg['replay_dedup']
+        if self.dedup not in ["none", "drop", "merge"]:
+            raise Exception("ReplayBuffer: unknown replay_dedup '%s'" % self.dedup)
+        self.fingerprints     = mk_column("fingerprints", (self.capacity, 2), np.uint64)
+        self.n_merged         = mk_column("n_merged", (self.capacity,), np.int32)
+        self.slot_of          = {}
+        self.n_offered        = 0
+        self.n_duplicates     = 0
+
+        # priorities are stored as (|cost| + eps) ** alpha, and new datapoints get the largest priority seen so far
+        self.priority_info    = cfg['replay_priority']
+        self.prioritized      = self.priority_info['kind'] == "prioritized"
+        if self.prioritized:
+            self.priorities   = SumTree(self.capacity)
+            self.max_priority = 1.0
+
+        self.head             = 0
+        self.count            = 0
+        self.n_bytes          = 0
+        self.n_added          = 0
+        self.eviction_started = False
+        self.lock             = threading.Lock()
+        self.ready            = threading.Condition(self.lock)
+
+        # ids are consecutive, so the stored header covers exactly the ids in [synced_min_id, n_added at the last sync)
+        self.n_unsynced       = 0
+        self.synced_min_id    = 0
+        self.needs_sync       = False
+        if self.store is not None and self.store.header is not None:
+            self._reopen(self.store.header)
+
+    def _live_slots(self):
+        return (self.head + np.arange(self.count)) % self.capacity
+
+    def _reopen(self, header):
+        self.head             = header['head']
+        self.count            = header['count']
+        self.n_added          = header['n_added']
+        self.eviction_started = header['eviction_started']
+        self.synced_min_id    = self.n_added - self.count
+
+        slots                 = self._live_slots()
+        self.n_bytes          = int(np.sum(self.lengths[slots])) * CELL_BYTES + self.count * ENTRY_BYTES
+        if self.dedup != "none":
+            self.slot_of      = { self.fingerprints[slot].tobytes() : slot for slot in slots }
+        if self.prioritized:
+            self.priorities.update(slots, np.full(self.count, self.max_priority ** self.priority_info['alpha']))
+        print("[REPLAY_BUFFER] Reopened %d datapoints (%d bytes) from %s" % (self.count, self.n_bytes, self.store.path))
+
+    def _sync(self):
+        # Once eviction has started, the header leaves out the oldest 1/SYNC_AHEAD_FRACTION of the datapoints,
+        # so that the next evictions can reuse their slots and rows without syncing again.
+        n_ahead = min(self.count, max(1, self.count // SYNC_AHEAD_FRACTION)) if self.eviction_started else 0
+        self.store.write_header(head=(self.head + n_ahead) % self.capacity, count=self.count - n_ahead,
+                                n_added=self.n_added, eviction_started=self.eviction_started)
+        self.synced_min_id = self.n_added - self.count + n_ahead
+        self.n_unsynced    = 0
+        self.needs_sync    = False
+
+    def _evict_oldest(self):
+        if not self.eviction_started:
             self.eviction_started = True
             print("[REPLAY_BUFFER] Starting eviction...")
 
-    def add_datapoints(self, datapoints):
+        if self.prioritized:
+            self.priorities.update([self.head], [0.0])
+
+        if self.store is not None and self.ids[self.head] >= self.synced_min_id:
+            # its slot and rows are about to be reused, but the stored header still counts it as live
+            self.needs_sync = True
+
+        if self.dedup != "none":
+            self.slot_of.pop(self.fingerprints[self.head].tobytes(), None)
+
+        self.n_bytes -= self.lengths[self.head] * CELL_BYTES + ENTRY_BYTES
+        self.head     = (self.head + 1) % self.capacity
+        self.count   -= 1
+
+    def _allocate(self, n_rows):
+        # live rows are [arena head, arena tail) if not wrapped, and [arena head, end) + [0, arena tail) if wrapped
+        while True:
+            if self.count == 0:
+                return 0
+
+            newest     = (self.head + self.count - 1) % self.capacity
+            arena_head = self.offsets[self.head]
+            arena_tail = self.offsets[newest] + max(self.lengths[newest], 1)
+            if self.offsets[newest] >= arena_head:
+                if arena_tail + n_rows <= len(self.arena):
+                    return arena_tail
+                elif n_rows <= arena_head:
+                    return 0
+            elif arena_tail + n_rows <= arena_head:
+                return arena_tail
+
+            self._evict_oldest()
+
+    def _merge_datapoint(self, slot, datapoint):
+        n_merged                     = self.n_merged[slot]
+        self.target_sl_esteps[slot] += (datapoint.target_sl_esteps - self.target_sl_esteps[slot]) / (n_merged + 1)
+        self.n_merged[slot]          = n_merged + 1
+
+    def _add_datapoint(self, datapoint, fingerprint):
+        self.n_offered += 1
+        if fingerprint is not None and fingerprint in self.slot_of:
+            self.n_duplicates += 1
+            if self.dedup == "merge":
+                self._merge_datapoint(self.slot_of[fingerprint], datapoint)
+            return
+
+        n_cells = np.shape(datapoint.LC_idxs)[0]
+        n_bytes = n_cells * CELL_BYTES + ENTRY_BYTES
+        if n_bytes > self.max_bytes:
+            print("[REPLAY_BUFFER] Dropping datapoint of %d bytes, larger than the budget" % n_bytes)
+            return
+
+        while self.count == self.capacity or self.n_bytes + n_bytes > self.max_bytes:
+            self._evict_oldest()
+
+        offset = self._allocate(max(n_cells, 1))
+        slot   = (self.head + self.count) % self.capacity
+
+        if self.needs_sync:
+            self._sync()
+
+        self.arena[offset:offset+n_cells]  = datapoint.LC_idxs
+        self.offsets[slot]                 = offset
+        self.lengths[slot]                 = n_cells
+        self.n_vars[slot]                  = datapoint.n_vars
+        self.n_clauses[slot]               = datapoint.n_clauses
+        self.target_var[slot]              = datapoint.target_var
+        self.target_sl_esteps[slot]        = datapoint.target_sl_esteps
+        self.ids[slot]                     = self.n_added
+        self.n_merged[slot]                = 1
+
+        if fingerprint is not None:
+            self.fingerprints[slot] = np.frombuffer(fingerprint, dtype=np.uint64)
+            self.slot_of[fingerprint] = slot
+
+        if self.prioritized:
+            self.priorities.update([slot], [self.max_priority ** self.priority_info['alpha']])
+
+        self.n_bytes    += n_bytes
+        self.n_added    += 1
+        self.count      += 1
+        self.n_unsynced += 1
+
+    def _get_datapoint(self, slot):
+        offset = self.offsets[slot]
+        return NeuroSATDatapoint(n_vars=int(self.n_vars[slot]),
+                                 n_clauses=int(self.n_clauses[slot]),
+                                 LC_idxs=self.arena[offset:offset+self.lengths[slot]].copy(),
+                                 target_var=int(self.target_var[slot]),
+                                 target_sl_esteps=float(self.target_sl_esteps[slot]))
+
+    def add_datapoints(self, datapoints, dimacs=""):
         if not datapoints: return
 
-        for datapoint in datapoints:
-            self.storage[self.next_index] = datapoint
-            self._increment_index()
+        # hashing is the expensive part, so it happens outside of the lock
+        fingerprints = [datapoint_fingerprint(dimacs, datapoint) if self.dedup != "none" else None for datapoint in datapoints]
+        with self.lock:
+            for datapoint, fingerprint in zip(datapoints, fingerprints):
+                self._add_datapoint(datapoint, fingerprint)
+
+            if self.store is not None and self.n_unsynced >= self.cfg['replay_buffer_sync_freq']:
+                self._sync()
+
+            self.ready.notify_all()
+
+    def _sample_prioritized(self, n_samples):
+        # stratified over [0, total), with importance-sampling weights normalized by the largest in the batch
+        total   = self.priorities.total()
+        masses  = (np.arange(n_samples) + np.random.uniform(size=n_samples)) * (total / n_samples)
+        slots   = self.priorities.find(np.minimum(masses, np.nextafter(total, 0)))
+        probs   = self.priorities.get(slots) / total
+        weights = np.power(self.count * probs, - self.priority_info['beta'])
+        return slots, (weights / np.max(weights)).astype(np.float32)
+
+    def _is_ready(self, n_samples):
+        # waits for replay_buffer_min_size datapoints to prevent overfitting the first run that happens to get added
+        return (self.eviction_started or self.count >= self.cfg['replay_buffer_min_size']) and self.count >= n_samples
+
+    def wait_until_ready(self, n_samples, timeout=None):
+        # blocks until sample(n_samples) can succeed, returns False on timeout
+        with self.ready:
+            return self.ready.wait_for(lambda: self._is_ready(n_samples), timeout=timeout)
+
+    def sample(self, n_samples):
+        with self.lock:
+            if not self._is_ready(n_samples):
+                return None
+
+            if self.prioritized:
+                slots, weights = self._sample_prioritized(n_samples)
+            else:
+                slots   = (self.head + np.array(random.sample(range(self.count), k=n_samples), dtype=np.int64)) % self.capacity
+                weights = np.ones(n_samples, dtype=np.float32)
+
+            return ReplaySample(datapoints=[self._get_datapoint(slot) for slot in slots], slots=slots, ids=self.ids[slots], weights=weights)
 
     def sample_datapoints(self, n_samples):
-        if (not self.eviction_started) and self.next_index < self.cfg['replay_buffer_min_size']:
-            # to prevent overfitting the first run that happens to get added
-            return []
-
-        n_to_consider = len(self.storage) if self.eviction_started else self.next_index
-        if n_to_consider >= n_samples:
-            return random.sample(self.storage[:n_to_consider], k=n_samples)
-        else:
-            return []
+        sample = self.sample(n_samples)
+        return sample.datapoints if sample is not None else []
+
+    def update_priorities(self, slots, ids, costs):
+        # ignores datapoints that were evicted since they were sampled
+        if not self.prioritized: return
+
+        with self.lock:
+            live = (self.ids[slots] == ids) & ((slots - self.head) % self.capacity < self.count)
+            if not np.any(live): return
+            priorities = np.abs(costs[live]) + self.priority_info['eps']
+            self.max_priority = max(self.max_priority, float(np.max(priorities)))
+            self.priorities.update(slots[live], np.power(priorities, self.priority_info['alpha']))
+
+    def stats(self):
+        with self.lock:
+            slots = self._live_slots()
+            return { "n_bytes" : self.n_bytes, "count" : self.count,
+                     "max_entry_bytes" : int(np.max(self.lengths[slots])) * CELL_BYTES + ENTRY_BYTES if self.count > 0 else 0,
+                     "n_offered" : self.n_offered, "n_duplicates" : self.n_duplicates,
+                     "duplicate_rate" : self.n_duplicates / float(max(self.n_offered, 1)),
+                     "mean_merged" : float(np.mean(self.n_merged[slots])) if self.count > 0 else 0.0 }
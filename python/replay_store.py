@@ -0,0 +1,140 @@
+# Copyright 2018 Daniel Selsam. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import numpy as np
+import errno
+import fcntl
+import os
+import struct
+import zlib
+
+# On-disk backing for the replay buffer columns, so that a restarted server can train right away.
+#   <name>.bin : one raw memory-mapped file per column (pages are only read in when a datapoint is sampled)
+#   header.bin : two header slots of magic, format, seq, capacity, arena rows, head, count, n_added, eviction started,
+#                each followed by the crc32 of the packed fields
+# Headers are written to alternating slots after the columns are flushed, and on open the valid slot with the
+# largest seq wins, so a crash while writing a header falls back to the previous one.
+
+STORE_MAGIC  = b"NCRB"
+STORE_FORMAT = 1
+STORE_HEADER = struct.Struct("<4sIQqqqqqq")
+STORE_CRC    = struct.Struct("<I")
+SLOT_SIZE    = 128
+HEADER_FILE  = "header.bin"
+COPY_CHUNK   = 1 << 20
+FICLONE      = 0x40049409
+
+def data_extents(fd, size):
+    # the (start, end) byte ranges of fd that are not holes (all of it where SEEK_DATA is not supported)
+    offset = 0
+    while offset < size:
+        try:
+            start = os.lseek(fd, offset, os.SEEK_DATA)
+        except OSError as e:
+            if e.errno == errno.ENXIO: return
+            if e.errno != errno.EINVAL: raise
+            yield offset, size
+            return
+        end = os.lseek(fd, start, os.SEEK_HOLE)
+        yield start, end
+        offset = end
+
+def copy_sparse(src, dst):
+    # copies src to dst without filling in the unused rows of the arena: a reflink where the filesystem supports
+    # one, otherwise only the data extents of src, leaving holes for the chunks that are all zeros
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return
+        except OSError:
+            pass
+
+        size = os.fstat(fsrc.fileno()).st_size
+        for start, end in data_extents(fsrc.fileno(), size):
+            for offset in range(start, end, COPY_CHUNK):
+                chunk = os.pread(fsrc.fileno(), min(COPY_CHUNK, end - offset), offset)
+                if chunk.count(0) != len(chunk):
+                    os.pwrite(fdst.fileno(), chunk, offset)
+        os.ftruncate(fdst.fileno(), size)
+
+def replay_dir_of_checkpoint(restore_path):
+    # <run_dir>/checkpoints/<checkpoint> -> <run_dir>/replay
+    return os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(restore_path))), "replay")
+
+class ReplayStore:
+    def __init__(self, path, capacity, arena_rows, restore_from=None):
+        self.path       = path
+        self.capacity   = capacity
+        self.arena_rows = arena_rows
+        self.columns    = []
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        if restore_from is not None and os.path.isdir(restore_from) and os.path.abspath(restore_from) != os.path.abspath(path):
+            print("[REPLAY_STORE] Copying %s to %s..." % (restore_from, path))
+            for name in os.listdir(restore_from):
+                copy_sparse(os.path.join(restore_from, name), os.path.join(path, name))
+
+        header_path = os.path.join(path, HEADER_FILE)
+        if not os.path.exists(header_path):
+            with open(header_path, 'wb') as f: f.write(bytes(2 * SLOT_SIZE))
+
+        self.header_file = open(header_path, 'r+b')
+        self.header      = self._read_header()
+        self.seq         = self.header['seq'] if self.header is not None else 0
+
+    def _read_header(self):
+        self.header_file.seek(0)
+        data   = self.header_file.read(2 * SLOT_SIZE)
+        best   = None
+        for slot in range(2):
+            if len(data) < (slot + 1) * SLOT_SIZE: break
+            fields = data[slot*SLOT_SIZE:slot*SLOT_SIZE+STORE_HEADER.size]
+            crc,   = STORE_CRC.unpack_from(data, slot * SLOT_SIZE + STORE_HEADER.size)
+            if zlib.crc32(fields) != crc: continue
+
+            magic, fmt, seq, capacity, arena_rows, head, count, n_added, eviction_started = STORE_HEADER.unpack(fields)
+            if magic != STORE_MAGIC or fmt != STORE_FORMAT: continue
+            if best is None or seq > best['seq']:
+                best = { "seq" : seq, "capacity" : capacity, "arena_rows" : arena_rows, "head" : head, "count" : count,
+                         "n_added" : n_added, "eviction_started" : bool(eviction_started) }
+
+        if best is not None and (best['capacity'] != self.capacity or best['arena_rows'] != self.arena_rows):
+            print("[REPLAY_STORE] Ignoring %s: stored with capacity %d and %d arena rows" % (self.path, best['capacity'], best['arena_rows']))
+            return None
+        return best
+
+    def column(self, name, shape, dtype):
+        # reopens the column if the header is valid and the file has the right size, otherwise starts from zeros
+        path   = os.path.join(self.path, "%s.bin" % name)
+        nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        if self.header is not None and not (os.path.exists(path) and os.path.getsize(path) == nbytes):
+            print("[REPLAY_STORE] Missing or truncated %s, starting empty" % path)
+            self.header = None
+
+        mode   = 'r+' if self.header is not None else 'w+'
+        column = np.memmap(path, dtype=dtype, mode=mode, shape=shape)
+        self.columns.append(column)
+        return column
+
+    def write_header(self, head, count, n_added, eviction_started):
+        for column in self.columns:
+            column.flush()
+
+        self.seq += 1
+        fields = STORE_HEADER.pack(STORE_MAGIC, STORE_FORMAT, self.seq, self.capacity, self.arena_rows,
+                                   head, count, n_added, int(eviction_started))
+        os.pwrite(self.header_file.fileno(), fields + STORE_CRC.pack(zlib.crc32(fields)), (self.seq % 2) * SLOT_SIZE)
+        os.fsync(self.header_file.fileno())
@@ -0,0 +1,145 @@
+# Copyright 2018 Daniel Selsam. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import numpy as np
+import random
+import time
+
+MAX_STARVED_FRAC = 0.1
+
+# Schedulers choose the problem of the next episode of an actor, among its problem_idxs:
+#   next()                                               : the problem_idx of the next episode
+#   update(problem_idx, wall_secs, n_datapoints, esteps) : the cost and outcome of an episode on problem_idx
+#   stats()                                              : reported to the server under scheduler/
+
+class UniformScheduler:
+    def __init__(self, problem_idxs):
+        self.problem_idxs = problem_idxs
+        self.n_episodes   = 0
+        self.secs         = 0.0
+        self.datapoints   = 0
+
+    def next(self):
+        return random.choice(self.problem_idxs)
+
+    def update(self, problem_idx, wall_secs, n_datapoints, esteps):
+        self.n_episodes += 1
+        self.secs       += wall_secs
+        self.datapoints += n_datapoints
+
+    def stats(self):
+        return { "n_episodes" : self.n_episodes, "datapoints_per_sec" : self.datapoints / max(self.secs, 1e-3) }
+
+class CostAwareScheduler:
+    # Samples problems by a score computed from the episodes played on them so far, either
+    #   datapoints_per_sec : datapoints produced per second of episode, so that problems solved at the root (no datapoints)
+    #                        and problems that stall the actor for minutes are rarely played
+    #   esteps_band        : 1 for problems whose mean esteps is within esteps_band, halving with every factor of 2 outside
+    # with P(problem) ~ score^(1/tau). The estimates decay with a half-life of half_life_secs, and a problem whose decayed
+    # weight drops below half an episode is scored as the best one again until it is replayed (as are the ones never played,
+    # with a score of 1 if no problem has a positive one). A fraction epsilon of the episodes is uniform, and a problem
+    # not picked for max_wait_secs since it was last picked is played next regardless, for at most max_starved_frac of them.
+    def __init__(self, problem_idxs, sched_info):
+        self.problem_idxs   = problem_idxs
+        self.positions      = { problem_idx : pos for pos, problem_idx in enumerate(problem_idxs) }
+        self.objective      = sched_info['objective']
+        self.epsilon        = sched_info['epsilon']
+        self.tau            = sched_info['tau']
+        self.half_life_secs = sched_info['half_life_secs']
+        self.max_wait_secs  = sched_info['max_wait_secs']
+        self.max_starved    = sched_info['max_starved_frac'] if 'max_starved_frac' in sched_info else MAX_STARVED_FRAC
+        if self.objective == "esteps_band":
+            self.log_band = np.log2(sched_info['esteps_band'])
+        elif self.objective != "datapoints_per_sec":
+            raise Exception("unexpected scheduler objective '%s'" % self.objective)
+
+        n, now            = len(problem_idxs), time.time()
+        # decayed sums, as of last_update
+        self.weight       = np.zeros(n)
+        self.secs         = np.zeros(n)
+        self.datapoints   = np.zeros(n)
+        self.log_esteps   = np.zeros(n)
+        self.last_update  = np.full(n, now)
+        self.last_pick    = np.full(n, np.inf)   # never picked: left to the optimistic score
+
+        self.n_exploit    = 0
+        self.n_explore    = 0
+        self.n_starved    = 0
+        self.n_episodes   = 0
+        self.total_secs   = 0.0
+        self.total_dps    = 0
+
+    def probs(self, now):
+        decay = np.power(0.5, (now - self.last_update) / self.half_life_secs)
+        known = self.weight * decay >= 0.5
+        if self.objective == "datapoints_per_sec":
+            score = self.datapoints / np.maximum(self.secs, 1e-3)
+        else:
+            mean_log_esteps = self.log_esteps / np.maximum(self.weight, 1e-9)
+            score           = np.power(0.5, np.maximum(np.maximum(self.log_band[0] - mean_log_esteps, mean_log_esteps - self.log_band[1]), 0.0))
+
+        # optimistic for the problems not (or no longer) known, so that they get played
+        best  = np.max(score[known]) if np.any(known) else 0.0
+        score = np.where(known, score, best if best > 0 else 1.0)
+        ps    = np.power(score, 1.0 / self.tau)
+        total = np.sum(ps)
+        return ps / total if total > 0 else np.full(np.size(ps), 1.0 / np.size(ps))
+
+    def next(self):
+        now = time.time()
+        pos = int(np.argmin(self.last_pick))
+        if now - self.last_pick[pos] > self.max_wait_secs and self.n_starved < self.max_starved * (self.n_exploit + self.n_explore + 1):
+            self.n_starved += 1
+        elif random.random() < self.epsilon:
+            pos = random.randrange(len(self.problem_idxs))
+            self.n_explore += 1
+        else:
+            pos = np.random.choice(len(self.problem_idxs), p=self.probs(now))
+            self.n_exploit += 1
+
+        self.last_pick[pos] = now
+        return self.problem_idxs[pos]
+
+    def update(self, problem_idx, wall_secs, n_datapoints, esteps):
+        now   = time.time()
+        pos   = self.positions[problem_idx]
+        decay = 0.5 ** ((now - self.last_update[pos]) / self.half_life_secs)
+        self.weight[pos]      = decay * self.weight[pos] + 1.0
+        self.secs[pos]        = decay * self.secs[pos] + wall_secs
+        self.datapoints[pos]  = decay * self.datapoints[pos] + n_datapoints
+        self.log_esteps[pos]  = decay * self.log_esteps[pos] + np.log2(esteps)
+        self.last_update[pos] = now
+
+        self.n_episodes += 1
+        self.total_secs += wall_secs
+        self.total_dps  += n_datapoints
+
+    def stats(self):
+        probs   = self.probs(time.time())
+        n_picks = max(self.n_exploit + self.n_explore + self.n_starved, 1)
+        return { "n_episodes"         : self.n_episodes,
+                 "datapoints_per_sec" : self.total_dps / max(self.total_secs, 1e-3),
+                 "n_played"           : int(np.sum(self.weight > 0)),
+                 # the number of problems of a uniform distribution with the same entropy
+                 "effective_problems" : float(np.exp(-np.sum(probs * np.log(np.maximum(probs, 1e-30))))),
+                 "explore_frac"       : self.n_explore / n_picks,
+                 "starved_frac"       : self.n_starved / n_picks }
+
+def mk_scheduler(actor_info, problem_idxs):
+    if 'scheduler' not in actor_info or actor_info['scheduler']['kind'] == "uniform":
+        return UniformScheduler(problem_idxs)
+    elif actor_info['scheduler']['kind'] == "cost":
+        return CostAwareScheduler(problem_idxs, actor_info['scheduler'])
+    else:
+        raise Exception("unexpected scheduler kind '%s'" % actor_info['scheduler']['kind'])
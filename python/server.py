@@ -20,10 +20,13 @@ import sys
 import math
 import os
 import time
+import traceback
 from learner import Learner
 from actor import ActorEpisodeResult
 import queue
 from util import set_pyro_config
+from wire import decode_episodes
+from corpus_index import CorpusIndex
 from tbwriter import TensorBoardWriter
 from sat_util import parse_dimacs
 from replay_buffer import ReplayBuffer
@@ -40,15 +43,101 @@ class LearnerThread(threading.Thread):
             self.learner.step()
 
 class LearnerPostThread(threading.Thread):
-    def __init__(self, cfg, learner_outqueue, tbwriter):
+    def __init__(self, cfg, learner_outqueue, tbwriter, replay_buffer, ingest_queue, ingest_threads):
         threading.Thread.__init__(self)
         self.cfg = cfg
         self.learner_outqueue = learner_outqueue
         self.tbwriter = tbwriter
+        self.replay_buffer = replay_buffer
+        self.ingest_queue = ingest_queue
+        self.ingest_threads = ingest_threads
 
     def run(self):
         while True:
-            self.tbwriter.log_learner_episode(*self.learner_outqueue.get())
+            learner_episode = self.learner_outqueue.get()
+            self.tbwriter.log_learner_episode(*learner_episode)
+
+            iteration = learner_episode[0]
+            if iteration % self.cfg['replay_stats_freq'] == 0:
+                self.tbwriter.log_replay_buffer(iteration, self.replay_buffer.stats())
+                stats = self.ingest_queue.stats()
+                stats["n_threads_alive"] = sum([ingest_thread.is_alive() for ingest_thread in self.ingest_threads])
+                self.tbwriter.log_ingest(iteration, stats)
+
+class IngestQueue:
+    # bounded queue of actor episodes between the Pyro request threads and the IngestThreads,
+    # with latency measured from the RPC until the episode is in the replay buffer
+    def __init__(self, maxsize):
+        self.queue            = queue.Queue(maxsize=maxsize)
+        self.lock             = threading.Lock()
+        self.n_accepted       = 0
+        self.n_rejected       = 0
+        self.n_ingested       = 0
+        self.n_failed         = 0
+        self.latency_secs     = 0.0
+        self.max_latency_secs = 0.0
+
+    def offer(self, aer):
+        # returns False if the queue is full, in which case the actor is expected to back off and retry
+        try:
+            self.queue.put_nowait((time.time(), aer))
+        except queue.Full:
+            with self.lock: self.n_rejected += 1
+            return False
+        with self.lock: self.n_accepted += 1
+        return True
+
+    def get(self):
+        return self.queue.get()
+
+    def empty(self):
+        return self.queue.empty()
+
+    def failed(self):
+        with self.lock: self.n_failed += 1
+
+    def done(self, enqueued_at):
+        latency_secs = time.time() - enqueued_at
+        with self.lock:
+            self.n_ingested       += 1
+            self.latency_secs     += latency_secs
+            self.max_latency_secs  = max(self.max_latency_secs, latency_secs)
+
+    def stats(self):
+        # latencies are over the episodes ingested since the last call
+        with self.lock:
+            stats = { "queue_depth" : self.queue.qsize(), "n_accepted" : self.n_accepted, "n_rejected" : self.n_rejected,
+                      "n_failed" : self.n_failed,
+                      "mean_latency_ms" : 1000.0 * self.latency_secs / max(self.n_ingested, 1),
+                      "max_latency_ms" : 1000.0 * self.max_latency_secs }
+            self.n_ingested, self.latency_secs, self.max_latency_secs = 0, 0.0, 0.0
+            return stats
+
+class IngestThread(threading.Thread):
+    def __init__(self, ingest_queue, tbwriter, replay_buffer, corpus_index):
+        threading.Thread.__init__(self, daemon=True)
+        self.ingest_queue  = ingest_queue
+        self.tbwriter      = tbwriter
+        self.replay_buffer = replay_buffer
+        self.corpus_index  = corpus_index
+
+    def run(self):
+        while True:
+            enqueued_at, aer = self.ingest_queue.get()
+            # a bad episode is logged and skipped, so that the consumers outlive it
+            try:
+                aer = ActorEpisodeResult(*aer)
+                self.tbwriter.log_actor_episode(aer)
+                self.replay_buffer.add_datapoints(aer.datapoints, dimacs=aer.dimacs)
+                if self.corpus_index is not None:
+                    self.corpus_index.record_episode(aer.dimacs, aer.esteps, aer.wall_secs, aer.n_conflicts, len(aer.datapoints), aer.truncated)
+                    # the index commits in batches while episodes keep coming, and as soon as they stop
+                    if self.ingest_queue.empty(): self.corpus_index.flush()
+            except Exception:
+                print("[INGEST] failed to ingest an episode, dropping it")
+                traceback.print_exc()
+                self.ingest_queue.failed()
+            self.ingest_queue.done(enqueued_at)
 
 @Pyro4.expose
 @Pyro4.behavior(instance_mode="single")
@@ -62,7 +151,13 @@ class NeuroCuberServer:
         self.learner_thread      = LearnerThread(self.learner)
         self.learner_thread.start()
 
-        self.learner_post_thread = LearnerPostThread(cfg, self.learner_outqueue, self.tbwriter)
+        self.ingest_queue        = IngestQueue(maxsize=cfg['ingest_queue_size'])
+        self.corpus_index        = CorpusIndex(cfg['corpus_index']) if cfg['corpus_index'] != "none" else None
+        self.ingest_threads      = [IngestThread(self.ingest_queue, self.tbwriter, self.replay_buffer, self.corpus_index) for _ in range(cfg['n_ingest_threads'])]
+        for ingest_thread in self.ingest_threads:
+            ingest_thread.start()
+
+        self.learner_post_thread = LearnerPostThread(cfg, self.learner_outqueue, self.tbwriter, self.replay_buffer, self.ingest_queue, self.ingest_threads)
         self.learner_post_thread.start()
 
     def get_config(self):
@@ -71,12 +166,26 @@ class NeuroCuberServer:
     def get_weights(self):
         return self.learner.get_weights()
 
-    def process_actor_episode(self, aer):
-        aer = ActorEpisodeResult(*aer)
-        assert(aer is not None)
+    def get_weights_if_newer(self, version):
+        return self.learner.get_weights_if_newer(version)
+
+    def process_actor_episode(self, blob):
+        # blob : one episode encoded with wire.encode_episodes, returns False when the ingest queue is full
+        aers = decode_episodes(blob)
+        assert(len(aers) == 1)
+        return self.ingest_queue.offer(aers[0])
+
+    def process_actor_episodes(self, blob):
+        # blob : a batch of episodes encoded with wire.encode_episodes,
+        # returns how many of them were accepted, always a prefix of the batch
+        aers = decode_episodes(blob)
+        for n_accepted, aer in enumerate(aers):
+            if not self.ingest_queue.offer(aer):
+                return n_accepted
+        return len(aers)
 
-        self.tbwriter.log_actor_episode(aer)
-        self.replay_buffer.add_datapoints(aer.datapoints)
+    def process_actor_stats(self, actor_name, stats):
+        self.tbwriter.log_actor_stats(actor_name, stats)
 
 def get_options():
     import argparse
@@ -102,10 +211,12 @@ def load_config(opts):
     cfg['run_dir']             = os.path.join(cfg['root_dir'], "runs", cfg['unique_id'])
     cfg['summary_dir']         = os.path.join(cfg['run_dir'], "summaries")
     cfg['checkpoint_dir']      = os.path.join(cfg['run_dir'], "checkpoints")
+    cfg['replay_dir']          = os.path.join(cfg['run_dir'], "replay")
 
     os.makedirs(cfg['run_dir'])
     os.makedirs(cfg['summary_dir'])
     os.makedirs(cfg['checkpoint_dir'])
+    os.makedirs(cfg['replay_dir'])
 
     with open(os.path.join(cfg['run_dir'], 'config.json'), 'w') as f: json.dump(cfg, f)
 
@@ -0,0 +1,71 @@
+# Copyright 2018 Daniel Selsam. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import collections
+import time
+from sat_util import Z3Solver
+
+# rough resident size of a Z3Solver per cell of its problem (z3 context and clauses, variable maps, reduced clause graph),
+# measured at ~270 bytes on random 3-SAT
+SOLVER_BYTES_PER_CELL = 280
+
+class SolverPool:
+    # Prepared solvers per problem, so that an episode starts from a push scope on an existing solver instead of
+    # rebuilding the z3 context, the variables and all the clauses. acquire pushes a scope and release pops it,
+    # which takes the solver back to the root. Idle solvers are evicted in LRU order once their estimated size
+    # exceeds max_bytes, and max_bytes = 0 builds a fresh solver for every episode, without a scope.
+    # Problems are keyed by their index in the corpus of the actor, which is unique where their names need not be.
+    def __init__(self, zopts, max_bytes):
+        self.zopts       = zopts
+        self.max_bytes   = max_bytes
+        self.idle        = collections.OrderedDict()
+        self.n_bytes     = 0
+        self.n_hits      = 0
+        self.n_misses    = 0
+        self.n_evictions = 0
+        self.setup_secs  = 0.0
+
+    def acquire(self, problem_idx, load_sp):
+        # load_sp : returns the SATProblem of problem_idx, only called if there is no idle solver for it
+        start = time.time()
+        if problem_idx in self.idle:
+            s, n_bytes    = self.idle.pop(problem_idx)
+            self.n_bytes -= n_bytes
+            self.n_hits  += 1
+        else:
+            s = Z3Solver(sp=load_sp(), opts=self.zopts)
+            self.n_misses += 1
+
+        if self.max_bytes > 0:
+            s.push()
+        self.setup_secs += time.time() - start
+        return s
+
+    def release(self, problem_idx, s):
+        if self.max_bytes == 0: return
+        s.pop()
+        n_bytes = s.sp().n_cells() * SOLVER_BYTES_PER_CELL
+        if n_bytes > self.max_bytes: return
+
+        self.idle[problem_idx] = (s, n_bytes)
+        self.n_bytes     += n_bytes
+        while self.n_bytes > self.max_bytes:
+            _, (_, evicted_bytes) = self.idle.popitem(last=False)
+            self.n_bytes     -= evicted_bytes
+            self.n_evictions += 1
+
+    def stats(self):
+        n_episodes = self.n_hits + self.n_misses
+        return { "hits" : self.n_hits, "misses" : self.n_misses, "evictions" : self.n_evictions, "idle" : len(self.idle),
+                 "bytes" : self.n_bytes, "setup_ms" : 1000.0 * self.setup_secs / max(n_episodes, 1) }
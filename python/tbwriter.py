@@ -20,6 +20,7 @@ import os
 import tensorflow as tf
 import numpy as np
 import collections
+import threading
 
 class TensorBoardWriter:
     def __init__(self, cfg):
@@ -29,6 +30,9 @@ class TensorBoardWriter:
 
         self.writers = { "learn" : tf.summary.FileWriter(os.path.join(cfg['summary_dir'], "learn")) }
         self.actor_iterations  = collections.defaultdict(int)
+        self.stats_iterations  = collections.defaultdict(int)
+        # called from the ingest, Pyro and learner post threads
+        self.lock              = threading.Lock()
 
     def flush(self):
         for writer in self.writers:
@@ -37,17 +41,47 @@ class TensorBoardWriter:
     def log_actor_episode(self, actor_episode_result):
         aer = actor_episode_result
 
-        if aer.cuber not in self.writers:
-            self.writers[aer.cuber] = tf.summary.FileWriter(os.path.join(self.cfg['summary_dir'], aer.cuber))
+        with self.lock:
+            if aer.cuber not in self.writers:
+                self.writers[aer.cuber] = tf.summary.FileWriter(os.path.join(self.cfg['summary_dir'], aer.cuber))
 
-        self.actor_iterations[(aer.cuber, aer.brancher)] += 1
+            self.actor_iterations[(aer.cuber, aer.brancher)] += 1
 
-        self.writers[aer.cuber].add_summary(
-            tf.Summary(value=[tf.Summary.Value(tag="esteps/vs_%s" % aer.brancher, simple_value=aer.esteps)]),
-            global_step=self.actor_iterations[(aer.cuber, aer.brancher)]
+            self.writers[aer.cuber].add_summary(
+                # the esteps of truncated episodes are partly the network's guess, so they are kept apart
+                tf.Summary(value=[tf.Summary.Value(tag="%s/vs_%s" % ("esteps_truncated" if aer.truncated else "esteps", aer.brancher), simple_value=aer.esteps)]),
+                global_step=self.actor_iterations[(aer.cuber, aer.brancher)]
+            )
+
+    def log_actor_stats(self, actor_name, stats):
+        writer_name = "actors/%s" % actor_name
+        with self.lock:
+            if writer_name not in self.writers:
+                self.writers[writer_name] = tf.summary.FileWriter(os.path.join(self.cfg['summary_dir'], "actors", actor_name))
+
+            self.stats_iterations[actor_name] += 1
+
+            self.writers[writer_name].add_summary(
+                tf.Summary(value=[tf.Summary.Value(tag=k, simple_value=float(v)) for k, v in sorted(stats.items())]),
+                global_step=self.stats_iterations[actor_name]
+            )
+
+    def log_ingest(self, iteration, stats):
+        self.writers['learn'].add_summary(
+            tf.Summary(value=[tf.Summary.Value(tag="ingest/%s" % k, simple_value=float(v)) for k, v in sorted(stats.items())]),
+            global_step=iteration
+        )
+
+    def log_replay_buffer(self, iteration, stats):
+        self.writers['learn'].add_summary(
+            tf.Summary(value=[tf.Summary.Value(tag="replay_buffer/%s" % k, simple_value=float(v)) for k, v in sorted(stats.items())]),
+            global_step=iteration
         )
 
-    def log_learner_episode(self, iteration, summary, n_secs):
+    def log_learner_episode(self, iteration, summary, n_secs, n_datapoints, input_stall_secs):
         self.writers['learn'].add_summary(summary, global_step=iteration)
-        self.writers['learn'].add_summary(tf.Summary(value=[tf.Summary.Value(tag="profile/n_secs_learn", simple_value=n_secs)]),
+        self.writers['learn'].add_summary(tf.Summary(value=[tf.Summary.Value(tag="profile/n_secs_learn", simple_value=n_secs),
+                                                            tf.Summary.Value(tag="profile/steps_per_sec", simple_value=1.0 / n_secs),
+                                                            tf.Summary.Value(tag="profile/datapoints_per_sec", simple_value=n_datapoints / n_secs),
+                                                            tf.Summary.Value(tag="profile/input_stall_secs", simple_value=input_stall_secs)]),
                                           global_step=iteration)
@@ -0,0 +1,78 @@
+# Copyright 2018 Daniel Selsam. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import numpy as np
+import pytest
+import json
+import os
+import sys
+
+# the numpy engine is for hosts without TF, where there is nothing to compare against
+tf = pytest.importorskip("tensorflow")
+
+PYTHON_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, PYTHON_DIR)
+
+from neuroquery import NeuroQuery
+from neurosat_np import NumpyNeuroQuery
+
+CONFIG = os.path.join(PYTHON_DIR, "..", "config", "server.json")
+RTOL   = 1e-4
+ATOL   = 1e-4
+
+def random_query(n_vars, n_clauses, k):
+    lits    = np.random.randint(0, n_vars, size=(n_clauses, k)) + n_vars * np.random.randint(0, 2, size=(n_clauses, k))
+    clauses = np.repeat(np.arange(n_clauses), k)
+    return n_vars, n_clauses, np.stack([lits.flatten(), clauses], axis=1).astype(np.int32)
+
+def check_parity(**overrides):
+    np.random.seed(0)
+    with open(CONFIG) as f: cfg = json.load(f)
+    cfg.update(overrides)
+    cfg['dropout_training'] = False
+
+    with tf.Graph().as_default():
+        tf_nq = NeuroQuery(cfg, gpu_id=None, gpu_frac=1.0)
+        tf_nq.sess.run(tf.global_variables_initializer())
+
+        # perturb the gains so that the weight reparam is exercised too
+        tvars = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES)
+        names = [tvar.name for tvar in tvars]
+        vals  = [np.random.uniform(0.5, 1.5, size=np.shape(val)).astype(np.float32) if name.endswith("/g:0") else val
+                 for name, val in zip(names, tf_nq.sess.run(tvars))]
+        tf_nq.set_weights((names, vals))
+
+        np_nq = NumpyNeuroQuery(cfg)
+        np_nq.set_weights((names, vals))
+
+        for batch_size in [1, 5]:
+            queries = [random_query(np.random.randint(5, 50), np.random.randint(10, 200), 3) for _ in range(batch_size)]
+            for tf_tfqr, np_tfqr in zip(tf_nq.query_batch(queries), np_nq.query_batch(queries)):
+                np.testing.assert_allclose(np_tfqr['logits'], tf_tfqr['logits'], rtol=RTOL, atol=ATOL)
+                np.testing.assert_allclose(np_tfqr['sl_esteps'], tf_tfqr['sl_esteps'], rtol=RTOL, atol=ATOL)
+
+def test_parity_default():
+    check_parity()
+
+def test_parity_rounds():
+    check_parity(n_rounds=3)
+
+def test_parity_repeat_layers():
+    check_parity(n_rounds=2, repeat_layers=True)
+
+def test_parity_no_reparam():
+    check_parity(weight_reparam=False)
+
+def test_parity_no_batch_norm():
+    check_parity(batch_norm=False, res_layers=False)
@@ -76,3 +76,21 @@ def mean_batch_norm(x):
     # (n, d)
     mu = tf.tile(mu, [tf.shape(x)[0], 1])
     return x - mu
+
+def segment_mean(x, segment_ids, n_segments):
+    # x : (n, ...), segment_ids : (n)
+    sums   = tf.unsorted_segment_sum(x, segment_ids, n_segments)
+    counts = tf.maximum(tf.unsorted_segment_sum(tf.ones_like(segment_ids, dtype=x.dtype), segment_ids, n_segments), 1.0)
+    if x.get_shape().ndims > 1:
+        counts = tf.expand_dims(counts, axis=1)
+    return sums / counts
+
+def segment_mean_batch_norm(x, segment_ids, n_segments):
+    # like mean_batch_norm, but each segment (i.e. graph) is normalized separately
+    return x - tf.gather(segment_mean(x, segment_ids, n_segments), segment_ids)
+
+def segment_sparse_softmax_cross_entropy_with_logits(logits, labels, segment_ids, n_segments):
+    # logits : (n), labels : (n_segments) indices into logits, one per segment
+    maxes = tf.unsorted_segment_max(logits, segment_ids, n_segments)
+    exps  = tf.exp(logits - tf.gather(maxes, segment_ids))
+    return tf.log(tf.unsorted_segment_sum(exps, segment_ids, n_segments)) + maxes - tf.gather(logits, labels)
@@ -0,0 +1,114 @@
+# Copyright 2018 Daniel Selsam. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import queue
+import threading
+import time
+import traceback
+import Pyro4
+from wire import encode_episodes
+
+UPLOAD_BACKOFF_SECS     = 0.1
+UPLOAD_MAX_BACKOFF_SECS = 10.0
+UPLOAD_MAX_FAILURES     = 5
+
+class EpisodeUploader(threading.Thread):
+    # Sends the episodes of one actor to the server in the background, so that the actor can keep playing.
+    # Episodes wait in an outbox of outbox_size episodes (the oldest one is dropped when it is full) and are sent
+    # up to max_batch at a time with process_actor_episodes; episodes the server rejects and batches that fail
+    # to send are retried with exponential backoff. A batch that fails with anything but a communication error
+    # (e.g. it cannot be encoded, or the server raises on it) is dropped after UPLOAD_MAX_FAILURES attempts.
+    # stats() reports whether the thread is alive, and the actor stops if it is not.
+    def __init__(self, server_uri, upload_info, compress):
+        super(EpisodeUploader, self).__init__(daemon=True)
+        self.server_uri  = server_uri
+        self.upload_info = upload_info
+        self.compress    = compress
+        self.outbox      = queue.Queue(maxsize=upload_info['outbox_size'])
+
+        self.lock        = threading.Lock()
+        self.n_queued    = 0
+        self.n_sent      = 0
+        self.n_dropped   = 0
+        self.n_batches   = 0
+        self.n_retries   = 0
+        self.n_failed    = 0
+
+    def enqueue(self, aer):
+        while True:
+            try:
+                self.outbox.put_nowait(aer)
+                break
+            except queue.Full:
+                try:
+                    self.outbox.get_nowait()
+                    with self.lock: self.n_dropped += 1
+                except queue.Empty:
+                    pass
+
+        with self.lock: self.n_queued += 1
+
+    def _next_batch(self, pending):
+        if not pending:
+            pending.append(self.outbox.get())
+        while len(pending) < self.upload_info['max_batch']:
+            try:
+                pending.append(self.outbox.get_nowait())
+            except queue.Empty:
+                break
+
+    def run(self):
+        # the proxy belongs to this thread, the actor keeps using its own
+        server       = Pyro4.Proxy(self.server_uri)
+        pending      = []
+        n_failures   = 0
+        backoff_secs = UPLOAD_BACKOFF_SECS
+        while True:
+            self._next_batch(pending)
+            n_dropped = 0
+            try:
+                n_accepted = server.process_actor_episodes(encode_episodes(pending, compress=self.compress))
+            except Pyro4.errors.CommunicationError as e:
+                print("[UPLOADER] failed to send %d episodes (%s), retrying..." % (len(pending), e))
+                n_accepted = 0
+                server._pyroRelease()
+            except Exception:
+                traceback.print_exc()
+                n_accepted  = 0
+                n_failures += 1
+                if n_failures < UPLOAD_MAX_FAILURES:
+                    print("[UPLOADER] failed to send %d episodes, retrying..." % len(pending))
+                else:
+                    print("[UPLOADER] failed to send %d episodes %d times, dropping them" % (len(pending), n_failures))
+                    n_dropped = len(pending)
+
+            with self.lock:
+                self.n_batches += 1
+                self.n_sent    += n_accepted
+                self.n_failed  += n_dropped
+                if n_accepted + n_dropped < len(pending): self.n_retries += 1
+
+            if n_accepted > 0 or n_dropped > 0: n_failures = 0
+            pending = pending[n_accepted + n_dropped:]
+            if pending:
+                time.sleep(backoff_secs)
+                backoff_secs = min(2 * backoff_secs, UPLOAD_MAX_BACKOFF_SECS)
+            else:
+                backoff_secs = UPLOAD_BACKOFF_SECS
+
+    def stats(self):
+        with self.lock:
+            return { "n_queued" : self.n_queued, "n_sent" : self.n_sent, "n_dropped" : self.n_dropped,
+                     "n_batches" : self.n_batches, "n_retries" : self.n_retries, "n_failed" : self.n_failed,
+                     "outbox_size" : self.outbox.qsize(), "alive" : int(self.is_alive()) }
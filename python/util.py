@@ -13,6 +13,9 @@
 # limitations under the License.
 # ==============================================================================
 import numpy as np
+import hashlib
+import struct
+from collections import namedtuple
 
 def npsoftmax(x, axis=None):
     e_x = np.exp(x - np.max(x, axis=axis, keepdims=True))
@@ -22,10 +25,69 @@ def compute_top_k(arr, k):
     assert(k <= np.size(arr))
     return arr.argsort()[-k:][::-1]
 
+NeuroSATDatapoint = namedtuple('NeuroSATDatapoint',  ['n_vars', 'n_clauses', 'LC_idxs', 'target_var', 'target_sl_esteps'])
+
+PackedGraphs = namedtuple('PackedGraphs', ['n_vars', 'n_clauses', 'LC_idxs', 'n_graphs', 'var_graph', 'clause_graph', 'var_offsets'])
+
+def pack_graphs(graphs):
+    # graphs : list of (n_vars, n_clauses, LC_idxs)
+    # packs them as one disjoint union, keeping all positive literals before all negative ones so that flip still works
+    n_vars_g         = np.array([g[0] for g in graphs], dtype=np.int64)
+    n_clauses_g      = np.array([g[1] for g in graphs], dtype=np.int64)
+    var_offsets      = np.concatenate([[0], np.cumsum(n_vars_g)])
+    clause_offsets   = np.concatenate([[0], np.cumsum(n_clauses_g)])
+    n_vars           = int(var_offsets[-1])
+    n_clauses        = int(clause_offsets[-1])
+
+    n_cells          = sum([np.shape(g[2])[0] for g in graphs])
+    LC_idxs          = np.empty(shape=(n_cells, 2), dtype=np.int32)
+
+    cell_idx = 0
+    for g_idx, (g_n_vars, g_n_clauses, g_LC_idxs) in enumerate(graphs):
+        g_LC_idxs = np.asarray(g_LC_idxs)
+        g_n_cells = np.shape(g_LC_idxs)[0]
+        lits      = g_LC_idxs[:, 0]
+        LC_idxs[cell_idx:cell_idx+g_n_cells, 0] = lits + var_offsets[g_idx] + (lits >= g_n_vars) * (n_vars - g_n_vars)
+        LC_idxs[cell_idx:cell_idx+g_n_cells, 1] = g_LC_idxs[:, 1] + clause_offsets[g_idx]
+        cell_idx += g_n_cells
+
+    var_graph    = np.repeat(np.arange(len(graphs), dtype=np.int32), n_vars_g)
+    clause_graph = np.repeat(np.arange(len(graphs), dtype=np.int32), n_clauses_g)
+    return PackedGraphs(n_vars=n_vars, n_clauses=n_clauses, LC_idxs=LC_idxs, n_graphs=len(graphs),
+                        var_graph=var_graph, clause_graph=clause_graph, var_offsets=var_offsets)
+
+def packed_graphs_of_batch(n_vars, n_clauses, batch):
+    # batch : TFQueryBatch of children of one problem, already packed by Z3Solver.to_tf_queries_packed
+    n_graphs     = len(batch.fvars)
+    var_offsets  = np.arange(n_graphs + 1, dtype=np.int64) * n_vars
+    var_graph    = np.repeat(np.arange(n_graphs, dtype=np.int32), n_vars)
+    clause_graph = np.repeat(np.arange(n_graphs, dtype=np.int32), n_clauses)
+    return PackedGraphs(n_vars=n_graphs * n_vars, n_clauses=n_graphs * n_clauses, LC_idxs=batch.LC_idxs, n_graphs=n_graphs,
+                        var_graph=var_graph, clause_graph=clause_graph, var_offsets=var_offsets)
+
+def unpack_graphs(pg, logits, sl_esteps):
+    return [{"logits":logits[pg.var_offsets[g_idx]:pg.var_offsets[g_idx+1]], "sl_esteps":sl_esteps[g_idx]} for g_idx in range(pg.n_graphs)]
+
+def lc_digest(LC_idxs):
+    # canonical (i.e. independent of the order of the rows) hash of LC_idxs
+    LC_idxs = np.asarray(LC_idxs)
+    cells   = (LC_idxs[:, 1].astype(np.uint64) << np.uint64(32)) | LC_idxs[:, 0].astype(np.uint64)
+    cells.sort()
+    return hashlib.blake2b(cells.tobytes(), digest_size=16).digest()
+
+def datapoint_fingerprint(dimacs, datapoint):
+    # identifies the (problem, state, target var) of a datapoint, independently of the order of the LC_idxs rows
+    h = hashlib.blake2b(digest_size=16)
+    h.update(dimacs.encode('utf-8'))
+    h.update(struct.pack("<iii", datapoint.n_vars, datapoint.n_clauses, datapoint.target_var))
+    h.update(lc_digest(datapoint.LC_idxs))
+    return h.digest()
+
 def set_pyro_config():
     import Pyro4
     Pyro4.config.SERVERTYPE            = "multiplex"
-    Pyro4.config.SERIALIZERS_ACCEPTED  = ["marshal", "json", "serpent", "pickle"]
-    Pyro4.config.SERIALIZER            = "pickle"
-    Pyro4.config.COMPRESSION           = True
+    # episodes and weights travel as wire.py blobs, so plain marshal suffices and nothing is ever unpickled
+    Pyro4.config.SERIALIZERS_ACCEPTED  = ["marshal"]
+    Pyro4.config.SERIALIZER            = "marshal"
+    Pyro4.config.COMPRESSION           = False
     Pyro4.config.DETAILED_TRACEBACK    = True
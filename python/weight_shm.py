@@ -0,0 +1,111 @@
+# Copyright 2018 Daniel Selsam. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import mmap
+import os
+import socket
+import struct
+import time
+
+# Memory-mapped weight segment shared by the learner and the actors on the same host.
+#   header : magic, active slot, seq, version, slot capacity, blob length of each slot
+#   slots  : two buffers of slot capacity bytes holding wire-encoded weight blobs
+# The writer fills the inactive slot and then publishes it under a seqlock (seq is odd while the header changes),
+# and readers decode straight from the mapping and retry whenever seq changed while they were decoding, up to
+# READ_ATTEMPTS times before they give up until the next pull.
+
+SEGMENT_MAGIC  = b"NCWS"
+SEGMENT_HEADER = struct.Struct("<4sIQqQQQ")
+HEADER_SIZE    = 64
+SEQ_OFFSET     = 8
+READ_ATTEMPTS  = 100
+
+def _slot_offset(capacity, slot):
+    return HEADER_SIZE + slot * capacity
+
+class WeightSegmentWriter:
+    def __init__(self, path, capacity):
+        if os.path.exists(path):
+            # readers notice the new inode and remap
+            os.unlink(path)
+
+        self.capacity = capacity
+        with open(path, 'w+b') as f:
+            f.truncate(HEADER_SIZE + 2 * capacity)
+            self.mm = mmap.mmap(f.fileno(), HEADER_SIZE + 2 * capacity)
+
+        self.active  = 0
+        self.seq     = 0
+        self.lengths = [0, 0]
+        SEGMENT_HEADER.pack_into(self.mm, 0, SEGMENT_MAGIC, self.active, self.seq, -1, self.capacity, 0, 0)
+
+    def write(self, version, blob):
+        if len(blob) > self.capacity:
+            raise Exception("WeightSegmentWriter: blob of %d bytes does not fit in slot of %d bytes" % (len(blob), self.capacity))
+
+        slot   = 1 - self.active
+        offset = _slot_offset(self.capacity, slot)
+        self.mm[offset:offset+len(blob)] = blob
+
+        self.lengths[slot] = len(blob)
+        self.seq += 1
+        struct.pack_into("<Q", self.mm, SEQ_OFFSET, self.seq)
+        SEGMENT_HEADER.pack_into(self.mm, 0, SEGMENT_MAGIC, slot, self.seq, version, self.capacity, self.lengths[0], self.lengths[1])
+        self.seq += 1
+        struct.pack_into("<Q", self.mm, SEQ_OFFSET, self.seq)
+        self.active = slot
+
+class WeightSegmentReader:
+    # The segment may not exist yet (or be between the unlink and the recreate of a restarted writer), in which case
+    # apply_if_newer returns False and the caller pulls over RPC instead, trying the segment again on its next pull.
+    def __init__(self, path):
+        self.path  = path
+        self.mm    = None
+        self.inode = None
+
+    def _remap(self):
+        with open(self.path, 'rb') as f:
+            self.inode = os.fstat(f.fileno()).st_ino
+            self.mm    = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def apply_if_newer(self, version, apply):
+        # calls apply(blob) with a view of the latest blob straight from the mapping, unless it has the given version;
+        # apply must copy what it keeps, and is called again if the writer republished the slot while it ran
+        try:
+            if os.stat(self.path).st_ino != self.inode:
+                self._remap()
+        except FileNotFoundError:
+            return False
+
+        for _ in range(READ_ATTEMPTS):
+            magic, active, seq, latest, capacity, length0, length1 = SEGMENT_HEADER.unpack_from(self.mm, 0)
+            if magic != SEGMENT_MAGIC:
+                raise Exception("WeightSegmentReader: unexpected magic %s in %s" % (magic, self.path))
+            if seq % 2 == 1:
+                time.sleep(0)
+                continue
+            if latest < 0 or latest == version:
+                return True
+
+            offset = _slot_offset(capacity, active)
+            apply(memoryview(self.mm)[offset:offset+(length0, length1)[active]])
+            if struct.unpack_from("<Q", self.mm, SEQ_OFFSET)[0] == seq:
+                return True
+        return True
+
+def open_weight_segment(cfg):
+    # only actors on the same host as the server can use the segment
+    if cfg['weights_shm_path'] == "none" or socket.gethostname() != cfg['hostname']:
+        return None
+    return WeightSegmentReader(cfg['weights_shm_path'])
@@ -0,0 +1,156 @@
+# Copyright 2018 Daniel Selsam. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import numpy as np
+import struct
+import json
+import zlib
+from util import NeuroSATDatapoint
+
+# Both formats below are a fixed header followed by raw little-endian buffers that decode to np.frombuffer views.
+#
+# Weight snapshots are serialized once per version and shipped as-is to every caller:
+#   header : magic, format, flags, weights version, length of the array table, length of the (uncompressed) body
+#   table  : json list of (name, dtype, shape, offset) for each array
+#   body   : the raw little-endian arrays, each aligned to ALIGN bytes (zlib-compressed if FLAG_COMPRESSED)
+
+WEIGHTS_MAGIC   = b"NCWT"
+WEIGHTS_FORMAT  = 1
+WEIGHTS_HEADER  = struct.Struct("<4sHHqIQ")
+FLAG_COMPRESSED = 1
+ALIGN           = 8
+
+# Batches of ActorEpisodeResults, sent by actors instead of pickled namedtuples:
+#   header : magic, format, flags, n episodes, n datapoints, n cells, length of the names, length of the (uncompressed) body
+#   names  : json list of (dimacs, cuber, brancher) for each episode
+#   body   : float32 esteps, int32 n datapoints and float64 (wall secs, n conflicts, truncated) per episode, int32
+#            (n_vars, n_clauses, target_var, n_cells) and float32 target_sl_esteps per datapoint, then the int32
+#            LC_idxs of all datapoints back to back,
+#            each buffer aligned to ALIGN bytes (compressed with zlib level 1 if FLAG_COMPRESSED)
+
+EPISODES_MAGIC  = b"NCEP"
+EPISODES_FORMAT = 3
+EPISODES_HEADER = struct.Struct("<4sHHIIQIQ")
+
+def _align(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+def encode_weights(version, names, values, compress):
+    values = [np.ascontiguousarray(value, dtype=np.asarray(value).dtype.newbyteorder('<')) for value in values]
+
+    table  = []
+    offset = 0
+    for name, value in zip(names, values):
+        table.append((name, value.dtype.str, list(value.shape), offset))
+        offset = _align(offset + value.nbytes)
+
+    body = bytearray(offset)
+    for (_, _, _, value_offset), value in zip(table, values):
+        body[value_offset:value_offset+value.nbytes] = value.tobytes()
+
+    table = json.dumps(table).encode('utf-8')
+    flags = FLAG_COMPRESSED if compress else 0
+    if compress:
+        body = zlib.compress(body)
+
+    return WEIGHTS_HEADER.pack(WEIGHTS_MAGIC, WEIGHTS_FORMAT, flags, version, len(table), offset) + table + bytes(body)
+
+def decode_weights(blob):
+    # returns (version, (names, values)); unless compressed, the values are read-only views into blob
+    magic, fmt, flags, version, table_len, body_len = WEIGHTS_HEADER.unpack_from(blob, 0)
+    if magic != WEIGHTS_MAGIC or fmt != WEIGHTS_FORMAT:
+        raise Exception("decode_weights: unexpected magic/format %s/%d" % (magic, fmt))
+
+    start = WEIGHTS_HEADER.size
+    table = json.loads(bytes(blob[start:start+table_len]).decode('utf-8'))
+    body  = memoryview(blob)[start+table_len:]
+    if flags & FLAG_COMPRESSED:
+        body = zlib.decompress(body)
+    if len(body) != body_len:
+        raise Exception("decode_weights: expected %d bytes of weights, got %d" % (body_len, len(body)))
+
+    names  = [name for (name, _, _, _) in table]
+    values = [np.frombuffer(body, dtype=np.dtype(dtype), count=int(np.prod(shape)), offset=offset).reshape(shape)
+              for (_, dtype, shape, offset) in table]
+    return version, (names, values)
+
+def _episodes_layout(n_episodes, n_datapoints, n_cells):
+    # (dtype, shape, offset) of each body buffer, and the body length
+    shapes = [(np.float32, (n_episodes,)), (np.int32, (n_episodes,)), (np.float64, (n_episodes, 3)), (np.int32, (n_datapoints, 4)),
+              (np.float32, (n_datapoints,)), (np.int32, (n_cells, 2))]
+    layout = []
+    offset = 0
+    for dtype, shape in shapes:
+        layout.append((np.dtype(dtype).newbyteorder('<'), shape, offset))
+        offset = _align(offset + int(np.prod(shape)) * np.dtype(dtype).itemsize)
+    return layout, offset
+
+def encode_episodes(aers, compress):
+    datapoints   = [dp for aer in aers for dp in aer.datapoints]
+    n_cells      = sum([np.shape(dp.LC_idxs)[0] for dp in datapoints])
+    layout, body_len = _episodes_layout(len(aers), len(datapoints), n_cells)
+
+    body = bytearray(body_len)
+    bufs = [np.frombuffer(body, dtype=dtype, count=int(np.prod(shape)), offset=offset).reshape(shape) for (dtype, shape, offset) in layout]
+    esteps, n_datapoints, costs, dp_ints, dp_sl_esteps, LC_idxs = bufs
+
+    esteps[:]       = [aer.esteps for aer in aers]
+    n_datapoints[:] = [len(aer.datapoints) for aer in aers]
+    costs[:]        = [(aer.wall_secs, aer.n_conflicts, aer.truncated) for aer in aers]
+    cell_idx = 0
+    for i, dp in enumerate(datapoints):
+        dp_n_cells      = np.shape(dp.LC_idxs)[0]
+        dp_ints[i]      = (dp.n_vars, dp.n_clauses, dp.target_var, dp_n_cells)
+        dp_sl_esteps[i] = dp.target_sl_esteps
+        LC_idxs[cell_idx:cell_idx+dp_n_cells] = dp.LC_idxs
+        cell_idx += dp_n_cells
+
+    names = json.dumps([(aer.dimacs, aer.cuber, aer.brancher) for aer in aers]).encode('utf-8')
+    flags = FLAG_COMPRESSED if compress else 0
+    if compress:
+        body = zlib.compress(body, 1)
+
+    return EPISODES_HEADER.pack(EPISODES_MAGIC, EPISODES_FORMAT, flags, len(aers), len(datapoints), n_cells, len(names), body_len) + names + bytes(body)
+
+def decode_episodes(blob):
+    # returns a list of (dimacs, cuber, brancher, esteps, datapoints, wall_secs, n_conflicts, truncated) in ActorEpisodeResult order,
+    # where the LC_idxs of the datapoints are read-only views into blob (or into the decompressed body)
+    magic, fmt, flags, n_episodes, n_datapoints, n_cells, names_len, body_len = EPISODES_HEADER.unpack_from(blob, 0)
+    if magic != EPISODES_MAGIC or fmt != EPISODES_FORMAT:
+        raise Exception("decode_episodes: unexpected magic/format %s/%d" % (magic, fmt))
+
+    start = EPISODES_HEADER.size
+    names = json.loads(bytes(blob[start:start+names_len]).decode('utf-8'))
+    body  = memoryview(blob)[start+names_len:]
+    if flags & FLAG_COMPRESSED:
+        body = zlib.decompress(body)
+    if len(body) != body_len:
+        raise Exception("decode_episodes: expected %d bytes of episodes, got %d" % (body_len, len(body)))
+
+    layout, _ = _episodes_layout(n_episodes, n_datapoints, n_cells)
+    esteps, ep_n_datapoints, costs, dp_ints, dp_sl_esteps, LC_idxs = \
+        [np.frombuffer(body, dtype=dtype, count=int(np.prod(shape)), offset=offset).reshape(shape) for (dtype, shape, offset) in layout]
+
+    aers     = []
+    dp_idx   = 0
+    cell_idx = 0
+    for (dimacs, cuber, brancher), ep_esteps, ep_n, (wall_secs, n_conflicts, truncated) in zip(names, esteps, ep_n_datapoints, costs.tolist()):
+        datapoints = []
+        for n_vars, n_clauses, target_var, dp_n_cells in dp_ints[dp_idx:dp_idx+ep_n].tolist():
+            datapoints.append(NeuroSATDatapoint(n_vars=n_vars, n_clauses=n_clauses, LC_idxs=LC_idxs[cell_idx:cell_idx+dp_n_cells],
+                                                target_var=target_var, target_sl_esteps=float(dp_sl_esteps[dp_idx + len(datapoints)])))
+            cell_idx += dp_n_cells
+        dp_idx += ep_n
+        aers.append((dimacs, cuber, brancher, float(ep_esteps), datapoints, wall_secs, int(n_conflicts), bool(truncated)))
+    return aers
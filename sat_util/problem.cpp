@@ -19,6 +19,8 @@
 #include <iostream>
 #include <fstream>
 #include <sstream>
+#include <cstring>
+#include <cstdlib>
 #include "problem.h"
 
 using std::vector;
@@ -45,8 +47,8 @@ bool Lit::operator==(const Lit & other) const { return var() == other.var() && s
 unsigned Lit::hash() const { return var().hash() + (sign() ? 48371 : 0); }
 
 // SAT Problem
-SATProblem::SATProblem(unsigned n_vars, vector<Clause> const & clauses):
-  _n_vars(n_vars), _clauses(clauses) {}
+SATProblem::SATProblem(unsigned n_vars, vector<Clause> clauses):
+  _n_vars(n_vars), _clauses(std::move(clauses)) {}
 
 unsigned SATProblem::n_vars() const { return _n_vars; }
 unsigned SATProblem::n_lits() const { return 2 * n_vars(); }
@@ -77,60 +79,117 @@ void SATProblem::print() const {
 Lit ilit_to_lit(int ilit) { return Lit(abs(ilit) - 1, ilit < 0); }
 
 SATProblem parse_dimacs(std::string const & filename) {
-  std::ifstream file(filename);
-  string line;
+  std::ifstream file(filename, std::ios::binary);
+  if (!file) { throw std::runtime_error("Error parsing dimacs: cannot open " + filename); }
+  std::ostringstream buffer;
+  buffer << file.rdbuf();
+  return parse_dimacs_buffer(buffer.str());
+}
+
+static char const * skip_line(char const * p) {
+  while (*p && *p != '\n') { ++p; }
+  return p;
+}
+
+static char const * skip_blanks(char const * p) {
+  while (*p == ' ' || *p == '\t' || *p == '\r') { ++p; }
+  return p;
+}
+
+static long parse_int(char const * & p) {
+  char * next;
+  long i = strtol(p, &next, 10);
+  if (next == p) { throw std::runtime_error("Error parsing dimacs: unexpected character '" + string(1, *p) + "'"); }
+  p = next;
+  return i;
+}
+
+SATProblem parse_dimacs_buffer(string const & buffer) {
+  // tokenizes the whole buffer in place; clauses may span lines and a '%' line ends the formula (as in SATLIB)
+  char const * p = buffer.c_str();
   bool seen_p = false;
 
-  unsigned n_vars, n_clauses;
+  unsigned n_vars = 0, n_clauses = 0;
   vector<Clause> clauses;
-
-  while (getline(file, line)) {
-    std::istringstream iss(line);
-    string result;
-    if (getline(iss, result, ' ')) {
-      if (result == "c") {
-        // comment
-        continue;
-      } else if (result == "p") {
-        // header
-	if (seen_p) {
-	  throw std::runtime_error("Error parsing dimacs: multiple header lines");
-	}
-        seen_p = true;
-
-        string token;
-        getline(iss, token, ' ');
-        assert(token == "cnf");
-
-        getline(iss, token, ' ');
-        n_vars = stoi(token);
-
-        getline(iss, token);
-        n_clauses = stoi(token);
+  Clause clause;
+
+  while (*p) {
+    p = skip_blanks(p);
+    if (*p == '\n') {
+      ++p;
+    } else if (*p == 'c') {
+      // comment
+      p = skip_line(p);
+    } else if (*p == '%') {
+      break;
+    } else if (*p == 'p') {
+      // header
+      if (seen_p) {
+	throw std::runtime_error("Error parsing dimacs: multiple header lines");
+      }
+      seen_p = true;
+      p = skip_blanks(p + 1);
+      if (strncmp(p, "cnf", 3) != 0) { throw std::runtime_error("Error parsing dimacs: expected 'p cnf'"); }
+      p += 3;
+      n_vars    = parse_int(p);
+      n_clauses = parse_int(p);
+      clauses.reserve(n_clauses);
+    } else if (*p) {
+      // clause
+      if (!seen_p) { throw std::runtime_error("Error parsing dimacs: clause before header"); }
+      long ilit = parse_int(p);
+      if (ilit == 0) {
+	clauses.push_back(std::move(clause));
+	clause.clear();
+      } else if ((unsigned long) labs(ilit) > n_vars) {
+	throw std::runtime_error("Error parsing dimacs: literal " + std::to_string(ilit) + " out of range");
       } else {
-        // clause
-        assert(seen_p);
-	vector<Lit> lits;
-        string token = result;
-        do {
-          if (token == "0") {
-            break;
-          } else {
-	    lits.push_back(ilit_to_lit(stoi(token)));
-          }
-        } while (getline(iss, token, ' '));
-	clauses.push_back(lits);
+	clause.push_back(ilit_to_lit(ilit));
       }
     }
   }
+  if (!clause.empty()) { clauses.push_back(clause); }
   if (!seen_p) { throw std::runtime_error("Error parsing dimacs: no header"); }
   if (n_clauses != clauses.size()) { throw std::runtime_error("Error parsing dimacs: number of clauses do not match"); }
-  return SATProblem(n_vars, clauses);
+  return SATProblem(n_vars, std::move(clauses));
+}
+
+SATProblem from_flat(unsigned n_vars, int32_t const * ilits, size_t n_ilits, int64_t const * offsets, size_t n_offsets) {
+  if (n_offsets == 0 || offsets[0] != 0 || (size_t) offsets[n_offsets - 1] != n_ilits) {
+    throw std::runtime_error("from_flat: offsets do not cover the literals");
+  }
+  vector<Clause> clauses(n_offsets - 1);
+  for (size_t c_idx = 0; c_idx + 1 < n_offsets; ++c_idx) {
+    if (offsets[c_idx + 1] < offsets[c_idx]) { throw std::runtime_error("from_flat: offsets are not sorted"); }
+    clauses[c_idx].reserve(offsets[c_idx + 1] - offsets[c_idx]);
+    for (int64_t l_idx = offsets[c_idx]; l_idx < offsets[c_idx + 1]; ++l_idx) {
+      int32_t ilit = ilits[l_idx];
+      if (ilit == 0 || (unsigned) abs(ilit) > n_vars) { throw std::runtime_error("from_flat: literal out of range"); }
+      clauses[c_idx].push_back(ilit_to_lit(ilit));
+    }
+  }
+  return SATProblem(n_vars, std::move(clauses));
+}
+
+void to_flat(SATProblem const & sp, vector<int32_t> & ilits, vector<int64_t> & offsets) {
+  ilits.clear();
+  offsets.clear();
+  ilits.reserve(sp.n_cells());
+  offsets.reserve(sp.n_clauses() + 1);
+  offsets.push_back(0);
+  for (Clause const & clause : sp.clauses()) {
+    for (Lit const & lit : clause) { ilits.push_back(lit.ilit()); }
+    offsets.push_back(ilits.size());
+  }
 }
 
 // Pybind11
 
 #include <pybind11/stl.h>
+#include <pybind11/numpy.h>
+
+typedef py::array_t<int32_t, py::array::c_style | py::array::forcecast> ilits_array;
+typedef py::array_t<int64_t, py::array::c_style | py::array::forcecast> offsets_array;
 
 void init_py_problem_module(py::module & m) {
   py::class_<Var>(m, "Var")
@@ -158,7 +217,17 @@ void init_py_problem_module(py::module & m) {
 		    [](py::tuple t) { return Lit(Var(t[0].cast<unsigned>()), t[1].cast<bool>()); }));
 
   py::class_<SATProblem>(m, "SATProblem")
-    .def(py::init<unsigned, vector<Clause> const &>(), py::arg("n_vars"), py::arg("clauses"))
+    .def(py::init<unsigned, vector<Clause>>(), py::arg("n_vars"), py::arg("clauses"))
+    .def_static("from_flat", [](unsigned n_vars, ilits_array ilits, offsets_array offsets) {
+	py::gil_scoped_release release;
+	return from_flat(n_vars, ilits.data(), ilits.size(), offsets.data(), offsets.size());
+      }, py::arg("n_vars"), py::arg("ilits"), py::arg("offsets"))
+    .def("to_flat", [](SATProblem const & sp) {
+	vector<int32_t> ilits;
+	vector<int64_t> offsets;
+	to_flat(sp, ilits, offsets);
+	return py::make_tuple(ilits_array(ilits.size(), ilits.data()), offsets_array(offsets.size(), offsets.data()));
+      })
     .def("n_vars", &SATProblem::n_vars)
     .def("n_lits", &SATProblem::n_lits)
     .def("n_clauses", &SATProblem::n_clauses)
@@ -166,5 +235,10 @@ void init_py_problem_module(py::module & m) {
     .def("clauses", &SATProblem::clauses, py::return_value_policy::reference_internal)
     .def("print", &SATProblem::print);
 
-  m.def("parse_dimacs", &parse_dimacs, py::return_value_policy::copy);
+  m.def("parse_dimacs", &parse_dimacs, py::arg("filename"), py::call_guard<py::gil_scoped_release>());
+  m.def("parse_dimacs_buffer", [](py::bytes buffer) {
+      string contents = buffer;
+      py::gil_scoped_release release;
+      return parse_dimacs_buffer(contents);
+    }, py::arg("buffer"));
 }
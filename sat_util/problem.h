@@ -17,6 +17,7 @@
 #pragma once
 #include <pybind11/pybind11.h>
 #include <vector>
+#include <cstdint>
 
 using std::string;
 using std::vector;
@@ -62,7 +63,7 @@ typedef vector<Lit> Clause;
 struct SATProblem {
   unsigned       _n_vars;
   vector<Clause> _clauses;
-  SATProblem(unsigned n_vars, vector<Clause> const & clauses);
+  SATProblem(unsigned n_vars, vector<Clause> clauses);
   unsigned n_vars() const;
   unsigned n_lits() const;
   unsigned n_clauses() const;
@@ -73,6 +74,11 @@ struct SATProblem {
 
 Lit ilit_to_lit(int ilit);
 SATProblem parse_dimacs(string const & filename);
+SATProblem parse_dimacs_buffer(string const & buffer);
+
+// Flat form of a SATProblem: the DIMACS literals of all clauses back to back, and n_clauses + 1 offsets into them
+SATProblem from_flat(unsigned n_vars, int32_t const * ilits, size_t n_ilits, int64_t const * offsets, size_t n_offsets);
+void to_flat(SATProblem const & sp, vector<int32_t> & ilits, vector<int64_t> & offsets);
 
 namespace py = pybind11;
 
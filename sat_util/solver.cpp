@@ -21,6 +21,8 @@
 #include <fstream>
 #include <algorithm>
 #include <sstream>
+#include <atomic>
+#include <thread>
 
 using std::unordered_map;
 using std::unordered_set;
@@ -40,11 +42,13 @@ Z3Options::Z3Options(unsigned max_conflicts, unsigned sat_restart_max):
   max_conflicts(max_conflicts), sat_restart_max(sat_restart_max) {}
 
 // Z3Solver
+static unsigned const NO_CONFLICT = (unsigned) -1;
 
 Z3Status Z3Solver::propagate() {
   _zsolver.set(":max_conflicts", (unsigned) 0);
   z3::check_result cr = _zsolver.check();
   _zsolver.set(":max_conflicts", _opts.max_conflicts);
+  absorb_zunits();
   return check_result_to_Z3Status(cr);
 }
 
@@ -74,65 +78,386 @@ Lit Z3Solver::zlit_to_lit(z3::expr const & zlit) const {
   return Lit(var, sign);
 }
 
+bool Z3Solver::is_problem_zlit(z3::expr const & zlit) const {
+  // z3 also reports literals of its own, e.g. the guards of push scopes
+  z3::expr zvar = zlit.is_not() ? zlit.arg(0) : zlit;
+  return zvar.is_const() && _zvar_to_var.count(zvar);
+}
+
 void Z3Solver::push() {
   _zsolver.push();
+  _marks.push_back(_trail.size());
 }
 
 void Z3Solver::pop() {
   _zsolver.pop();
+  if (_marks.empty()) { return; }
+  undo_to(_marks.back());
+  _marks.pop_back();
+  if (_conflict != NO_CONFLICT && _conflict > _marks.size()) { _conflict = NO_CONFLICT; }
 }
 
-TFQuery Z3Solver::to_tf_query() {
-  // note it is the caller's responsibility to propagate first
+vector<Lit> Z3Solver::units() const {
+  vector<Lit> units;
+  z3::expr_vector zunits = _zsolver.units();
+  for (unsigned u_idx = 0; u_idx < zunits.size(); ++u_idx) {
+    if (is_problem_zlit(zunits[u_idx])) { units.push_back(zlit_to_lit(zunits[u_idx])); }
+  }
+  return units;
+}
 
-  // we don't know the number of cells yet
-  vector<pair<unsigned, unsigned> > idxs;
-  unsigned n_cells = 0;
+unsigned Z3Solver::conflicts() const {
+  // conflicts of the sat core over the lifetime of the solver, as counted in the z3 statistics
+  z3::stats stats = _zsolver.statistics();
+  for (unsigned s_idx = 0; s_idx < stats.size(); ++s_idx) {
+    if (stats.key(s_idx) == "sat conflicts" || stats.key(s_idx) == "conflicts") {
+      return stats.is_uint(s_idx) ? stats.uint_value(s_idx) : (unsigned) stats.double_value(s_idx);
+    }
+  }
+  return 0;
+}
+
+bool Z3Solver::is_active(unsigned c_idx) const {
+  return _n_true[c_idx] == 0 && _sp.clauses()[c_idx].size() - _n_false[c_idx] > 1;
+}
+
+unsigned Z3Solver::n_cells(unsigned c_idx) const {
+  return is_active(c_idx) ? _sp.clauses()[c_idx].size() - _n_false[c_idx] : 0;
+}
 
-  // collect units
-  bool units[_sp.n_lits()] = { false };
+void Z3Solver::assign(unsigned vidx, int delta) {
+  // delta = 1 when vidx becomes true, -1 when it stops being true
+  unsigned n_vars = _sp.n_vars();
+  unsigned fvidx  = vidx < n_vars ? vidx + n_vars : vidx - n_vars;
+  unsigned var    = vidx < n_vars ? vidx : fvidx;
+  _assigned[vidx] = delta > 0;
+  for (unsigned c_idx : _occs[vidx]) {
+    _n_true[c_idx] += delta;
+    if (!_touched_clause[c_idx]) { _touched_clause[c_idx] = true; _touched_clauses.push_back(c_idx); }
+  }
+  for (unsigned c_idx : _occs[fvidx]) {
+    _n_false[c_idx] += delta;
+    if (!_touched_clause[c_idx]) { _touched_clause[c_idx] = true; _touched_clauses.push_back(c_idx); }
+  }
+  if (!_touched_var[var]) { _touched_var[var] = true; _touched_vars.push_back(var); }
+}
 
+bool Z3Solver::enqueue(Lit const & lit) {
+  // returns false if the negation of lit is already true
+  unsigned n_vars = _sp.n_vars();
+  if (_assigned[lit.flip().vidx(n_vars)]) { return false; }
+  if (!_assigned[lit.vidx(n_vars)]) {
+    assign(lit.vidx(n_vars), 1);
+    _trail.push_back(lit.vidx(n_vars));
+  }
+  return true;
+}
+
+bool Z3Solver::propagate_units() {
+  // returns false on a conflict, which leaves the rest of the trail unpropagated
+  unsigned n_vars = _sp.n_vars();
+  for (; _qhead < _trail.size(); ++_qhead) {
+    unsigned vidx  = _trail[_qhead];
+    unsigned fvidx = vidx < n_vars ? vidx + n_vars : vidx - n_vars;
+    for (unsigned c_idx : _occs[fvidx]) {
+      if (_n_true[c_idx] > 0) { continue; }
+      Clause const & clause = _sp.clauses()[c_idx];
+      unsigned n_left = clause.size() - _n_false[c_idx];
+      if (n_left == 0) { return false; }
+      if (n_left > 1) { continue; }
+      for (Lit const & lit : clause) {
+	if (!_assigned[lit.flip().vidx(n_vars)]) {
+	  assign(lit.vidx(n_vars), 1);
+	  _trail.push_back(lit.vidx(n_vars));
+	  break;
+	}
+      }
+    }
+  }
+  return true;
+}
+
+void Z3Solver::absorb_zunits() {
+  // puts the units z3 has fixed (e.g. by conflict analysis) on the trail of the current scope
+  if (_conflict != NO_CONFLICT) { return; }
+  unsigned n_vars = _sp.n_vars();
   z3::expr_vector zunits = _zsolver.units();
   for (unsigned u_idx = 0; u_idx < zunits.size(); ++u_idx) {
-    units[zlit_to_lit(zunits[u_idx]).vidx(_sp.n_vars())] = true;
+    if (!is_problem_zlit(zunits[u_idx])) { continue; }
+    Lit lit = zlit_to_lit(zunits[u_idx]);
+    if (_assigned[lit.vidx(n_vars)]) { continue; }
+    if (!enqueue(lit)) { _conflict = _marks.size(); return; }
   }
+  if (!propagate_units()) { _conflict = _marks.size(); }
+}
 
-  // cmask
-  for (unsigned c_idx = 0; c_idx < _sp.clauses().size(); ++c_idx) {
-    Clause clause;
-    bool has_unit = false;
-    for (Lit const & lit : _sp.clauses()[c_idx]) {
-      if (units[lit.vidx(_sp.n_vars())]) {
-	has_unit = true;
-	break;
-      } else if (!units[lit.flip().vidx(_sp.n_vars())]) {
-	clause.push_back(lit);
+void Z3Solver::undo_to(unsigned trail_size) {
+  while (_trail.size() > trail_size) {
+    assign(_trail.back(), -1);
+    _trail.pop_back();
+  }
+  _qhead = std::min(_qhead, trail_size);
+}
+
+TFQuery Z3Solver::to_tf_query(vector<Lit> const & assumptions) {
+  if (assumptions.empty()) { return base_tf_query(); }
+  return to_tf_queries({ assumptions }, 1)[0];
+}
+
+void Z3Solver::splice_cells() {
+  // The cells are kept in clause order, so the cells of the touched clauses are rebuilt in place of their old ones
+  // and the cells of all the other clauses are block-copied in between.
+  std::sort(_touched_clauses.begin(), _touched_clauses.end());
+  Eigen::MatrixXi const & old = _tfq.LC_idxs;
+  int const * old_clauses     = old.col(1).data();
+  unsigned n_old              = old.rows();
+
+  vector<pair<unsigned, unsigned>> blocks; // [start, end) of the old cells of each touched clause
+  unsigned n_new = n_old;
+  for (unsigned c_idx : _touched_clauses) {
+    unsigned start = std::lower_bound(old_clauses, old_clauses + n_old, (int) c_idx) - old_clauses;
+    unsigned end   = std::upper_bound(old_clauses + start, old_clauses + n_old, (int) c_idx) - old_clauses;
+    blocks.push_back({ start, end });
+    n_new += n_cells(c_idx) - (end - start);
+  }
+
+  unsigned n_vars  = _sp.n_vars();
+  unsigned old_idx = 0;
+  unsigned new_idx = 0;
+  _cells.resize(n_new, 2);
+  for (unsigned t_idx = 0; t_idx < _touched_clauses.size(); ++t_idx) {
+    unsigned c_idx = _touched_clauses[t_idx];
+    unsigned n_copy = blocks[t_idx].first - old_idx;
+    _cells.block(new_idx, 0, n_copy, 2) = old.block(old_idx, 0, n_copy, 2);
+    new_idx += n_copy;
+    old_idx  = blocks[t_idx].second;
+    if (is_active(c_idx)) {
+      for (Lit const & lit : _sp.clauses()[c_idx]) {
+	if (!_assigned[lit.flip().vidx(n_vars)]) {
+	  _cells(new_idx, 0) = lit.vidx(n_vars);
+	  _cells(new_idx, 1) = c_idx;
+	  ++new_idx;
+	}
       }
     }
+    _touched_clause[c_idx] = false;
+  }
+  _cells.block(new_idx, 0, n_old - old_idx, 2) = old.block(old_idx, 0, n_old - old_idx, 2);
+  _tfq.LC_idxs.swap(_cells);
+  _touched_clauses.clear();
+}
+
+void Z3Solver::splice_fvars() {
+  // the free vars are the unassigned vars that occur in the problem, in order
+  std::sort(_touched_vars.begin(), _touched_vars.end());
+  unsigned n_vars = _sp.n_vars();
+  vector<unsigned> fvars;
+  fvars.reserve(_tfq.fvars.size() + _touched_vars.size());
+  auto old = _tfq.fvars.begin();
+  for (unsigned var : _touched_vars) {
+    auto next = std::lower_bound(old, _tfq.fvars.end(), var);
+    fvars.insert(fvars.end(), old, next);
+    old = (next != _tfq.fvars.end() && *next == var) ? next + 1 : next;
+    bool occurs = !_occs[var].empty() || !_occs[var + n_vars].empty();
+    if (occurs && !_assigned[var] && !_assigned[var + n_vars]) { fvars.push_back(var); }
+    _touched_var[var] = false;
+  }
+  fvars.insert(fvars.end(), old, _tfq.fvars.end());
+  _tfq.fvars.swap(fvars);
+  _touched_vars.clear();
+}
+
+TFQuery Z3Solver::base_tf_query() {
+  // Only the cells of the clauses and the free vars touched since the last query are recomputed, the rest is copied.
+  // A trail with a conflict has no free vars and no cells, just like a solved one.
+  if (_conflict != NO_CONFLICT) {
+    TFQuery tfq;
+    tfq.LC_idxs.resize(0, 2);
+    return tfq;
+  }
+  if (!_touched_clauses.empty()) { splice_cells(); }
+  if (!_touched_vars.empty()) { splice_fvars(); }
+  return _tfq;
+}
 
-    if (clause.size() > 1 && !has_unit) {
+// Child queries
+// The query of the solver with extra assumptions is computed without touching z3: they are unit-propagated on top
+// of the reduced clause graph, with the counts they add kept per worker, and the child cells are the cells of the
+// graph that are still active. The graph is only read, so the children are spread over a few threads without the GIL.
+
+void Z3Solver::assign_child(ChildState & cs, unsigned vidx) const {
+  unsigned n_vars = _sp.n_vars();
+  unsigned fvidx  = vidx < n_vars ? vidx + n_vars : vidx - n_vars;
+  cs.assigned[vidx] = true;
+  cs.trail.push_back(vidx);
+  for (unsigned c_idx : _occs[vidx]) { ++cs.n_true[c_idx]; }
+  for (unsigned c_idx : _occs[fvidx]) { ++cs.n_false[c_idx]; }
+}
+
+bool Z3Solver::propagate_child(ChildState & cs, vector<Lit> const & assumptions) const {
+  // returns false if the assumptions are inconsistent with the trail
+  unsigned n_vars = _sp.n_vars();
+  auto is_true    = [&](unsigned vidx) { return _assigned[vidx] || cs.assigned[vidx]; };
+  for (Lit const & lit : assumptions) {
+    if (lit.var().idx() >= n_vars) { throw SatUtilException("to_tf_queries on invalid var"); }
+    if (is_true(lit.flip().vidx(n_vars))) { return false; }
+    if (!is_true(lit.vidx(n_vars))) { assign_child(cs, lit.vidx(n_vars)); }
+  }
+
+  // the trail itself is already propagated, so only the lits of the assumptions are
+  for (unsigned t_idx = 0; t_idx < cs.trail.size(); ++t_idx) {
+    unsigned vidx  = cs.trail[t_idx];
+    unsigned fvidx = vidx < n_vars ? vidx + n_vars : vidx - n_vars;
+    for (unsigned c_idx : _occs[fvidx]) {
+      if (_n_true[c_idx] + cs.n_true[c_idx] > 0) { continue; }
+      Clause const & clause = _sp.clauses()[c_idx];
+      unsigned n_left = clause.size() - _n_false[c_idx] - cs.n_false[c_idx];
+      if (n_left == 0) { return false; }
+      if (n_left > 1) { continue; }
       for (Lit const & lit : clause) {
-	idxs.push_back({lit.vidx(_sp.n_vars()), c_idx});
+	if (!is_true(lit.flip().vidx(n_vars))) {
+	  assign_child(cs, lit.vidx(n_vars));
+	  break;
+	}
       }
-      n_cells += clause.size();
     }
   }
+  return true;
+}
 
+void Z3Solver::undo_child(ChildState & cs) const {
+  unsigned n_vars = _sp.n_vars();
+  for (unsigned vidx : cs.trail) {
+    unsigned fvidx = vidx < n_vars ? vidx + n_vars : vidx - n_vars;
+    cs.assigned[vidx] = false;
+    for (unsigned c_idx : _occs[vidx]) { --cs.n_true[c_idx]; }
+    for (unsigned c_idx : _occs[fvidx]) { --cs.n_false[c_idx]; }
+  }
+  cs.trail.clear();
+}
+
+TFQuery Z3Solver::child_tf_query(ChildState & cs, vector<Lit> const & assumptions) const {
+  // a child with a conflict has no free vars and no cells, just like a solved one
   TFQuery tfq;
-  tfq.LC_idxs = Eigen::MatrixXi(n_cells, 2);
-  for (unsigned cell_idx = 0; cell_idx < n_cells; ++cell_idx) {
-    tfq.LC_idxs(cell_idx, 0) = idxs[cell_idx].first;
-    tfq.LC_idxs(cell_idx, 1) = idxs[cell_idx].second;
+  if (!propagate_child(cs, assumptions)) {
+    undo_child(cs);
+    tfq.LC_idxs.resize(0, 2);
+    return tfq;
   }
 
-  z3::expr_vector zfvars = _zsolver.non_units();
-  for (unsigned fv_idx = 0; fv_idx < zfvars.size(); ++fv_idx) {
-    tfq.fvars.push_back(zlit_to_lit(zfvars[fv_idx]).var().idx());
+  unsigned n_vars = _sp.n_vars();
+  for (unsigned var_idx : _tfq.fvars) {
+    if (!cs.assigned[var_idx] && !cs.assigned[var_idx + n_vars]) { tfq.fvars.push_back(var_idx); }
+  }
+
+  // as in splice_cells, only the cells of the clauses the assumptions touch are rebuilt
+  cs.touched.clear();
+  for (unsigned vidx : cs.trail) {
+    unsigned fvidx = vidx < n_vars ? vidx + n_vars : vidx - n_vars;
+    cs.touched.insert(cs.touched.end(), _occs[vidx].begin(), _occs[vidx].end());
+    cs.touched.insert(cs.touched.end(), _occs[fvidx].begin(), _occs[fvidx].end());
+  }
+  std::sort(cs.touched.begin(), cs.touched.end());
+  cs.touched.erase(std::unique(cs.touched.begin(), cs.touched.end()), cs.touched.end());
+
+  auto is_false = [&](Lit const & lit) { return _assigned[lit.flip().vidx(n_vars)] || cs.assigned[lit.flip().vidx(n_vars)]; };
+  auto n_cells  = [&](unsigned c_idx) -> unsigned {
+    unsigned n_left = _sp.clauses()[c_idx].size() - _n_false[c_idx] - cs.n_false[c_idx];
+    return _n_true[c_idx] + cs.n_true[c_idx] == 0 && n_left > 1 ? n_left : 0;
+  };
+
+  Eigen::MatrixXi const & base = _tfq.LC_idxs;
+  int const * base_clauses     = base.col(1).data();
+  unsigned n_base              = base.rows();
+  vector<pair<unsigned, unsigned>> blocks;
+  unsigned n_child = n_base;
+  for (unsigned c_idx : cs.touched) {
+    unsigned start = std::lower_bound(base_clauses, base_clauses + n_base, (int) c_idx) - base_clauses;
+    unsigned end   = std::upper_bound(base_clauses + start, base_clauses + n_base, (int) c_idx) - base_clauses;
+    blocks.push_back({ start, end });
+    n_child = n_child + n_cells(c_idx) - (end - start);
   }
-  std::sort(tfq.fvars.begin(), tfq.fvars.end());
+
+  unsigned base_idx  = 0;
+  unsigned child_idx = 0;
+  tfq.LC_idxs.resize(n_child, 2);
+  for (unsigned t_idx = 0; t_idx < cs.touched.size(); ++t_idx) {
+    unsigned c_idx  = cs.touched[t_idx];
+    unsigned n_copy = blocks[t_idx].first - base_idx;
+    tfq.LC_idxs.block(child_idx, 0, n_copy, 2) = base.block(base_idx, 0, n_copy, 2);
+    child_idx += n_copy;
+    base_idx   = blocks[t_idx].second;
+    if (n_cells(c_idx) == 0) { continue; }
+    for (Lit const & lit : _sp.clauses()[c_idx]) {
+      if (!is_false(lit)) {
+	tfq.LC_idxs(child_idx, 0) = lit.vidx(n_vars);
+	tfq.LC_idxs(child_idx, 1) = c_idx;
+	++child_idx;
+      }
+    }
+  }
+  tfq.LC_idxs.block(child_idx, 0, n_base - base_idx, 2) = base.block(base_idx, 0, n_base - base_idx, 2);
+
+  undo_child(cs);
   return tfq;
 }
 
+vector<TFQuery> Z3Solver::to_tf_queries(vector<vector<Lit>> const & assumption_sets, unsigned n_threads) {
+  if (_conflict != NO_CONFLICT) { return vector<TFQuery>(assumption_sets.size(), base_tf_query()); }
+  base_tf_query();
+  n_threads = std::max(1u, std::min(n_threads, (unsigned) assumption_sets.size()));
+  if (_children.size() < n_threads) { _children.resize(n_threads); }
+  for (unsigned t_idx = 0; t_idx < n_threads; ++t_idx) {
+    ChildState & cs = _children[t_idx];
+    if (cs.assigned.size() != _sp.n_lits()) {
+      cs.assigned.assign(_sp.n_lits(), false);
+      cs.n_true.assign(_sp.n_clauses(), 0);
+      cs.n_false.assign(_sp.n_clauses(), 0);
+    }
+  }
+
+  vector<TFQuery> tfqs(assumption_sets.size());
+  std::atomic<unsigned> next(0);
+  auto work = [&](ChildState & cs) {
+    for (unsigned q_idx = next++; q_idx < assumption_sets.size(); q_idx = next++) {
+      tfqs[q_idx] = child_tf_query(cs, assumption_sets[q_idx]);
+    }
+  };
+
+  vector<std::thread> threads;
+  for (unsigned t_idx = 1; t_idx < n_threads; ++t_idx) {
+    threads.emplace_back(work, std::ref(_children[t_idx]));
+  }
+  work(_children[0]);
+  for (std::thread & thread : threads) { thread.join(); }
+  return tfqs;
+}
+
+TFQueryBatch Z3Solver::to_tf_queries_packed(vector<vector<Lit>> const & assumption_sets, unsigned n_threads) {
+  vector<TFQuery> tfqs = to_tf_queries(assumption_sets, n_threads);
+  unsigned n_vars    = _sp.n_vars();
+  unsigned n_clauses = _sp.n_clauses();
+  unsigned n_graphs  = tfqs.size();
+
+  unsigned n_cells = 0;
+  for (TFQuery const & tfq : tfqs) { n_cells += tfq.LC_idxs.rows(); }
+
+  TFQueryBatch batch;
+  unsigned cell_idx = 0;
+  batch.LC_idxs.resize(n_cells, 2);
+  for (unsigned g_idx = 0; g_idx < n_graphs; ++g_idx) {
+    Eigen::MatrixXi const & LC_idxs = tfqs[g_idx].LC_idxs;
+    for (unsigned r_idx = 0; r_idx < LC_idxs.rows(); ++r_idx) {
+      unsigned vidx = LC_idxs(r_idx, 0);
+      batch.LC_idxs(cell_idx, 0) = vidx < n_vars ? vidx + g_idx * n_vars : vidx - n_vars + (n_graphs + g_idx) * n_vars;
+      batch.LC_idxs(cell_idx, 1) = LC_idxs(r_idx, 1) + g_idx * n_clauses;
+      ++cell_idx;
+    }
+    batch.fvars.push_back(std::move(tfqs[g_idx].fvars));
+  }
+  return batch;
+}
+
 void Z3Solver::set_params() {
   _zsolver.set(":lookahead.cube.cutoff", "depth");
   _zsolver.set(":lookahead.cube.depth", (unsigned)1);
@@ -168,9 +493,12 @@ void Z3Solver::validate_cube(z3::expr_vector const & cube) {
 }
 
 void Z3Solver::add(vector<Lit> const & lits) {
+  // once the lits are inconsistent, the trail is left alone until the scope of the conflict is popped
   for (Lit const & lit : lits) {
     _zsolver.add(lit_to_zlit(lit));
+    if (_conflict == NO_CONFLICT && !enqueue(lit)) { _conflict = _marks.size(); }
   }
+  if (_conflict == NO_CONFLICT && !propagate_units()) { _conflict = _marks.size(); }
 }
 
 pair<Z3Status, vector<Lit>> Z3Solver::cube(string const & lookahead_reward, float lookahead_delta_fraction) {
@@ -181,6 +509,7 @@ pair<Z3Status, vector<Lit>> Z3Solver::cube(string const & lookahead_reward, floa
   z3::solver::cube_iterator  start = cg.begin();
   z3::solver::cube_iterator  end   = cg.end();
 
+  absorb_zunits();
   if (start == end) { return { Z3Status::UNSAT, {} }; }
 
   z3::expr_vector cube1 = *start;
@@ -207,7 +536,9 @@ pair<Z3Status, vector<Lit>> Z3Solver::cube(string const & lookahead_reward, floa
 }
 
 Z3Status Z3Solver::check() {
-  return check_result_to_Z3Status(_zsolver.check());
+  z3::check_result cr = _zsolver.check();
+  absorb_zunits();
+  return check_result_to_Z3Status(cr);
 }
 
 pair<Z3Status, vector<Lit>> Z3Solver::check_core(vector<Lit> const & lits) {
@@ -231,13 +562,37 @@ SATProblem const & Z3Solver::sp() const {
 }
 
 void Z3Solver::reset() {
+  _marks.clear();
+  undo_to(_n_root);
+  _conflict = _root_conflict;
   return _zsolver.reset();
 }
 
 Z3Solver::Z3Solver(SATProblem const & sp, Z3Options const & opts):
-  _sp(sp), _opts(opts), _zctx(), _zsolver(_zctx, "QF_FD")  {
+  _sp(sp), _opts(opts), _zctx(), _zsolver(_zctx, "QF_FD"),
+  _occs(sp.n_lits()), _assigned(sp.n_lits(), false), _n_true(sp.n_clauses(), 0), _n_false(sp.n_clauses(), 0),
+  _qhead(0), _conflict(NO_CONFLICT), _touched_var(sp.n_vars(), true), _touched_clause(sp.n_clauses(), true) {
   set_params();
 
+  for (unsigned c_idx = 0; c_idx < _sp.n_clauses(); ++c_idx) {
+    for (Lit const & lit : _sp.clauses()[c_idx]) {
+      _occs[lit.vidx(_sp.n_vars())].push_back(c_idx);
+    }
+  }
+
+  // the first query builds everything
+  _tfq.LC_idxs.resize(0, 2);
+  for (unsigned var = 0; var < _sp.n_vars(); ++var) { _touched_vars.push_back(var); }
+  for (unsigned c_idx = 0; c_idx < _sp.n_clauses(); ++c_idx) { _touched_clauses.push_back(c_idx); }
+
+  for (Clause const & clause : _sp.clauses()) {
+    if (_conflict != NO_CONFLICT) { break; }
+    if (clause.empty() || (clause.size() == 1 && !enqueue(clause[0]))) { _conflict = 0; }
+  }
+  if (_conflict == NO_CONFLICT && !propagate_units()) { _conflict = 0; }
+  _n_root        = _trail.size();
+  _root_conflict = _conflict;
+
   // create zvars
   for (unsigned v_idx = 0; v_idx < _sp.n_vars(); ++v_idx) {
     std::string name = "x_" + std::to_string(v_idx);
@@ -275,9 +630,13 @@ void init_py_solver_module(py::module & m) {
     .def_readonly("fvars", &TFQuery::fvars)
     .def_readonly("LC_idxs", &TFQuery::LC_idxs);
 
+  py::class_<TFQueryBatch>(m, "TFQueryBatch")
+    .def_readonly("fvars", &TFQueryBatch::fvars)
+    .def_readonly("LC_idxs", &TFQueryBatch::LC_idxs);
+
   py::class_<Z3Solver>(m, "Z3Solver")
     .def(py::init<SATProblem const &, Z3Options const &>(), py::arg("sp"), py::arg("opts"))
-    .def("sp", &Z3Solver::sp)
+    .def("sp", &Z3Solver::sp, py::return_value_policy::reference_internal)
     .def("push", &Z3Solver::push)
     .def("pop", &Z3Solver::pop)
     .def("reset", &Z3Solver::reset)
@@ -285,7 +644,14 @@ void init_py_solver_module(py::module & m) {
     .def("add", &Z3Solver::add, py::arg("lits"))
     .def("check", &Z3Solver::check, py::call_guard<py::gil_scoped_release>())
     .def("check_core", &Z3Solver::check_core, py::arg("assumptions"), py::call_guard<py::gil_scoped_release>())
-    .def("to_tf_query", &Z3Solver::to_tf_query, py::call_guard<py::gil_scoped_release>())
+    .def("units", &Z3Solver::units)
+    .def("conflicts", &Z3Solver::conflicts)
+    .def("to_tf_query", &Z3Solver::to_tf_query, py::arg("assumptions") = vector<Lit>(),
+	 py::call_guard<py::gil_scoped_release>())
+    .def("to_tf_queries", &Z3Solver::to_tf_queries, py::arg("assumption_sets"), py::arg("n_threads") = 1,
+	 py::call_guard<py::gil_scoped_release>())
+    .def("to_tf_queries_packed", &Z3Solver::to_tf_queries_packed, py::arg("assumption_sets"), py::arg("n_threads") = 1,
+	 py::call_guard<py::gil_scoped_release>())
     .def("print", &Z3Solver::print)
     .def("cube", &Z3Solver::cube, py::arg("lookahead_reward"), py::arg("lookahead_delta_fraction"),
 	 py::call_guard<py::gil_scoped_release>());
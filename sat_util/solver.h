@@ -40,6 +40,22 @@ struct TFQuery {
   Eigen::MatrixXi LC_idxs;
 };
 
+// Several queries over the same problem packed into one disjoint union, in the layout of util.pack_graphs:
+// the positive literals of all the graphs come before all the negative literals.
+struct TFQueryBatch {
+  vector<vector<unsigned>> fvars;
+  Eigen::MatrixXi          LC_idxs;
+};
+
+// What the assumptions of a worker add to the reduced clause graph of a Z3Solver, all back to zero between queries.
+struct ChildState {
+  vector<char>     assigned;  // lit vidx -> made true by the assumptions
+  vector<unsigned> n_true;    // clause -> literals made true by the assumptions
+  vector<unsigned> n_false;   // clause -> literals made false by the assumptions
+  vector<unsigned> trail;
+  vector<unsigned> touched;   // clauses of the lits of trail
+};
+
 class Z3Solver {
  private:
   SATProblem        _sp;
@@ -50,10 +66,48 @@ class Z3Solver {
   vector<z3::expr>  _var_to_zvar;
   z3_expr_map<Var>  _zvar_to_var;
 
+  // Reduced clause graph of the unit clauses of the problem, the lits given to add and the units z3 fixes in
+  // check/cube/propagate, closed under unit propagation over the occurrence lists and undone scope by scope on pop:
+  // a clause is active if none of its literals is true and more than one of them is not false.
+  vector<vector<unsigned>> _occs;            // lit vidx -> clauses it occurs in
+  vector<char>             _assigned;        // lit vidx -> is it true
+  vector<unsigned>         _n_true;          // clause -> number of its literals that are true
+  vector<unsigned>         _n_false;         // clause -> number of its literals that are false
+  vector<unsigned>         _trail;           // true lit vidxs, in the order they were assigned
+  unsigned                 _qhead;           // trail index of the next lit to propagate
+  vector<unsigned>         _marks;           // size of _trail at each push
+  unsigned                 _n_root;          // size of _trail after the unit clauses of the problem
+  unsigned                 _conflict;        // number of scopes when the lits became inconsistent, or NO_CONFLICT
+  unsigned                 _root_conflict;   // _conflict after the unit clauses of the problem
+  vector<char>             _touched_var;     // var -> is it in _touched_vars
+  vector<unsigned>         _touched_vars;    // vars assigned or unassigned since _tfq was computed
+  vector<char>             _touched_clause;  // clause -> is it in _touched_clauses
+  vector<unsigned>         _touched_clauses; // clauses whose counts changed since _tfq was computed
+  TFQuery                  _tfq;             // of the trail, with its cells in clause order
+  Eigen::MatrixXi          _cells;           // buffer the cells of _tfq are spliced into
+  vector<ChildState>       _children;        // one per worker of to_tf_queries
+
+  void assign(unsigned vidx, int delta);
+  bool enqueue(Lit const & lit);
+  bool propagate_units();
+  void absorb_zunits();
+  void undo_to(unsigned trail_size);
+  bool is_active(unsigned c_idx) const;
+  unsigned n_cells(unsigned c_idx) const;
+  void splice_cells();
+  void splice_fvars();
+  TFQuery base_tf_query();
+
+  void assign_child(ChildState & cs, unsigned vidx) const;
+  bool propagate_child(ChildState & cs, vector<Lit> const & assumptions) const;
+  void undo_child(ChildState & cs) const;
+  TFQuery child_tf_query(ChildState & cs, vector<Lit> const & assumptions) const;
+
   z3::expr var_to_zvar(Var const & var) const;
   z3::expr lit_to_zlit(Lit const & lit) const;
   Var zvar_to_var(z3::expr const & zvar) const;
   Lit zlit_to_lit(z3::expr const & zlit) const;
+  bool is_problem_zlit(z3::expr const & zlit) const;
 
   void set_params();
   void validate_cube(z3::expr_vector const & cube);
@@ -71,7 +125,11 @@ class Z3Solver {
   void add(vector<Lit> const & lits);
   Z3Status check();
   pair<Z3Status, vector<Lit>> check_core(vector<Lit> const & assumptions);
-  TFQuery to_tf_query();
+  vector<Lit> units() const;
+  unsigned conflicts() const;
+  TFQuery to_tf_query(vector<Lit> const & assumptions);
+  vector<TFQuery> to_tf_queries(vector<vector<Lit>> const & assumption_sets, unsigned n_threads);
+  TFQueryBatch to_tf_queries_packed(vector<vector<Lit>> const & assumption_sets, unsigned n_threads);
 
   void print() const;
 };
@@ -13,7 +13,7 @@
 # limitations under the License.
 # ==============================================================================
 from sat_util import *
-from nose.tools import assert_equals, assert_not_equal
+from nose.tools import assert_equals, assert_not_equal, assert_raises
 import pickle
 import gzip
 
@@ -101,3 +101,21 @@ def test_parse_dimacs():
     assert_equals(sp.n_vars(), 6)
     assert_equals(len(sp.clauses()), 7)
     assert_equals(sp.clauses()[0], [Lit(Var(i), False) for i in range(4)])
+
+def test_parse_dimacs_buffer():
+    sp = parse_dimacs_buffer(b"c a comment\np cnf 3  2\n1 -2\n 3 0\r\n-1 0\n%\n0\n")
+    assert_equals(sp.n_vars(), 3)
+    assert_equals(sp.clauses(), [[Lit(Var(0), False), Lit(Var(1), True), Lit(Var(2), False)], [Lit(Var(0), True)]])
+
+def test_parse_dimacs_buffer_errors():
+    for buffer in [b"1 2 0\n", b"p cnf 2 1\n1 3 0\n", b"p cnf 2 2\n1 2 0\n", b"p cnf 2 1\np cnf 2 1\n1 0\n", b"p cnf 2 1\n1 x 0\n"]:
+        assert_raises(RuntimeError, parse_dimacs_buffer, buffer)
+
+def test_flat():
+    sp            = parse_dimacs_buffer(b"p cnf 4 3\n1 -2 0\n4 0\n-3 2 -1 0\n")
+    ilits, offsets = sp.to_flat()
+    assert_equals(list(ilits), [1, -2, 4, -3, 2, -1])
+    assert_equals(list(offsets), [0, 2, 3, 6])
+    assert_equals(SATProblem.from_flat(n_vars=4, ilits=ilits, offsets=offsets).clauses(), sp.clauses())
+    assert_raises(RuntimeError, SATProblem.from_flat, 4, ilits, offsets[:-1])
+    assert_raises(RuntimeError, SATProblem.from_flat, 3, ilits, offsets)
@@ -15,6 +15,7 @@
 from sat_util import *
 from nose.tools import assert_equals, assert_not_equal, assert_true, assert_raises
 import numpy as np
+import random
 import os
 
 TEST_DIR = "/home/dselsam/alphacuber/tests"
@@ -91,3 +92,169 @@ def test_scopes():
     assert_equals(s.check(), Z3Status.unsat)
     s.pop()
     assert_equals(s.check(), Z3Status.unknown)
+
+def random_sat_problem(n_vars, n_clauses, k, seed):
+    r = random.Random(seed)
+    return SATProblem(n_vars=n_vars, clauses=[[Lit(Var(r.randrange(n_vars)), r.random() < 0.5) for _ in range(k)] for _ in range(n_clauses)])
+
+def reference_tf_query(sp, units):
+    # the clause graph reduced by the units, recomputed from scratch
+    n_vars = sp.n_vars()
+    units  = set([lit.vidx(n_vars) for lit in units])
+    idxs   = []
+    for c_idx, clause in enumerate(sp.clauses()):
+        if any([lit.vidx(n_vars) in units for lit in clause]): continue
+        lits = [lit.vidx(n_vars) for lit in clause if lit.flip().vidx(n_vars) not in units]
+        if len(lits) > 1: idxs.extend([[vidx, c_idx] for vidx in lits])
+    return np.array(idxs, dtype=np.int32).reshape(-1, 2)
+
+def reference_propagate(sp, units):
+    # naive unit propagation over lit vidxs, returns None on a conflict
+    n_vars   = sp.n_vars()
+    assigned = set([lit.vidx(n_vars) for lit in units])
+    flip     = lambda vidx: vidx + n_vars if vidx < n_vars else vidx - n_vars
+    changed  = True
+    while changed:
+        changed = False
+        if any([flip(vidx) in assigned for vidx in assigned]): return None
+        for clause in sp.clauses():
+            vidxs = [lit.vidx(n_vars) for lit in clause]
+            if any([vidx in assigned for vidx in vidxs]): continue
+            left = [vidx for vidx in vidxs if flip(vidx) not in assigned]
+            if not left: return None
+            if len(set(left)) == 1 and len(left) == 1:
+                assigned.add(left[0])
+                changed = True
+    return assigned
+
+def check_incremental_to_tf_query(seed):
+    sp     = random_sat_problem(n_vars=40, n_clauses=150, k=3, seed=seed)
+    s      = Z3Solver(sp, opts(max_conflicts=0))
+    r      = random.Random(seed)
+    n_vars = sp.n_vars()
+    scopes = [[]]
+    for _ in range(30):
+        op = r.choice(["push", "add", "add", "pop"])
+        if op == "push":
+            s.push()
+            scopes.append([])
+        elif op == "pop" and len(scopes) > 1:
+            s.pop()
+            scopes.pop()
+        elif op == "add":
+            lit = Lit(Var(r.randrange(n_vars)), r.random() < 0.5)
+            s.add([lit])
+            scopes[-1].append(lit)
+
+        # the units z3 fixes in propagate join the lits of the innermost scope
+        if r.random() < 0.5:
+            s.propagate()
+            scopes[-1].extend(s.units())
+        assigned = reference_propagate(sp, [lit for scope in scopes for lit in scope])
+        tfq      = s.to_tf_query()
+        if assigned is None:
+            assert_equals(tfq.fvars, [])
+            assert_equals(tfq.LC_idxs.shape, (0, 2))
+            continue
+        units = [Lit(Var(vidx % n_vars), vidx >= n_vars) for vidx in assigned]
+        occurs = set([lit.var().idx() for clause in sp.clauses() for lit in clause])
+        assert_true((tfq.LC_idxs == reference_tf_query(sp, units)).all())
+        assert_equals(tfq.fvars, [v for v in sorted(occurs) if v not in assigned and v + n_vars not in assigned])
+
+def test_incremental_to_tf_query():
+    for seed in range(10):
+        yield check_incremental_to_tf_query, seed
+
+def check_to_tf_query_after_check(seed):
+    # z3 fixes units of its own by conflict analysis, which the graph has to drop as well
+    sp     = random_sat_problem(n_vars=150, n_clauses=640, k=3, seed=seed)
+    s      = Z3Solver(sp, Z3Options(max_conflicts=100, sat_restart_max=5))
+    r      = random.Random(seed)
+    n_vars = sp.n_vars()
+    added  = []
+    for _ in range(8):
+        lit = Lit(Var(r.randrange(n_vars)), r.random() < 0.5)
+        s.add([lit])
+        added.append(lit)
+        if s.check() != Z3Status.unknown: break
+        assigned = reference_propagate(sp, added + s.units())
+        tfq      = s.to_tf_query()
+        units    = [Lit(Var(vidx % n_vars), vidx >= n_vars) for vidx in assigned]
+        occurs   = set([lit.var().idx() for clause in sp.clauses() for lit in clause])
+        assert_true((tfq.LC_idxs == reference_tf_query(sp, units)).all())
+        assert_equals(tfq.fvars, [v for v in sorted(occurs) if v not in assigned and v + n_vars not in assigned])
+
+def test_to_tf_query_after_check():
+    for seed in range(20):
+        yield check_to_tf_query_after_check, seed
+
+def check_to_tf_queries(seed):
+    sp = random_sat_problem(n_vars=40, n_clauses=150, k=3, seed=seed)
+    s  = Z3Solver(sp, opts(max_conflicts=0))
+    r  = random.Random(seed)
+    added = [Lit(Var(r.randrange(sp.n_vars())), r.random() < 0.5)]
+    s.add(added)
+    if reference_propagate(sp, added) is None: return
+
+    n_vars  = sp.n_vars()
+    parent  = s.to_tf_query()
+    sets    = [[Lit(Var(r.randrange(n_vars)), r.random() < 0.5) for _ in range(r.randint(1, 3))] for _ in range(12)]
+    tfqs    = s.to_tf_queries(sets)
+    for n_threads in [2, 4]:
+        for tfq, tfq_t in zip(tfqs, s.to_tf_queries(sets, n_threads=n_threads)):
+            assert_equals(tfq.fvars, tfq_t.fvars)
+            assert_true((tfq.LC_idxs == tfq_t.LC_idxs).all())
+
+    for assumptions, tfq in zip(sets, tfqs):
+        assigned = reference_propagate(sp, added + assumptions)
+        if assigned is None:
+            assert_equals(tfq.fvars, [])
+            assert_equals(tfq.LC_idxs.shape, (0, 2))
+            continue
+        units = [Lit(Var(vidx % n_vars), vidx >= n_vars) for vidx in assigned]
+        assert_true((tfq.LC_idxs == reference_tf_query(sp, units)).all())
+        assert_equals(tfq.fvars, [v for v in parent.fvars if v not in assigned and v + n_vars not in assigned])
+
+    # the parent query is unaffected by the children
+    assert_true((s.to_tf_query().LC_idxs == parent.LC_idxs).all())
+    assert_true((s.to_tf_query(assumptions=sets[0]).LC_idxs == tfqs[0].LC_idxs).all())
+
+    batch    = s.to_tf_queries_packed(sets, n_threads=2)
+    n_graphs = len(sets)
+    expected = []
+    for g, tfq in enumerate(tfqs):
+        for vidx, c_idx in tfq.LC_idxs:
+            expected.append([vidx + g * n_vars if vidx < n_vars else vidx - n_vars + (n_graphs + g) * n_vars, c_idx + g * sp.n_clauses()])
+    assert_equals(batch.fvars, [tfq.fvars for tfq in tfqs])
+    assert_true((batch.LC_idxs == np.array(expected, dtype=np.int32).reshape(-1, 2)).all())
+
+def test_to_tf_queries():
+    for seed in range(10):
+        yield check_to_tf_queries, seed
+
+def test_episode_reset_with_scopes():
+    # the solver pools of the actors reset solvers to the root with a push scope per episode
+    sp   = random_sat_problem(n_vars=40, n_clauses=150, k=3, seed=0)
+    s    = Z3Solver(sp, opts(max_conflicts=0))
+    s.propagate()
+    root = s.to_tf_query()
+    for episode in range(3):
+        s.push()
+        s.add([Lit(Var(root.fvars[episode]), False)])
+        s.propagate()
+        assert_true(np.shape(s.to_tf_query().LC_idxs)[0] < np.shape(root.LC_idxs)[0])
+        s.pop()
+        s.propagate()
+        tfq = s.to_tf_query()
+        assert_equals(tfq.fvars, root.fvars)
+        assert_true((tfq.LC_idxs == root.LC_idxs).all())
+
+def test_conflicts():
+    sp = random_sat_problem(n_vars=60, n_clauses=255, k=3, seed=0)
+    s  = Z3Solver(sp, Z3Options(max_conflicts=50, sat_restart_max=5))
+    assert_equals(s.conflicts(), 0)
+    s.check()
+    n_conflicts = s.conflicts()
+    assert_true(n_conflicts > 0)
+    s.check()
+    assert_true(s.conflicts() >= n_conflicts)